@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class WatermelonAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'watermelon_app'
+
+    def ready(self):
+        from . import registry
+        from .serializers import ProjectSerializer, TaskSerializer
+        registry.register('projects', self.get_model('Project'), ProjectSerializer)
+        registry.register('tasks', self.get_model('Task'), TaskSerializer)
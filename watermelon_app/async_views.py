@@ -0,0 +1,118 @@
+# myapp/async_views.py
+"""
+Native async variants of the sync endpoints, for ASGI deployments.
+
+Under ASGI a synchronous view holds a thread of the sync-to-async pool for the
+whole request, streamed body included, which caps how many slow mobile clients
+one worker can serve. An ``AsyncSyncEndpoint`` mirrors a DRF sync view instead:
+authentication, permissions, throttling, rendering and compression are the DRF
+view's own, run once per request, and incremental pulls (``last_pulled_at``,
+streamed or not) are read through the async ORM, so a connection waiting on the
+network or the database holds no thread at all.
+
+Everything else is handed to the DRF view in a worker thread: pushes, because
+the async ORM runs no transactions, and the other pull modes (sequence, journal,
+paginated, turbo, first sync and schema migrations), which read little per
+request or are answered from snapshots.
+"""
+from asgiref.sync import sync_to_async
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+
+from . import replica
+from .compaction import expired_response
+from .conditional import precondition
+from .pull import apull_changes, astreaming_response
+from .schema import pending_migration
+
+# Parameters of the pull modes left to the synchronous view, as are pulls carrying a schema migration
+SYNC_PULL_PARAMS = ('last_seq', 'journal_seq', 'limit', 'turbo')
+
+
+class AsyncSyncEndpoint(View):
+    """
+    Async view serving the endpoint of the DRF view ``sync_view``, whose
+    ``sync_tables`` and request policies it reuses.
+    """
+    sync_view = None
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        # As with APIView, CSRF is enforced by DRF's session authentication only
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    @staticmethod
+    def pulls_async(query_params):
+        """Whether a pull with ``query_params`` is read through the async ORM."""
+        if not query_params.get('last_pulled_at') or pending_migration(query_params) is not None:
+            return False
+        return not any(name in query_params for name in SYNC_PULL_PARAMS)
+
+    def _initial(self, request, *args, **kwargs):
+        """
+        Run DRF's request setup of ``sync_view``.
+
+        Returns:
+            tuple: The DRF view, its ``Request`` and the error response to answer
+            with, or ``None`` when the request may proceed.
+        """
+        view = self.sync_view()
+        view.args, view.kwargs = args, kwargs
+        drf_request = view.initialize_request(request, *args, **kwargs)
+        view.request = drf_request
+        view.headers = view.default_response_headers
+        try:
+            view.initial(drf_request, *args, **kwargs)
+        except Exception as exc:
+            return view, drf_request, view.handle_exception(exc)
+        return view, drf_request, None
+
+    @staticmethod
+    def _handle(view, request, handler):
+        try:
+            return handler(request)
+        except Exception as exc:
+            return view.handle_exception(exc)
+
+    @staticmethod
+    def _precondition(view, request):
+        not_modified, etag = precondition(view, request)
+        if not_modified is None:
+            not_modified = expired_response(request.query_params)
+        return not_modified, etag
+
+    async def _pull(self, view, request):
+        response, etag = await sync_to_async(self._precondition)(view, request)
+        if response is not None:
+            return response
+        tables = self.sync_view.sync_tables
+        try:
+            if request.query_params.get('stream'):
+                response = astreaming_response(tables, request.query_params, request.user)
+            else:
+                response = Response(await apull_changes(tables, request.query_params, request.user))
+        except ValidationError as e:
+            return Response({'errors': e.detail}, status=status.HTTP_400_BAD_REQUEST)
+        if etag is not None:
+            response['ETag'] = etag
+        return response
+
+    async def get(self, request, *args, **kwargs):
+        view, drf_request, response = await sync_to_async(self._initial)(request, *args, **kwargs)
+        if response is None:
+            if self.pulls_async(drf_request.query_params):
+                target = await sync_to_async(replica.choose)(drf_request)
+                with replica.reading(target):
+                    response = replica.bind(await self._pull(view, drf_request), target)
+            else:
+                response = await sync_to_async(self._handle)(view, drf_request, view.get)
+        return view.finalize_response(drf_request, response, *args, **kwargs)
+
+    async def post(self, request, *args, **kwargs):
+        view, drf_request, response = await sync_to_async(self._initial)(request, *args, **kwargs)
+        if response is None:
+            response = await sync_to_async(self._handle)(view, drf_request, view.post)
+        return view.finalize_response(drf_request, response, *args, **kwargs)
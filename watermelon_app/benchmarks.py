@@ -0,0 +1,499 @@
+# myapp/benchmarks.py
+"""
+Benchmark scenarios for the sync endpoints, run with ``manage.py benchmark_sync``.
+
+Each scenario seeds its own rows inside a transaction that is rolled back
+afterwards, so it can be pointed at any database without leaving data behind.
+"""
+import asyncio
+import tempfile
+import threading
+import time
+import tracemalloc
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.test import AsyncClient, Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from . import push, subscriptions
+from .compression import COMPRESSORS
+from .models import Project, Task
+from .records import encoder_for
+from .renderers import SyncJSONRenderer, dumps
+from .serializers import TaskSerializer
+from .snapshots import build_snapshot
+from .views import SyncView
+
+
+class Rollback(Exception):
+    """Raised to discard everything a scenario wrote."""
+
+
+def bench_user():
+    """Create the user every request of a scenario is authenticated as."""
+    return get_user_model().objects.create(username=f'bench-{uuid.uuid4().hex}')
+
+
+def authenticated(request, user):
+    force_authenticate(request, user=user)
+    return request
+
+
+def seed(count, owner):
+    """Insert ``count`` live projects of ``owner``, each with one task, and return both lists."""
+    projects = Project.objects.bulk_create(Project(name=f'Project {i}', owner=owner) for i in range(count))
+    tasks = Task.objects.bulk_create(
+        Task(title=f'Task {i}', project=project, owner=owner) for i, project in enumerate(projects)
+    )
+    # Bulk inserts send no signals; subscribe the owner from the journal
+    subscriptions.process()
+    return projects, tasks
+
+
+def push_payload(count, projects, tasks):
+    """Build a push touching ``count`` records per table and operation."""
+    new_projects = [{'id': str(uuid.uuid4()), 'name': f'New project {i}'} for i in range(count)]
+    new_tasks = [
+        {'id': str(uuid.uuid4()), 'title': f'New task {i}', 'project': project['id']}
+        for i, project in enumerate(new_projects)
+    ]
+    for project, task in zip(new_projects, new_tasks):
+        project['lead_task'] = task['id']
+    return {
+        'changes': {
+            'projects': {
+                'created': new_projects,
+                'updated': [{'id': str(p.id), 'name': f'{p.name} (edited)'} for p in projects[:count]],
+                'deleted': [str(p.id) for p in projects[count:2 * count]],
+            },
+            'tasks': {
+                'created': new_tasks,
+                'updated': [{'id': str(t.id), 'title': f'{t.title} (edited)'} for t in tasks[:count]],
+                'deleted': [str(t.id) for t in tasks[count:2 * count]],
+            },
+        }
+    }
+
+
+def timed(func):
+    """Run ``func`` and return its result and wall time in ms."""
+    started = time.perf_counter()
+    result = func()
+    return result, round((time.perf_counter() - started) * 1000, 1)
+
+
+def measure(func):
+    """
+    Run ``func`` and return its result, wall time in ms and peak traced memory in MiB.
+    Tracing slows Python code down noticeably, so compare these times only with each other.
+    """
+    tracemalloc.start()
+    try:
+        started = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return result, round(elapsed * 1000, 1), round(peak / 2 ** 20, 1)
+
+
+def bench_push(sizes=(10, 100, 1000)):
+    """
+    Count the SQL statements and time taken by one ``SyncView.post`` per size.
+
+    Yields:
+        dict: One result row per size.
+    """
+    view = SyncView.as_view()
+    factory = APIRequestFactory()
+    for size in sizes:
+        try:
+            with transaction.atomic():
+                user = bench_user()
+                projects, tasks = seed(2 * size, user)
+                request = factory.post('/sync/', push_payload(size, projects, tasks), format='json')
+                authenticated(request, user)
+                with CaptureQueriesContext(connection) as queries:
+                    started = time.perf_counter()
+                    response = view(request)
+                    elapsed = time.perf_counter() - started
+                raise Rollback
+        except Rollback:
+            pass
+        yield {
+            'records': size * 6,
+            'status': response.status_code,
+            'statements': len(queries),
+            'ms': round(elapsed * 1000, 1),
+        }
+
+
+def bench_pull_memory(sizes=(10000, 100000, 1000000)):
+    """
+    Compare peak memory of a buffered pull against a streamed one.
+
+    Yields:
+        dict: One result row per mode and size, where size is the number of changed rows.
+    """
+    view = SyncView.as_view()
+    factory = APIRequestFactory()
+    # A zero last_pulled_at pulls every row through the live path rather than the snapshot
+    modes = {
+        'buffered': lambda user: len(
+            view(authenticated(factory.get('/sync/', {'last_pulled_at': 0}), user)).render().content
+        ),
+        'streamed': lambda user: sum(
+            len(c) for c in view(
+                authenticated(factory.get('/sync/', {'last_pulled_at': 0, 'stream': 1}), user)
+            ).streaming_content
+        ),
+    }
+    for size in sizes:
+        try:
+            with transaction.atomic():
+                user = bench_user()
+                seed(size // 2, user)
+                for mode, pull in modes.items():
+                    length, ms, peak = measure(lambda: pull(user))
+                    yield {'rows': size, 'mode': mode, 'bytes': length, 'ms': ms, 'peak_mib': peak}
+                raise Rollback
+        except Rollback:
+            pass
+
+
+def bench_encode(sizes=(1000, 10000, 100000)):
+    """
+    Time encoding pulled tasks to JSON through the DRF serializer and through
+    the ``values_list`` record encoder, and check both bodies are identical.
+
+    Yields:
+        dict: One result row per path and size.
+    """
+    for size in sizes:
+        try:
+            with transaction.atomic():
+                seed(size, bench_user())
+                queryset = Task.objects.all()
+                paths = {
+                    'serializer': lambda: dumps(TaskSerializer(queryset, many=True).data),
+                    'encoder': lambda: dumps(encoder_for(TaskSerializer).records(queryset)),
+                }
+                bodies = {}
+                for path, encode in paths.items():
+                    bodies[path], ms = timed(encode)
+                    yield {'rows': size, 'path': path, 'ms': ms}
+                assert bodies['serializer'] == bodies['encoder'], 'encoder output differs from the serializer'
+                raise Rollback
+        except Rollback:
+            pass
+
+
+def validate_payload(count, projects):
+    """Build ``count`` created tasks pointing at ``projects``, every fiftieth one invalid."""
+    items = []
+    for i in range(count):
+        item = {'id': str(uuid.uuid4()), 'title': f'Task {i}', 'project': str(projects[i % len(projects)].id)}
+        if i % 100 == 3:
+            item['title'] = 'x' * 201
+        elif i % 100 == 53:
+            item['project'] = str(uuid.uuid4())
+        items.append(item)
+    return items
+
+
+def bench_validate(sizes=(1000, 10000, 100000)):
+    """
+    Time validating pushed tasks record by record through the DRF serializer and
+    through the compiled column checks of ``push.validate_batch``, and check both
+    return the same validated data and error messages. Both start from a serializer
+    built by ``push.prepare_serializer``, whose lookups are not timed.
+
+    Yields:
+        dict: One result row per path and size.
+    """
+    for size in sizes:
+        try:
+            with transaction.atomic():
+                user = bench_user()
+                projects, _ = seed(100, user)
+                items = validate_payload(size, projects)
+
+                def serializer_path(serializer):
+                    results = []
+                    for item in items:
+                        try:
+                            results.append((serializer.run_validation(item), None))
+                        except ValidationError as e:
+                            results.append((None, e.detail))
+                    return results
+
+                def compiled_path(serializer):
+                    return [
+                        (data, None if error is None else error.detail)
+                        for _, data, error in push.validate_batch(serializer, items)
+                    ]
+
+                paths = {'serializer': serializer_path, 'compiled': compiled_path}
+                results = {}
+                for path, validate in paths.items():
+                    # Both paths share the batched lookups, which are left out of the timing
+                    serializer = push.prepare_serializer(TaskSerializer, items, owner=user)
+                    results[path], ms = timed(lambda: validate(serializer))
+                    invalid = sum(1 for _, error in results[path] if error is not None)
+                    yield {'records': size, 'path': path, 'invalid': invalid, 'ms': ms}
+                assert results['serializer'] == results['compiled'], 'compiled validation differs from the serializer'
+                raise Rollback
+        except Rollback:
+            pass
+
+
+def bench_render(sizes=(1000, 10000, 100000)):
+    """
+    Time rendering a pull payload of ``size`` tasks with DRF's ``JSONRenderer``
+    and with ``SyncJSONRenderer``.
+
+    Yields:
+        dict: One result row per renderer and size.
+    """
+    for size in sizes:
+        try:
+            with transaction.atomic():
+                seed(size, bench_user())
+                records = encoder_for(TaskSerializer).records(Task.objects.all())
+                payload = {'changes': {'tasks': {'created': records, 'updated': [], 'deleted': []}}, 'timestamp': 0}
+                for renderer in (JSONRenderer(), SyncJSONRenderer()):
+                    body, ms = timed(lambda: renderer.render(payload))
+                    yield {'rows': size, 'renderer': type(renderer).__name__, 'bytes': len(body), 'ms': ms}
+                raise Rollback
+        except Rollback:
+            pass
+
+
+def bench_first_sync(sizes=(1000, 10000, 100000), requests=20):
+    """
+    Compare first-sync throughput of the live path against the snapshot file,
+    for a client accepting gzip and for one that does not.
+
+    Yields:
+        dict: One result row per path and size, with the bytes sent per request.
+    """
+    view = SyncView.as_view()
+    factory = APIRequestFactory()
+
+    def live(user):
+        return len(view(authenticated(factory.get('/sync/', {'last_pulled_at': 0}), user)).render().content)
+
+    def snapshot(user, accept_encoding):
+        response = view(authenticated(factory.get('/sync/', HTTP_ACCEPT_ENCODING=accept_encoding), user))
+        length = sum(len(chunk) for chunk in response.streaming_content)
+        # Closing the response itself would fire request_finished and drop the connection
+        if getattr(response, 'file_to_stream', None) is not None:
+            response.file_to_stream.close()
+        return length
+
+    paths = {
+        'live': live,
+        'snapshot-gzip': lambda user: snapshot(user, 'gzip, deflate'),
+        'snapshot-identity': lambda user: snapshot(user, 'identity'),
+    }
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as directory, override_settings(SYNC_SNAPSHOT_DIR=directory):
+            try:
+                with transaction.atomic():
+                    user = bench_user()
+                    seed(size // 2, user)
+                    _, build_ms = timed(lambda: build_snapshot(SyncView.sync_tables, owner=user))
+                    yield {'rows': size, 'path': 'build', 'ms': build_ms}
+                    for path, pull in paths.items():
+                        length, ms = timed(lambda: [pull(user) for _ in range(requests)][-1])
+                        yield {'rows': size, 'path': path, 'bytes': length, 'req_per_s': round(requests * 1000 / ms, 1)}
+                    raise Rollback
+            except Rollback:
+                pass
+
+
+def bench_compression(sizes=(1000, 10000, 100000), levels=(1, 6, 9)):
+    """
+    Measure size and CPU time of compressing a pull body of ``size`` changed rows
+    with every available content coding and a few levels.
+
+    Yields:
+        dict: One result row per coding, level and size.
+    """
+    view = SyncView.as_view()
+    factory = APIRequestFactory()
+    for size in sizes:
+        try:
+            with transaction.atomic():
+                user = bench_user()
+                seed(size // 2, user)
+                body = view(authenticated(factory.get('/sync/', {'last_pulled_at': 0}), user)).render().content
+                for coding, factory_for_level in COMPRESSORS.items():
+                    for level in levels:
+                        compressor = factory_for_level(level)
+                        started = time.thread_time()
+                        compressed = compressor.compress(body) + compressor.flush()
+                        cpu_ms = round((time.thread_time() - started) * 1000, 1)
+                        yield {
+                            'rows': size, 'coding': coding, 'level': level, 'bytes_in': len(body),
+                            'bytes_out': len(compressed), 'cpu_ms': cpu_ms,
+                        }
+                raise Rollback
+        except Rollback:
+            pass
+
+
+def bench_poll(sizes=(1000,), requests=2000):
+    """
+    Compare the throughput of no-change polls answered from the database marks
+    with polls answered from the shared watermark registry.
+
+    Yields:
+        dict: One result row per mode and size, with the SQL statements per poll.
+    """
+    view = SyncView.as_view()
+    factory = APIRequestFactory()
+    params = {'last_pulled_at': 1}
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            modes = {'database': None, 'registry': f'{directory}/watermarks.bin'}
+            try:
+                with transaction.atomic():
+                    user = bench_user()
+                    seed(size, user)
+                    for mode, path in modes.items():
+                        with override_settings(SYNC_WATERMARK_PATH=path):
+                            etag = view(authenticated(factory.get('/sync/', params), user)).render()['ETag']
+                            poll = authenticated(factory.get('/sync/', params, HTTP_IF_NONE_MATCH=etag), user)
+                            with CaptureQueriesContext(connection) as queries:
+                                statuses, ms = timed(lambda: {view(poll).status_code for _ in range(requests)})
+                        yield {
+                            'rows': size, 'mode': mode, 'status': '/'.join(map(str, statuses)),
+                            'statements_per_poll': round(len(queries) / requests, 2),
+                            'req_per_s': round(requests * 1000 / ms),
+                        }
+                    raise Rollback
+            except Rollback:
+                pass
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * fraction))] * 1000, 1)
+
+
+class _PeakThreads(threading.Thread):
+    """Sample the number of live threads until stopped, keeping the highest."""
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.peak = threading.active_count()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(0.005):
+            self.peak = max(self.peak, threading.active_count())
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.join()
+
+
+def bench_concurrency(sizes=(10, 100, 200), rows=200, threads=8, delay=0.02):
+    """
+    Compare how many slow clients the sync endpoint serves at once under WSGI
+    and under ASGI.
+
+    Each of ``size`` concurrent clients makes a streamed incremental pull of
+    ``rows`` projects and tasks, reading each chunk of the body ``delay`` seconds
+    apart like a phone on a slow link. Under WSGI, ``SyncView`` runs on a pool of
+    ``threads`` workers, as with ``gunicorn --threads``, and a client holds its
+    worker until it has read the whole body. Under ASGI, ``AsyncSyncView`` serves
+    every client from one event loop. Requests go through Django's own handlers,
+    middleware and session authentication included.
+
+    Unlike the other scenarios, the rows are committed, since every WSGI worker
+    reads through its own connection, and deleted afterwards.
+
+    Yields:
+        dict: One result row per server and size, with the time to first byte
+        counted from when every client connected, and the peak number of live threads.
+    """
+    params = {'last_pulled_at': 1, 'stream': 1}
+    user = bench_user()
+    try:
+        seed(rows, user)
+        login = Client()
+        login.force_login(user)
+        workers = threading.local()
+
+        def wsgi_pull(started):
+            if not hasattr(workers, 'client'):
+                workers.client = Client()
+                workers.client.cookies = login.cookies
+            response = workers.client.get('/sync/', params)
+            first_byte = None
+            for _ in response.streaming_content:
+                first_byte = first_byte or time.perf_counter() - started
+                time.sleep(delay)
+            return first_byte
+
+        async def asgi_pull(client, started):
+            response = await client.get('/sync/async/', params)
+            first_byte = None
+            async for _ in response.streaming_content:
+                first_byte = first_byte or time.perf_counter() - started
+                await asyncio.sleep(delay)
+            return first_byte
+
+        async def asgi_pulls(size):
+            client = AsyncClient()
+            client.cookies = login.cookies
+            started = time.perf_counter()
+            return await asyncio.gather(*(asgi_pull(client, started) for _ in range(size)))
+
+        def wsgi_pulls(size):
+            started = time.perf_counter()
+            with ThreadPoolExecutor(threads) as pool:
+                return list(pool.map(wsgi_pull, [started] * size))
+
+        servers = {'wsgi': wsgi_pulls, 'asgi': async_to_sync(asgi_pulls)}
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            for size in sizes:
+                for server, pulls in servers.items():
+                    with _PeakThreads() as peak:
+                        first_bytes, ms = timed(lambda: pulls(size))
+                    yield {
+                        'clients': size, 'server': server, 'ms': ms,
+                        'clients_per_s': round(size * 1000 / ms, 1),
+                        'ttfb_p50_ms': _percentile(first_bytes, 0.5), 'ttfb_p95_ms': _percentile(first_bytes, 0.95),
+                        'peak_threads': peak.peak,
+                    }
+    finally:
+        user.delete()
+
+
+SCENARIOS = {
+    'push': bench_push,
+    'pull-memory': bench_pull_memory,
+    'encode': bench_encode,
+    'validate': bench_validate,
+    'render': bench_render,
+    'first-sync': bench_first_sync,
+    'compression': bench_compression,
+    'poll': bench_poll,
+    'concurrency': bench_concurrency,
+}
@@ -0,0 +1,222 @@
+# myapp/compaction.py
+"""
+Tombstone compaction and the oldest pull cursors it leaves supported.
+
+Soft-deleted rows are kept so that pulls can report their deletion, but every
+client has pulled them after a while. ``compact()`` hard-deletes the tombstones
+older than ``SYNC_TOMBSTONE_HORIZON`` seconds in batches of
+``SYNC_COMPACTION_BATCH_SIZE``, each in its own short transaction, appending
+them first to ``<SYNC_TOMBSTONE_ARCHIVE_DIR>/<db_table>.jsonl.gz`` when the
+setting is not ``None``. Subscriptions left before the horizon go the same way.
+Tombstones whose deletion would cascade to a live or more recent row are kept
+until that row is compacted in turn.
+
+Each batch moves ``CompactionState`` to the latest ``deleted_at`` and
+``server_seq`` it removed. A timestamp or sequence pull whose cursor is behind
+them could miss a deletion, so ``supported_cursor`` answers it with
+``410 Gone`` and ``reset`` set, telling the client to reset its database and
+pull from scratch. Journal pulls are unaffected: a hard delete is journaled
+like any other, and reported as a deletion.
+"""
+import datetime
+import functools
+import gzip
+import json
+from pathlib import Path
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, models, transaction
+from django.db.models import Max, Q
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+
+from . import subscriptions, watermarks
+from .models import CompactionState, Subscription
+from .pull import decode_cursor, parse_last_pulled_at, parse_last_seq
+
+_compacted_models = []
+
+
+def register(*models):
+    """Compact the tombstones of ``models``."""
+    for model in models:
+        if model not in _compacted_models:
+            _compacted_models.append(model)
+
+
+def oldest_supported():
+    """
+    Returns:
+        tuple: The oldest ``last_pulled_at`` datetime (``None`` before any
+        compaction) and ``last_seq`` still answered completely.
+    """
+    state = CompactionState.objects.filter(pk=1).values_list('oldest_pulled_at', 'oldest_seq').first()
+    return state or (None, 0)
+
+
+def _advance(oldest_pulled_at, oldest_seq):
+    """Move the supported cursors forward, never back. Called inside the batch transaction."""
+    state, _ = CompactionState.objects.select_for_update().get_or_create(pk=1)
+    if oldest_pulled_at is not None and (state.oldest_pulled_at is None or oldest_pulled_at > state.oldest_pulled_at):
+        state.oldest_pulled_at = oldest_pulled_at
+    state.oldest_seq = max(state.oldest_seq, oldest_seq or 0)
+    state.save()
+
+
+def _archive(directory, model, queryset):
+    path = Path(directory) / f'{model._meta.db_table}.jsonl.gz'
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Every batch appends a gzip member; readers see one stream of lines
+    with gzip.open(path, 'at', encoding='utf-8') as archive:
+        for row in queryset.values().iterator():
+            archive.write(json.dumps(row, cls=DjangoJSONEncoder) + '\n')
+
+
+def _cascades(model):
+    """Relations to the rows of compacted models deleted along with a row of ``model``."""
+    return [
+        relation
+        for relation in model._meta.related_objects
+        if relation.on_delete is models.CASCADE and relation.related_model in _compacted_models
+    ]
+
+
+def tombstones(model, cutoff):
+    """
+    Tombstones of ``model`` deleted before ``cutoff`` whose removal takes no other
+    row with it but tombstones older than ``cutoff``.
+    """
+    queryset = model._default_manager.filter(deleted_at__lt=cutoff)
+    for relation in _cascades(model):
+        fk = relation.field.name
+        kept = relation.related_model._default_manager.filter(
+            Q(deleted_at__isnull=True) | Q(deleted_at__gte=cutoff), **{f'{fk}__isnull': False}
+        )
+        queryset = queryset.exclude(pk__in=kept.values(fk))
+    return queryset
+
+
+def compact_model(model, cutoff, batch_size, archive_dir=None):
+    """
+    Hard-delete the tombstones of ``model`` older than ``cutoff`` in batches.
+
+    Returns:
+        int: The number of tombstones deleted.
+    """
+    removed = 0
+    while True:
+        with transaction.atomic():
+            pks = list(tombstones(model, cutoff).order_by('deleted_at').values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                return removed
+            batch = model._default_manager.filter(pk__in=pks)
+            if archive_dir is not None:
+                _archive(archive_dir, model, batch)
+            _advance(**batch.aggregate(oldest_pulled_at=Max('deleted_at'), oldest_seq=Max('server_seq')))
+            # Deleting through the ORM sends the signals that keep subscriptions and watermarks current
+            batch.delete()
+            removed += len(pks)
+
+
+def compact_subscriptions(cutoff, batch_size):
+    """
+    Delete the subscriptions left before ``cutoff`` in batches.
+
+    Returns:
+        int: The number of subscriptions deleted.
+    """
+    removed = 0
+    while True:
+        with transaction.atomic():
+            left = Subscription.objects.filter(left=True, changed_at__lt=cutoff).order_by('changed_at')
+            pks = list(left.values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                return removed
+            batch = Subscription.objects.filter(pk__in=pks)
+            _advance(**batch.aggregate(oldest_pulled_at=Max('changed_at'), oldest_seq=Max('changed_seq')))
+            batch.delete()
+            removed += len(pks)
+
+
+def compact(horizon=None, batch_size=None, archive_dir=None):
+    """
+    Remove the tombstones and left subscriptions older than ``horizon``.
+
+    Args:
+        horizon (int, optional): Age in seconds, ``SYNC_TOMBSTONE_HORIZON`` by default.
+        batch_size (int, optional): Rows per transaction, ``SYNC_COMPACTION_BATCH_SIZE`` by default.
+        archive_dir (str, optional): Directory the tombstones are appended to before
+            being deleted, ``SYNC_TOMBSTONE_ARCHIVE_DIR`` by default.
+
+    Returns:
+        dict: The number of rows deleted, by ``db_table``.
+    """
+    horizon = settings.SYNC_TOMBSTONE_HORIZON if horizon is None else horizon
+    batch_size = min(batch_size or settings.SYNC_COMPACTION_BATCH_SIZE, connection.features.max_query_params)
+    archive_dir = settings.SYNC_TOMBSTONE_ARCHIVE_DIR if archive_dir is None else archive_dir
+    cutoff = timezone.now() - datetime.timedelta(seconds=horizon)
+
+    removed = {}
+    # Children first, so that the tombstones a parent cascades to have moved the supported cursors
+    for model in reversed(_compacted_models):
+        removed[model._meta.db_table] = compact_model(model, cutoff, batch_size, archive_dir)
+    # Hard deletes leave the subscriptions to those records, which are then compacted too
+    subscriptions.process()
+    removed[Subscription._meta.db_table] = compact_subscriptions(cutoff, batch_size)
+    watermarks.touch()
+    return removed
+
+
+def cursor_expired(query_params):
+    """
+    Whether the cursor of a pull is older than the oldest one still supported.
+    Malformed cursors are left for the pull itself to reject.
+    """
+    try:
+        # A zero cursor asks for everything, which is always complete
+        if query_params.get('last_seq'):
+            last_seq = parse_last_seq(query_params['last_seq'])
+            return 0 < last_seq < oldest_supported()[1]
+        if query_params.get('cursor'):
+            since = decode_cursor(query_params['cursor']).get('since')
+        else:
+            since = query_params.get('last_pulled_at')
+        if not since or not int(since) or 'journal_seq' in query_params:
+            return False
+        oldest_pulled_at = oldest_supported()[0]
+        return oldest_pulled_at is not None and parse_last_pulled_at(since) < oldest_pulled_at
+    except (ValidationError, TypeError, ValueError, OverflowError):
+        return False
+
+
+def expired_response(query_params):
+    """
+    The ``410 Gone`` response telling a client to resync, when the cursor in
+    ``query_params`` is older than the compacted tombstones, else ``None``.
+    """
+    if not cursor_expired(query_params):
+        return None
+    oldest_pulled_at, oldest_seq = oldest_supported()
+    return Response({
+        'errors': ['The pull cursor is older than the oldest change kept; a full resync is required.'],
+        'reset': True,
+        'oldest_pulled_at': oldest_pulled_at and int(oldest_pulled_at.timestamp() * 1000),
+        'oldest_seq': oldest_seq,
+    }, status=status.HTTP_410_GONE)
+
+
+def supported_cursor(get):
+    """
+    Decorate the ``get`` of a sync view to answer pulls whose cursor is older than
+    the compacted tombstones with ``410 Gone``, telling the client to resync.
+    """
+    @functools.wraps(get)
+    def wrapper(self, request, *args, **kwargs):
+        expired = expired_response(request.query_params)
+        if expired is not None:
+            return expired
+        return get(self, request, *args, **kwargs)
+    return wrapper
@@ -0,0 +1,259 @@
+# myapp/compression.py
+"""
+Response compression for the sync endpoints, negotiated from ``Accept-Encoding``.
+
+gzip and deflate are always available; brotli (``br``) and zstd are offered when
+the ``brotli`` and ``zstandard`` packages are installed. Every codec compresses
+incrementally, so streamed responses are compressed chunk by chunk as they are
+produced and buffered ones once they are rendered.
+
+Each compressed response adds its size before and after compression and the CPU
+time spent to per-endpoint counters, readable with ``metrics()``, and logs them
+at DEBUG level on the ``watermelon_app.compression`` logger.
+"""
+import logging
+import re
+import threading
+import time
+import zlib
+
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# Buffered bodies smaller than this are sent as is; compression would barely shrink them
+MIN_SIZE = 200
+
+# Level of each codec when the view does not set one
+DEFAULT_LEVELS = {'zstd': 3, 'br': 5, 'gzip': 6, 'deflate': 6}
+
+_CODING = re.compile(r'^\s*([\w*-]+)\s*(?:;\s*q\s*=\s*([0-9.]+))?\s*$')
+
+
+class _BrotliCompressor:
+    """Adapter giving ``brotli.Compressor`` the ``compress``/``flush`` interface of zlib."""
+
+    def __init__(self, level):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.finish()
+
+
+def _compressor_factories():
+    """Map each available content coding to a ``level -> compressor`` factory, in server preference order."""
+    factories = {}
+    if zstandard is not None:
+        factories['zstd'] = lambda level: zstandard.ZstdCompressor(level=level).compressobj()
+    if brotli is not None:
+        factories['br'] = _BrotliCompressor
+    factories['gzip'] = lambda level: zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    factories['deflate'] = lambda level: zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS)
+    return factories
+
+
+COMPRESSORS = _compressor_factories()
+
+_metrics = {}
+_metrics_lock = threading.Lock()
+
+
+def _qualities(accept_encoding):
+    """Parse an ``Accept-Encoding`` header to ``{coding: quality}``, skipping malformed entries."""
+    accepted = {}
+    for coding in accept_encoding.split(','):
+        match = _CODING.match(coding)
+        if not match:
+            continue
+        try:
+            quality = float(match[2]) if match[2] else 1.0
+        except ValueError:
+            continue
+        accepted[match[1].lower()] = quality
+    return accepted
+
+
+def accepts(accept_encoding, coding):
+    """Whether an ``Accept-Encoding`` header allows ``coding``."""
+    accepted = _qualities(accept_encoding)
+    return accepted.get(coding, accepted.get('*', 0.0)) > 0
+
+
+def negotiate(accept_encoding):
+    """
+    Pick the content coding to answer with from an ``Accept-Encoding`` header.
+
+    The highest quality value wins and ties go to the server's preference order
+    (zstd, br, gzip, deflate). Codings refused with ``q=0`` are never picked.
+
+    Returns:
+        str: The chosen coding, or ``None`` to send the body uncompressed.
+    """
+    accepted = _qualities(accept_encoding)
+    best, best_quality = None, 0.0
+    for coding in COMPRESSORS:
+        quality = accepted.get(coding, accepted.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    return best
+
+
+def record(endpoint, coding, bytes_in, bytes_out, cpu_seconds):
+    """Add one compressed response to the counters of ``endpoint``."""
+    with _metrics_lock:
+        counters = _metrics.setdefault((endpoint, coding), {
+            'responses': 0, 'bytes_in': 0, 'bytes_out': 0, 'cpu_seconds': 0.0,
+        })
+        counters['responses'] += 1
+        counters['bytes_in'] += bytes_in
+        counters['bytes_out'] += bytes_out
+        counters['cpu_seconds'] += cpu_seconds
+    logger.debug(
+        '%s %s: %d -> %d bytes in %.2f ms CPU', endpoint, coding, bytes_in, bytes_out, cpu_seconds * 1000
+    )
+
+
+def metrics():
+    """Return a copy of the counters, keyed by ``(endpoint, coding)``."""
+    with _metrics_lock:
+        return {key: dict(counters) for key, counters in _metrics.items()}
+
+
+class _StreamCompressor:
+    """Compressor of one stream, timing and sizing every step for ``record()``."""
+
+    def __init__(self, compressor, endpoint, coding):
+        self.compressor, self.endpoint, self.coding = compressor, endpoint, coding
+        self.bytes_in = self.bytes_out = 0
+        self.cpu_seconds = 0.0
+
+    def _step(self, method, *args):
+        started = time.thread_time()
+        data = method(*args)
+        self.cpu_seconds += time.thread_time() - started
+        self.bytes_out += len(data)
+        return data
+
+    def compress(self, chunk):
+        self.bytes_in += len(chunk)
+        return self._step(self.compressor.compress, chunk)
+
+    def flush(self):
+        return self._step(self.compressor.flush)
+
+    def record(self):
+        record(self.endpoint, self.coding, self.bytes_in, self.bytes_out, self.cpu_seconds)
+
+
+def _compress_stream(chunks, compressor, endpoint, coding):
+    """Compress ``chunks`` as they are produced, recording the totals once the stream ends."""
+    stream = _StreamCompressor(compressor, endpoint, coding)
+    try:
+        for chunk in chunks:
+            if data := stream.compress(chunk):
+                yield data
+        yield stream.flush()
+    finally:
+        stream.record()
+
+
+async def _acompress_stream(chunks, compressor, endpoint, coding):
+    """``_compress_stream()`` for the asynchronous content of a streamed response."""
+    stream = _StreamCompressor(compressor, endpoint, coding)
+    try:
+        async for chunk in chunks:
+            if data := stream.compress(chunk):
+                yield data
+        yield stream.flush()
+    finally:
+        stream.record()
+
+
+def _set_encoding_headers(response, coding):
+    # The same representation is now sent with different bytes, as in GZipMiddleware
+    if etag := response.get('ETag'):
+        if etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+    response['Content-Encoding'] = coding
+
+
+def compress_response(request, response, levels=None, endpoint=''):
+    """
+    Compress ``response`` with the coding negotiated for ``request``.
+
+    Streamed responses, synchronous or not, get their content wrapped in an
+    incremental compressor.
+    Responses still to be rendered, like DRF's ``Response``, are compressed from
+    a post-render callback. Responses that already carry a ``Content-Encoding``
+    are returned unchanged.
+
+    Args:
+        request (HttpRequest): Request holding the client's ``Accept-Encoding``.
+        response (HttpResponseBase): Response to compress.
+        levels (dict, optional): Compression level per coding, overriding ``DEFAULT_LEVELS``.
+        endpoint (str, optional): Name the metrics of this response are recorded under.
+
+    Returns:
+        HttpResponseBase: ``response``, with compression applied or scheduled.
+    """
+    patch_vary_headers(response, ('Accept-Encoding',))
+    if response.has_header('Content-Encoding'):
+        return response
+    coding = negotiate(request.headers.get('Accept-Encoding', ''))
+    if coding is None:
+        return response
+    level = {**DEFAULT_LEVELS, **(levels or {})}[coding]
+
+    if response.streaming:
+        compressor = COMPRESSORS[coding](level)
+        compress_stream = _acompress_stream if response.is_async else _compress_stream
+        response.streaming_content = compress_stream(response.streaming_content, compressor, endpoint, coding)
+        del response['Content-Length']
+        _set_encoding_headers(response, coding)
+        return response
+
+    def compress_content(response):
+        content = response.content
+        if len(content) < MIN_SIZE:
+            return
+        started = time.thread_time()
+        compressor = COMPRESSORS[coding](level)
+        compressed = compressor.compress(content) + compressor.flush()
+        cpu_seconds = time.thread_time() - started
+        if len(compressed) >= len(content):
+            return
+        response.content = compressed
+        response['Content-Length'] = str(len(compressed))
+        _set_encoding_headers(response, coding)
+        record(endpoint, coding, len(content), len(compressed), cpu_seconds)
+
+    if getattr(response, 'is_rendered', True):
+        compress_content(response)
+    else:
+        response.add_post_render_callback(compress_content)
+    return response
+
+
+class CompressedResponseMixin:
+    """
+    View mixin compressing every response of the view. Set ``compression_levels``
+    on the view to change the level of any coding for that endpoint.
+    """
+    compression_levels = {}
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        return compress_response(request, response, self.compression_levels, type(self).__name__)
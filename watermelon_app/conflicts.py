@@ -0,0 +1,70 @@
+# myapp/conflicts.py
+"""
+Conflict detection on push.
+
+WatermelonDB expects a push to be rejected when a record it updates or deletes
+changed on the server after the client's last pull. A push naming that pull, by
+``last_pulled_at`` or, for clients pulling by sequence, ``last_seq``, is checked
+before anything is written: one primary-key lookup per table finds which of the
+pushed records were written since, as every write stamps ``updated_at`` and
+``server_seq``. The push is then answered with those IDs only, so the client
+pulls them and pushes again instead of starting a full sync.
+
+Created records are not checked; a created ID that already exists fails its
+uniqueness check like before.
+"""
+from rest_framework.exceptions import ValidationError
+
+from .models import owned_rows
+from .pull import parse_last_pulled_at, parse_last_seq
+from .push import parse_ids
+
+
+def parse_since(query_params):
+    """
+    Lookups matching the rows written after the pull named by a push.
+
+    Returns:
+        dict: Filter keyword arguments, or ``None`` when the push names no pull
+        and is not checked for conflicts.
+
+    Raises:
+        ValidationError: If ``last_pulled_at`` or ``last_seq`` is malformed.
+    """
+    if query_params.get('last_seq'):
+        return {'server_seq__gt': parse_last_seq(query_params['last_seq'])}
+    if query_params.get('last_pulled_at'):
+        return {'updated_at__gt': parse_last_pulled_at(query_params['last_pulled_at'])}
+    return None
+
+
+def find_conflicts(tables, changes, owner, since):
+    """
+    Find the pushed updates and deletions of records written after the client's last pull.
+
+    Args:
+        tables (tuple): ``SyncTable`` of each synced table, in push order.
+        changes (dict): The pushed changes by table name.
+        owner (User): User pushing the changes; only records visible to them are reported.
+        since (dict): Lookups from ``parse_since``.
+
+    Returns:
+        dict: The conflicting IDs, as pushed, by table name; empty when there are none.
+    """
+    conflicts = {}
+    for name, model, _ in tables:
+        table_changes = changes.get(name) or {}
+        pushed = [item.get('id') for item in table_changes.get('updated', []) if isinstance(item, dict)]
+        pushed += table_changes.get('deleted', [])
+        # IDs that cannot be parsed are reported by the push itself
+        pks = parse_ids(model, pushed)[0]
+        if not pks:
+            continue
+        written = set(
+            owned_rows(model, owner).filter(pk__in=set(pks.values()), **since).values_list('pk', flat=True)
+        )
+        ids = [pushed[position] for position, pk in pks.items() if pk in written]
+        if ids:
+            # An updated and deleted record is listed once
+            conflicts[name] = list(dict.fromkeys(ids))
+    return conflicts
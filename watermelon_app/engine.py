@@ -0,0 +1,340 @@
+# myapp/engine.py
+"""
+Generic sync engine driving pulls and pushes of the registered tables.
+
+A sync endpoint is a ``SyncEngineView`` naming the app whose tables it syncs in
+``sync_app``; everything else comes from the registry in ``registry.py``. Every
+pull mode (timestamp, sequence, journal, paginated, streamed, snapshot, turbo and
+schema migrations) and every push step runs through the same set-based helpers
+for every table, so an optimization made to them applies to all synced tables.
+
+A push is applied in phases:
+
+1. Created records are inserted with one ``bulk_create`` per table. With
+   ``SYNC_SINGLE_PASS_PUSH`` on a database that checks foreign keys at commit,
+   every key is written in place, references between records of the push
+   included. Otherwise the inserts follow the dependency order planned by
+   ``planner.py``, without the keys deferred to break a reference cycle...
+2. ...which are then set with one batched fixup per deferred edge, now that
+   every record they may point at exists.
+3. Updates, then soft deletions, are applied table by table in registration order.
+
+Tables whose rows are their own owner, such as users, accept no created records.
+
+A push naming the client's last pull is first checked for conflicts (see
+``conflicts.py``) and rejected as a whole, before any phase, when one of its
+updated or deleted records changed on the server since.
+
+Errors are reported per record with the same messages for every table.
+"""
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
+from django.utils.functional import classproperty
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from . import conflicts, planner, push, registry, subscriptions, watermarks
+from .compaction import supported_cursor
+from .compression import CompressedResponseMixin
+from .conditional import conditional_pull
+from .journal import journal_changes, recording_device
+from .pull import paginated_changes, pull_changes, sequence_changes, streaming_response
+from .renderers import SyncJSONRenderer
+from .replica import pin, read_replica
+from .schema import parse_migration
+from .snapshots import snapshot_response, turbo_response
+
+
+class SyncEngineView(CompressedResponseMixin, APIView):
+    """
+    API view synchronizing the registered tables of ``sync_app`` with WatermelonDB.
+    Supports pulling changes from the server (GET) and pushing changes to the server (POST).
+    Every pull and push only sees the records visible to the requesting user.
+    """
+    permission_classes = [IsAuthenticated]
+    renderer_classes = [SyncJSONRenderer]
+    # Compression level per content coding for this endpoint, over compression.DEFAULT_LEVELS
+    compression_levels = {'gzip': 6, 'deflate': 6}
+    # Label of the app whose registered tables the endpoint syncs
+    sync_app = None
+
+    @classproperty
+    def sync_tables(cls):
+        """``SyncTable`` of each synced table, in pull order."""
+        return registry.tables_of(cls.sync_app)
+
+    @read_replica
+    @conditional_pull
+    @supported_cursor
+    def get(self, request):
+        """
+        Handle GET requests to pull the user's changes since the last synchronization timestamp.
+
+        Args:
+            request: The HTTP request object containing query parameters.
+
+        Query Parameters:
+            last_pulled_at (str): Timestamp in milliseconds since Unix epoch representing the last sync time.
+                When absent, the response is served from the user's first-sync snapshot
+                file when a fresh one exists, and streamed otherwise.
+            limit (str, optional): Maximum number of records per page. When given, changes are
+                returned in pages walked in (updated_at, id) order.
+            cursor (str, optional): Opaque cursor returned by the previous page of a paginated pull.
+            stream (str, optional): When set, the response body is streamed while the
+                changes are read, keeping server memory flat however many rows changed.
+            schemaVersion (str, optional): Schema version of the client, sent with ``migration``.
+            migration (str, optional): JSON object ``{"from": version, ...}`` sent by WatermelonDB
+                after a schema upgrade. The rows and columns added since ``from`` are returned
+                along with the delta. Only buffered, unpaginated pulls carry a migration; it
+                cannot be combined with ``stream``, ``limit``, ``last_seq``, ``journal_seq`` or ``turbo``.
+            turbo (str, optional): When set on a first sync, the body is the pre-encoded payload
+                for WatermelonDB's turbo login, holding only the ``created`` list of each table.
+            last_seq (str, optional): Server sequence value returned as ``timestamp`` by the
+                previous sequence pull (0 for the first one). Replaces ``last_pulled_at`` and
+                pulls every write sequenced after it.
+            journal_seq (str, optional): Change journal position returned as ``timestamp`` by the
+                previous journal pull (0 for the first one). Only the records journaled after it
+                are read, so the cost follows the number of changes.
+
+        Headers:
+            If-None-Match (optional): ETag of the previous pull. When no synced table changed
+                since and the pull is made by the same user in the same mode, the answer is an
+                empty 304 Not Modified.
+
+        Returns:
+            Response: A JSON response containing:
+                - changes: Created, updated and deleted records of each synced table.
+                - timestamp: Current server timestamp in milliseconds, or the server
+                  sequence or journal position reached for sequence and journal pulls.
+                - has_more, cursor: Only for paginated pulls; whether another page follows and
+                  the cursor to request it with.
+            Incremental, unpaginated pulls also carry an ETag header.
+
+        Example Response:
+            {
+                "changes": {
+                    "projects": {
+                        "created": [...],
+                        "updated": [...],
+                        "deleted": [1, 2, 3]
+                    },
+                    "tasks": {
+                        "created": [...],
+                        "updated": [...],
+                        "deleted": [4, 5, 6]
+                    }
+                },
+                "timestamp": 1698771234567
+            }
+        """
+        tables, params, owner = self.sync_tables, request.query_params, request.user
+        try:
+            # Schema migration of an upgraded client, if any
+            migration = parse_migration(params)
+            # Sequence pull, reading every write sequenced after last_seq
+            if 'last_seq' in params:
+                return Response(sequence_changes(tables, params, owner))
+            # Journal pull, reading only the records journaled after journal_seq
+            if 'journal_seq' in params:
+                return Response(journal_changes(tables, params, owner))
+            # Paginated pull, walked in (updated_at, id) order with an opaque cursor
+            if 'limit' in params:
+                return Response(paginated_changes(tables, params, owner))
+            # Turbo first sync: pre-encoded created lists only
+            if params.get('turbo'):
+                if params.get('last_pulled_at'):
+                    raise ValidationError('turbo is only supported for the first sync.')
+                return turbo_response(tables, request, owner)
+            if not params.get('last_pulled_at'):
+                # First sync, answered from the user's fresh snapshot when there is one, streamed otherwise
+                response = snapshot_response(tables, request, owner=owner)
+                return response if response is not None else streaming_response(tables, params, owner)
+            # Streamed pull, encoded while the querysets are read in chunks
+            if params.get('stream'):
+                return streaming_response(tables, params, owner)
+            return Response(pull_changes(tables, params, owner, migration))
+        except ValidationError as e:
+            return Response({'errors': e.detail}, status=status.HTTP_400_BAD_REQUEST)
+
+    def post(self, request):
+        """
+        Handle POST requests to push changes from the client to the server.
+
+        Args:
+            request: The HTTP request object containing the changes in the request body.
+
+        Request Body:
+            changes (dict): Created, updated and deleted records of each synced table.
+                Example:
+                    {
+                        "projects": {
+                            "created": [{"id": 1, "name": "Project A", "lead_task": 1}, ...],
+                            "updated": [{"id": 2, "name": "Project B"}, ...],
+                            "deleted": [3, 4]
+                        },
+                        "tasks": {
+                            "created": [{"id": 1, "title": "Task A", "project": 1}, ...],
+                            "updated": [{"id": 2, "title": "Task B"}, ...],
+                            "deleted": [5, 6]
+                        }
+                    }
+
+        Query Parameters:
+            last_pulled_at (str, optional): ``timestamp`` of the client's last pull. When given,
+                the push is rejected if any record it updates or deletes changed after it.
+            last_seq (str, optional): Same, for clients pulling by sequence.
+
+        Headers:
+            X-Device-Id (optional): Device pushing the changes, recorded in the change journal.
+
+        Returns:
+            Response: A JSON response indicating success or failure:
+                - On success: {"status": "success"} with HTTP 200.
+                - On failure: {"errors": [error_messages]} with HTTP 400.
+                - On conflict: {"errors": [error_message], "conflicts": {table: [ids]}} with
+                  HTTP 409, nothing applied. The client pulls, then pushes again.
+        """
+        try:
+            since = conflicts.parse_since(request.query_params)
+        except ValidationError as e:
+            return Response({'errors': e.detail}, status=status.HTTP_400_BAD_REQUEST)
+        # Use atomic transaction to ensure all changes are applied or none are
+        with transaction.atomic(), recording_device(request.headers.get('X-Device-Id')):
+            changes = request.data.get('changes', {})
+            # Reject the whole push if a record it overwrites changed since the client's last pull
+            found = conflicts.find_conflicts(self.sync_tables, changes, request.user, since) if since else {}
+            if found:
+                return Response({
+                    'errors': ['Records changed on the server since the last pull; pull them and push again.'],
+                    'conflicts': found,
+                }, status=status.HTTP_409_CONFLICT)
+            # Apply changes on behalf of the user and collect any errors
+            errors = apply_changes(self.sync_tables, changes, request.user)
+            # Bring the subscriptions of every user the changes concern up to date
+            subscriptions.process()
+            # Publish the new high-water marks to the other workers once committed
+            watermarks.touch()
+        # Read this device's next pulls from the primary until the replica has its writes
+        pin(request)
+
+        if errors:
+            return Response({'errors': errors}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'status': 'success'}, status=status.HTTP_200_OK)
+
+
+def apply_changes(tables, changes, owner):
+    """
+    Apply a pushed batch of changes to ``tables``, in the phases described above.
+
+    Args:
+        tables (tuple): ``SyncTable`` of each synced table, in push order.
+        changes (dict): Created, updated and deleted records by table name.
+        owner (User): User pushing the changes; created records are theirs and only
+            records visible to them can be updated, deleted or referenced.
+
+    Returns:
+        list: Error messages of the records that could not be applied.
+    """
+    errors, changes = _reject_self_owned(tables, changes)
+    plan = planner.plan_push(tables, changes)
+    if plan.inserts and settings.SYNC_SINGLE_PASS_PUSH and push.can_defer_constraint_checks():
+        errors.extend(_create_single_pass(plan, changes, owner))
+    elif plan.inserts:
+        errors.extend(_create_planned(plan, changes, owner))
+
+    # Phase 3: Process updates, then deletions
+    pushed = [(table, changes.get(table.name, {})) for table in tables]
+    for table, table_changes in pushed:
+        errors.extend(_apply_updated(table, table_changes.get('updated', []), owner))
+    for table, table_changes in pushed:
+        errors.extend(_apply_deleted(table, table_changes.get('deleted', []), owner))
+    return errors
+
+
+def _reject_self_owned(tables, changes):
+    """
+    Refuse the created records of tables whose rows are their own owner, such as
+    users: a user only syncs their existing row and cannot create others.
+
+    Returns:
+        tuple: The error messages, and ``changes`` without those records.
+    """
+    errors = []
+    for table in tables:
+        created = (changes.get(table.name) or {}).get('created')
+        if table.model.owner_field != 'pk' or not created:
+            continue
+        name = table.model.__name__
+        for item in created:
+            record_id = item.get('id', 'unknown') if isinstance(item, dict) else 'unknown'
+            errors.append(f'{name} creation failed for ID {record_id}: {name} records cannot be created by a push')
+        changes = {**changes, table.name: {**changes[table.name], 'created': []}}
+    return errors, changes
+
+
+def _create_single_pass(plan, changes, owner):
+    """Phase 1 in a single pass, every foreign key in place and checked when the push commits."""
+    push.defer_constraint_checks()
+    batches = [(table.serializer_class, changes[table.name]['created']) for table, _, _ in plan.inserts]
+    errors = []
+    for (table, _, _), failures in zip(plan.inserts, push.bulk_create_linked(batches, owner)):
+        errors.extend(_creation_errors(table, failures))
+    # Subscribe the user to the records just created, so the next phases can reference them
+    subscriptions.process()
+    return errors
+
+
+def _create_planned(plan, changes, owner):
+    """Phases 1 and 2 as planned by ``planner.py``."""
+    errors = []
+    # Phase 1: Create records in dependency order, without the foreign keys closing a cycle
+    for table, deferred_fields, referenced in plan.inserts:
+        errors.extend(_creation_errors(table, push.bulk_create_records(
+            table.serializer_class, changes[table.name]['created'], deferred_fields=deferred_fields, owner=owner,
+        )))
+        if referenced or table is plan.inserts[-1][0]:
+            # Subscribe the user to the records just created, so what follows can reference them
+            subscriptions.process()
+
+    # Phase 2: Set the deferred foreign keys now that every created record exists
+    for table, fk_field in plan.fixups:
+        name = table.model._meta.verbose_name
+        for item, e in push.bulk_assign_fk(table.model, fk_field, changes[table.name]['created'], owner):
+            if isinstance(e, ObjectDoesNotExist):
+                errors.append(f"Failed to set {fk_field} for {name} {item.get('id')}: {str(e)}")
+            else:
+                errors.append(f"Unexpected error for {name} {item.get('id')}: {str(e)}")
+    return errors
+
+
+def _creation_errors(table, failures):
+    name = table.model.__name__
+    return [f"{name} creation failed for ID {item.get('id', 'unknown')}: {e.detail}" for item, e in failures]
+
+
+def _apply_updated(table, items, owner):
+    model = table.model
+    errors = []
+    for item, e in push.bulk_apply_updated(table.serializer_class, items, owner):
+        if isinstance(e, ValidationError):
+            errors.append(f"Update failed for {model.__name__} {item.get('id')}: {e.detail}")
+        elif isinstance(e, model.DoesNotExist):
+            errors.append(f"{model.__name__} {item.get('id')} does not exist")
+        else:
+            errors.append(f"Unexpected error updating {model.__name__} {item.get('id')}: {str(e)}")
+    return errors
+
+
+def _apply_deleted(table, ids, owner):
+    model = table.model
+    errors = []
+    for record_id, e in push.bulk_soft_delete(model, ids, owner):
+        if isinstance(e, model.DoesNotExist):
+            errors.append(f"{model.__name__} {record_id} does not exist")
+        else:
+            errors.append(f"Unexpected error deleting {model.__name__} {record_id}: {str(e)}")
+    return errors
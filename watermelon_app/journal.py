@@ -0,0 +1,293 @@
+# myapp/journal.py
+"""
+Trigger-maintained change journal of the synced tables.
+
+Every insert, update and delete on a journaled table appends a ``ChangeJournal``
+row from a database trigger, so writes that bypass the ORM signals (bulk updates,
+the admin, raw SQL) are recorded as well. A journal pull reads the journal range
+past the client's cursor, collapses repeated changes to the same record and
+fetches only the affected rows, so its cost follows the number of changes rather
+than the size of the tables.
+
+The triggers are installed by migrations, on SQLite and PostgreSQL. SQLite drops
+a table's triggers when a later migration rebuilds it, so they are also
+reinstalled after every ``migrate``. SQLite runs one writer at a time, so journal
+entries commit in ``seq`` order. PostgreSQL gets the same guarantee from a
+transaction-level advisory lock that every journal writer takes first, so a pull
+reading up to the highest ``seq`` never skips an entry committed later.
+
+Subscriptions, ETags and journal pulls are all fed by the journal, so registering
+a synced model on another backend, where the journal would stay empty, raises
+``ImproperlyConfigured`` at startup.
+"""
+import contextlib
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection, connections, router
+from django.db.models import Max, Q
+from django.db.models.signals import post_migrate
+from rest_framework.exceptions import ValidationError
+
+from .models import ChangeJournal, JournalDevice, owned_rows
+from .records import encoder_for
+
+_journaled_models = []
+
+# Backends the journal triggers are written for
+JOURNALED_VENDORS = ('sqlite', 'postgresql')
+
+# Key of the PostgreSQL advisory lock every journal writer holds until it commits
+JOURNAL_LOCK_KEY = 7_453_081
+
+# PL/pgSQL function run by the journal triggers on PostgreSQL
+TRIGGER_FUNCTION = 'watermelon_journal'
+
+
+def function_sql(vendor):
+    """
+    Return the statements creating what the triggers of every table share: on
+    PostgreSQL, the function journaling a write to the table it fires on, whose
+    primary key column is the trigger's argument.
+    """
+    if vendor != 'postgresql':
+        return []
+    journal = ChangeJournal._meta.db_table
+    device = f'(SELECT "device_id" FROM "{JournalDevice._meta.db_table}" LIMIT 1)'
+    return [
+        f'CREATE OR REPLACE FUNCTION "{TRIGGER_FUNCTION}"() RETURNS trigger LANGUAGE plpgsql AS $$ '
+        'DECLARE _data jsonb; _op char(1); '
+        f'BEGIN PERFORM pg_advisory_xact_lock({JOURNAL_LOCK_KEY}); '
+        "IF TG_OP = 'DELETE' THEN _data := to_jsonb(OLD); _op := 'd'; "
+        "ELSIF TG_OP = 'INSERT' THEN _data := to_jsonb(NEW); _op := 'c'; "
+        "ELSE _data := to_jsonb(NEW); _op := CASE WHEN _data ->> 'deleted_at' IS NULL THEN 'u' ELSE 'd' END; "
+        'END IF; '
+        f'INSERT INTO "{journal}" ("table", "record_id", "op", "device_id") '
+        f'VALUES (TG_TABLE_NAME, _data ->> TG_ARGV[0], _op, {device}); '
+        'RETURN NULL; END $$',
+    ]
+
+
+def trigger_sql(table, pk_column='id', vendor='sqlite'):
+    """
+    Return the ``CREATE TRIGGER`` statements journaling writes to ``table``.
+    Updates that set ``deleted_at`` are soft deletes and are journaled as such.
+    """
+    if vendor == 'postgresql':
+        return [
+            *drop_trigger_sql(table, vendor),
+            f'CREATE TRIGGER "{table}_journal" AFTER INSERT OR UPDATE OR DELETE ON "{table}" '
+            f'FOR EACH ROW EXECUTE FUNCTION "{TRIGGER_FUNCTION}"(\'{pk_column}\')',
+        ]
+    journal = ChangeJournal._meta.db_table
+    device = f'(SELECT "device_id" FROM "{JournalDevice._meta.db_table}" LIMIT 1)'
+    insert = f'INSERT INTO "{journal}" ("table", "record_id", "op", "device_id") VALUES'
+    return [
+        f'CREATE TRIGGER IF NOT EXISTS "{table}_journal_insert" AFTER INSERT ON "{table}" BEGIN '
+        f"{insert} ('{table}', NEW.\"{pk_column}\", 'c', {device}); END",
+        f'CREATE TRIGGER IF NOT EXISTS "{table}_journal_update" AFTER UPDATE ON "{table}" BEGIN '
+        f"{insert} ('{table}', NEW.\"{pk_column}\", "
+        f"CASE WHEN NEW.\"deleted_at\" IS NOT NULL THEN 'd' ELSE 'u' END, {device}); END",
+        f'CREATE TRIGGER IF NOT EXISTS "{table}_journal_delete" AFTER DELETE ON "{table}" BEGIN '
+        f"{insert} ('{table}', OLD.\"{pk_column}\", 'd', {device}); END",
+    ]
+
+
+def drop_trigger_sql(table, vendor='sqlite'):
+    if vendor == 'postgresql':
+        return [f'DROP TRIGGER IF EXISTS "{table}_journal" ON "{table}"']
+    return [f'DROP TRIGGER IF EXISTS "{table}_journal_{op}"' for op in ('insert', 'update', 'delete')]
+
+
+def install_triggers(schema_editor, models):
+    """Create the journal triggers of ``models``; a no-op on backends without journal triggers."""
+    vendor = schema_editor.connection.vendor
+    if vendor not in JOURNALED_VENDORS:
+        return
+    for sql in function_sql(vendor):
+        schema_editor.execute(sql)
+    for model in models:
+        for sql in trigger_sql(model._meta.db_table, model._meta.pk.column, vendor):
+            schema_editor.execute(sql)
+
+
+def drop_triggers(schema_editor, models):
+    vendor = schema_editor.connection.vendor
+    if vendor not in JOURNALED_VENDORS:
+        return
+    for model in models:
+        for sql in drop_trigger_sql(model._meta.db_table, vendor):
+            schema_editor.execute(sql)
+
+
+def reinstall_triggers(sender, using='default', **kwargs):
+    database = connections[using]
+    # Only SQLite drops the triggers of a rebuilt table
+    if database.vendor != 'sqlite' or not _journaled_models:
+        return
+    with database.schema_editor() as schema_editor:
+        install_triggers(schema_editor, _journaled_models)
+
+
+def lock_journal(using='default'):
+    """
+    Wait for the other journal writers to commit before journaling from the ORM,
+    as the triggers do on PostgreSQL. A no-op elsewhere; must run inside the
+    transaction writing the entries.
+    """
+    database = connections[using]
+    if database.vendor == 'postgresql':
+        with database.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_xact_lock(%s)', [JOURNAL_LOCK_KEY])
+
+
+def register(*models):
+    """
+    Keep the journal triggers of ``models`` installed after every ``migrate``.
+
+    Raises:
+        ImproperlyConfigured: If one of ``models`` is written to a backend without journal triggers.
+    """
+    for model in models:
+        alias = router.db_for_write(model)
+        if connections[alias].vendor not in JOURNALED_VENDORS:
+            raise ImproperlyConfigured(
+                f'{model._meta.label} is synced, but the change journal is only written on '
+                f'{" and ".join(JOURNALED_VENDORS)} and the database {alias!r} is {connections[alias].vendor}.'
+            )
+    _journaled_models.extend(model for model in models if model not in _journaled_models)
+    post_migrate.connect(reinstall_triggers, dispatch_uid='journal.reinstall_triggers')
+
+
+@contextlib.contextmanager
+def recording_device(device_id):
+    """
+    Attribute the journal rows written inside the block to ``device_id``. Must be
+    entered inside the push transaction, which keeps other writers out until the
+    device row is removed again.
+    """
+    if not device_id:
+        yield
+        return
+    JournalDevice.objects.create(device_id=device_id)
+    try:
+        yield
+    finally:
+        JournalDevice.objects.all().delete()
+
+
+def high_water_marks_sql(db_tables):
+    """SQL and parameters of the statement reading the high-water marks of ``db_tables``."""
+    qn = connection.ops.quote_name
+    lookup = (
+        f'(SELECT MAX({qn("seq")}) FROM {qn(ChangeJournal._meta.db_table)} WHERE {qn("table")} = %s)'
+    )
+    return 'SELECT ' + ', '.join([lookup] * len(db_tables)), list(db_tables)
+
+
+def high_water_marks(db_tables):
+    """
+    Return the sequence of the latest journal entry of each of ``db_tables`` (0 for
+    a table never written), read in one statement made of one index lookup per table
+    from the database the journal is read from, the replica during replica pulls.
+    """
+    with connections[router.db_for_read(ChangeJournal)].cursor() as cursor:
+        cursor.execute(*high_water_marks_sql(db_tables))
+        return [mark or 0 for mark in cursor.fetchone()]
+
+
+def journaled_tables():
+    """``db_table`` of every model registered for journaling."""
+    return [model._meta.db_table for model in _journaled_models]
+
+
+def parse_journal_seq(value):
+    try:
+        journal_seq = int(value)
+    except (TypeError, ValueError):
+        raise ValidationError('journal_seq must be an integer.')
+    if journal_seq < 0:
+        raise ValidationError('journal_seq must not be negative.')
+    return journal_seq
+
+
+def collapse(entries):
+    """
+    Collapse ``(table, record_id, op, user_id)`` journal entries to
+    ``{table: {record_id: (created, scoped)}}``, where ``created`` tells whether the
+    record was inserted, or entered the user's scope, within the range and
+    ``scoped`` whether it entered or left the user's scope.
+    """
+    touched = {}
+    for table, record_id, op, user_id in entries:
+        records = touched.setdefault(table, {})
+        created, scoped = records.get(record_id, (False, False))
+        records[record_id] = (created or op == 'c', scoped or user_id is not None)
+    return touched
+
+
+def journal_changes(tables, query_params, owner=None):
+    """
+    Build the changes journaled after the journal sequence value ``journal_seq``.
+
+    The upper bound of the range is read first, and the affected rows of each table
+    are then fetched by primary key in batches. A record is reported as deleted when
+    its row is gone or soft-deleted, as created when it was inserted within the
+    range, and as updated otherwise. With ``owner``, rows of other users are
+    skipped, and the scope changes journaled for the owner by the sync rules make
+    records that entered the owner's scope created and those that left it deleted.
+    Records deleted outright are reported to every owner, as their owner can no
+    longer be told; deleting an unknown ID is a no-op for the client.
+
+    Args:
+        tables (tuple): ``(name, model, serializer_class)`` for each synced table, in pull order.
+        query_params (QueryDict): Request parameters holding ``journal_seq``.
+        owner (User, optional): User whose rows are pulled.
+
+    Returns:
+        dict: The usual ``changes`` payload, with ``timestamp`` set to the journal
+        sequence value to send as ``journal_seq`` on the next pull.
+
+    Raises:
+        ValidationError: If ``journal_seq`` is invalid.
+    """
+    journal_seq = parse_journal_seq(query_params.get('journal_seq'))
+    high = ChangeJournal.objects.aggregate(high=Max('seq'))['high'] or 0
+    batch_size = connection.features.max_query_params
+
+    entries = ChangeJournal.objects.filter(
+        seq__gt=journal_seq, seq__lte=high, table__in=[model._meta.db_table for _, model, _ in tables]
+    )
+    # Scope changes only concern the user they were journaled for
+    entries = entries.filter(Q(user__isnull=True) | Q(user=owner)) if owner is not None else entries.filter(
+        user__isnull=True
+    )
+    touched = collapse(entries.values_list('table', 'record_id', 'op', 'user').iterator())
+
+    changes = {}
+    for name, model, serializer_class in tables:
+        records = touched.get(model._meta.db_table, {})
+        pk_field = model._meta.pk
+        pks = {pk_field.to_python(record_id): flags for record_id, flags in records.items()}
+        created, updated, deleted = [], [], []
+        batch = list(pks)
+        for start in range(0, len(batch), batch_size):
+            queryset = owned_rows(model, owner).filter(pk__in=batch[start:start + batch_size])
+            for record, (pk, deleted_at) in encoder_for(serializer_class).rows(queryset, extra=('pk', 'deleted_at')):
+                was_created, _ = pks.pop(pk)
+                if deleted_at is not None:
+                    deleted.append(pk)
+                elif was_created:
+                    created.append(record)
+                else:
+                    updated.append(record)
+        # Whatever was not fetched has been deleted outright or has left the owner's
+        # scope, unless it belongs to someone else
+        if owner is not None and pks:
+            rest = [pk for pk, (_, scoped) in pks.items() if not scoped]
+            for start in range(0, len(rest), batch_size):
+                foreign = model._default_manager.filter(pk__in=rest[start:start + batch_size])
+                for pk in foreign.values_list('pk', flat=True):
+                    del pks[pk]
+        deleted.extend(pks)
+        changes[name] = {'created': created, 'updated': updated, 'deleted': deleted}
+    return {'changes': changes, 'timestamp': high}
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from watermelon_app.benchmarks import SCENARIOS
+
+
+class Command(BaseCommand):
+    help = 'Run a sync benchmark scenario and print one result row per size.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenario', choices=sorted(SCENARIOS))
+        parser.add_argument(
+            '--sizes', nargs='+', type=int,
+            help='Sizes to benchmark with; each scenario has its own defaults.',
+        )
+
+    def handle(self, *args, **options):
+        scenario = SCENARIOS[options['scenario']]
+        rows = scenario(options['sizes']) if options['sizes'] else scenario()
+        for row in rows:
+            self.stdout.write('  '.join(f'{key}={value}' for key, value in row.items()))
@@ -0,0 +1,33 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from watermelon_app.snapshots import build_snapshot, prune_snapshots, snapshot_path
+from watermelon_app.views import SyncView
+from watermelon_user.views import UserProfileSyncView
+
+
+class Command(BaseCommand):
+    help = (
+        'Render the first-sync payload of every sync endpoint to its compressed '
+        'snapshot file for each user, e.g. right before a release, and remove the '
+        'stale snapshots of the others.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users', nargs='+', type=int,
+            help='Primary keys of the users to build snapshots for; every active user by default.',
+        )
+
+    def handle(self, *args, **options):
+        users = get_user_model().objects.filter(is_active=True)
+        if options['users']:
+            users = users.filter(pk__in=options['users'])
+        for user in users.iterator():
+            for view in (SyncView, UserProfileSyncView):
+                for turbo in (False, True):
+                    timestamp = build_snapshot(view.sync_tables, turbo, user)
+                    path = snapshot_path(view.sync_tables, turbo, user)
+                    self.stdout.write(f'{path}: timestamp={timestamp} bytes={path.stat().st_size}')
+        removed = prune_snapshots()
+        self.stdout.write(f'{removed} stale snapshot files removed')
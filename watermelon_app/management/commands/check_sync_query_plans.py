@@ -0,0 +1,90 @@
+import datetime
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Q
+
+from watermelon_app import subscriptions
+from watermelon_app.journal import high_water_marks_sql
+from watermelon_app.models import ChangeJournal, owned_rows
+from watermelon_app.pull import changed_querysets, page_queryset
+from watermelon_app.records import encoder_for
+from watermelon_app.views import SyncView
+from watermelon_user.views import UserProfileSyncView
+
+# A full table or index scan, as reported by EXPLAIN QUERY PLAN on any SQLite version,
+# or a sort of every row found. The single constant row of a SELECT without FROM is not a table.
+FULL_SCAN = re.compile(r'\bSCAN\b(?! CONSTANT ROW)|\bUSE TEMP B-TREE\b')
+
+# Pulls are scoped to the requesting user; any primary key gives the same plans
+OWNER = 1
+
+
+def pull_queries(since):
+    """
+    Yield ``(label, queryset)`` for every query a pull of one user's rows of the
+    synced tables runs, and for the conflict lookups of a push.
+    """
+    for view in (SyncView, UserProfileSyncView):
+        for name, model, serializer_class in view.sync_tables:
+            columns = encoder_for(serializer_class).columns
+            created, updated, deleted = changed_querysets(model, since, OWNER)
+            yield f'{name} created', created.values_list(*columns)
+            yield f'{name} updated', updated.values_list(*columns)
+            yield f'{name} deleted', deleted
+            if subscriptions.has_rules(model):
+                yield f'{name} first page', subscriptions.page_queryset(model, since, OWNER)
+                yield f'{name} next page', subscriptions.page_queryset(model, since, OWNER, (since, '1'))
+            else:
+                yield f'{name} first page', page_queryset(model, since, owner=OWNER)
+                yield f'{name} next page', page_queryset(model, since, (since, model._meta.pk.to_python(1)), OWNER)
+            if subscriptions.has_rules(model):
+                sequenced = subscriptions.sequence_changes(model, 1, 2, OWNER)[0]
+            else:
+                sequenced = owned_rows(model, OWNER).filter(server_seq__gt=1, server_seq__lte=2)
+            yield f'{name} sequence', sequenced.values_list(*columns, 'deleted_at', 'created_seq', 'pk')
+            journaled = owned_rows(model, OWNER).filter(pk__in=[model._meta.pk.to_python(1)])
+            yield f'{name} journaled rows', journaled.values_list(*columns, 'pk', 'deleted_at')
+            pushed = [model._meta.pk.to_python(1)]
+            for lookup, value in (('updated_at__gt', since), ('server_seq__gt', 1)):
+                conflicting = owned_rows(model, OWNER).filter(pk__in=pushed, **{lookup: value})
+                yield f'{name} push conflicts by {lookup.split("__")[0]}', conflicting.values_list('pk', flat=True)
+    journal = ChangeJournal.objects.filter(Q(user__isnull=True) | Q(user=OWNER), seq__gt=1, seq__lte=2, table__in=['a', 'b'])
+    yield 'change journal', journal.values_list('table', 'record_id', 'op', 'user')
+
+
+def query_plans(since):
+    """
+    Yield ``(label, plan)`` with the EXPLAIN QUERY PLAN output of every query of
+    ``pull_queries`` and of the ETag high-water mark lookup of each sync endpoint.
+    """
+    for label, queryset in pull_queries(since):
+        yield label, queryset.explain()
+    for view in (SyncView, UserProfileSyncView):
+        sql, params = high_water_marks_sql([model._meta.db_table for _, model, _ in view.sync_tables])
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            plan = '\n'.join(' '.join(str(column) for column in row) for row in cursor.fetchall())
+        yield f'{view.__name__} etag marks', plan
+
+
+class Command(BaseCommand):
+    help = (
+        'Run EXPLAIN QUERY PLAN on every pull query, and push conflict lookup, of the sync endpoints and fail '
+        'if any of them falls back to a full scan.'
+    )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('Query plans can only be checked on SQLite.')
+
+        since = datetime.datetime.now(datetime.timezone.utc)
+        regressions = []
+        for label, plan in query_plans(since):
+            self.stdout.write(f'{label}: {plan}')
+            if FULL_SCAN.search(plan):
+                regressions.append(label)
+        if regressions:
+            raise CommandError(f'Full scans in sync queries: {", ".join(regressions)}')
+        self.stdout.write(self.style.SUCCESS('All sync queries use an index range.'))
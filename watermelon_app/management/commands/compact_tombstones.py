@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from watermelon_app import compaction
+from watermelon_app.snapshots import prune_snapshots
+
+
+class Command(BaseCommand):
+    help = (
+        'Hard-delete the soft-deleted sync records and left subscriptions older than '
+        'the tombstone horizon, in small batches, and the stale per-user snapshots, '
+        'e.g. from a nightly cron job.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--horizon', type=int,
+            help='Age in seconds past which tombstones are removed; SYNC_TOMBSTONE_HORIZON by default.',
+        )
+        parser.add_argument(
+            '--batch-size', type=int,
+            help='Rows deleted per transaction; SYNC_COMPACTION_BATCH_SIZE by default.',
+        )
+        parser.add_argument(
+            '--archive-dir',
+            help='Directory the tombstones are appended to before deletion; SYNC_TOMBSTONE_ARCHIVE_DIR by default.',
+        )
+
+    def handle(self, *args, **options):
+        removed = compaction.compact(options['horizon'], options['batch_size'], options['archive_dir'])
+        for table, count in removed.items():
+            self.stdout.write(f'{table}: {count} removed')
+        self.stdout.write(f'snapshots: {prune_snapshots()} removed')
+        oldest_pulled_at, oldest_seq = compaction.oldest_supported()
+        self.stdout.write(self.style.SUCCESS(
+            f'Oldest supported cursors: last_pulled_at={oldest_pulled_at} last_seq={oldest_seq}'
+        ))
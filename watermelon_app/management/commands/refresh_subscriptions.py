@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from watermelon_app import subscriptions
+
+
+class Command(BaseCommand):
+    help = (
+        'Bring the sync subscriptions up to date with the change journal, or rebuild '
+        'them from every record, e.g. after the sync rules of a model changed.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rebuild', action='store_true',
+            help='Recompute the subscriptions to every record instead of the journaled ones only.',
+        )
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            subscriptions.rebuild()
+        else:
+            subscriptions.process()
+        self.stdout.write(self.style.SUCCESS('Subscriptions are up to date.'))
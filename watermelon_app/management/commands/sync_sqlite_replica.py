@@ -0,0 +1,37 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from watermelon_app import replica
+
+
+class Command(BaseCommand):
+    help = (
+        'Copy the primary SQLite database to the local read replica pulls read from, '
+        'once or every --interval seconds.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--database', default=settings.SYNC_REPLICA_DATABASE,
+            help='Alias of the replica to refresh; SYNC_REPLICA_DATABASE by default.',
+        )
+        parser.add_argument(
+            '--interval', type=float,
+            help='Keep refreshing the replica every this many seconds instead of once.',
+        )
+        parser.add_argument(
+            '--pages', type=int, default=-1,
+            help='Pages copied per backup step; the whole database at once by default.',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.perf_counter()
+            copied_at = replica.refresh(options['database'], options['pages'])
+            elapsed = time.perf_counter() - started
+            self.stdout.write(f'{options["database"]}: copy of {copied_at.isoformat()} in {elapsed * 1000:.1f} ms')
+            if options['interval'] is None:
+                return
+            time.sleep(max(0.0, options['interval'] - elapsed))
@@ -0,0 +1,29 @@
+# Generated by Django 5.1.6 on 2026-10-16 10:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('watermelon_app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='project',
+            options={},
+        ),
+        migrations.AlterModelOptions(
+            name='task',
+            options={},
+        ),
+        migrations.AddIndex(
+            model_name='project',
+            index=models.Index(fields=['updated_at', 'id'], name='project_sync_cursor_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['updated_at', 'id'], name='task_sync_cursor_idx'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.1.6 on 2026-10-16 10:40
+
+from django.db import migrations, models
+
+
+def backfill_server_seq(apps, schema_editor):
+    # Rows written before sequencing share the first value, so a pull from 0 returns them
+    apps.get_model('watermelon_app', 'ServerSequence').objects.create(pk=1, value=1)
+    for name in ('Project', 'Task'):
+        apps.get_model('watermelon_app', name).objects.update(server_seq=1, created_seq=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('watermelon_app', '0003_sync_pull_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ServerSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='created_seq',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='server_seq',
+            field=models.BigIntegerField(db_index=True, default=0),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='created_seq',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='server_seq',
+            field=models.BigIntegerField(db_index=True, default=0),
+        ),
+        migrations.RunPython(backfill_server_seq, migrations.RunPython.noop),
+    ]
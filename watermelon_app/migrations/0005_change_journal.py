@@ -0,0 +1,93 @@
+# Generated by Django 5.1.6 on 2026-10-16 10:43
+
+from django.db import migrations, models
+
+# Frozen copy of the journal triggers as this migration installs them, independent of
+# later changes to watermelon_app.journal
+JOURNAL_INSERT = 'INSERT INTO "watermelon_app_changejournal" ("table", "record_id", "op", "device_id") VALUES'
+DEVICE = '(SELECT "device_id" FROM "watermelon_app_journaldevice" LIMIT 1)'
+TABLES = ('watermelon_app_project', 'watermelon_app_task')
+
+# PL/pgSQL function the triggers run on PostgreSQL; the advisory lock makes journal
+# writers commit one at a time, in seq order
+FUNCTION_SQL = (
+    'CREATE OR REPLACE FUNCTION "watermelon_journal"() RETURNS trigger LANGUAGE plpgsql AS $$ '
+    'DECLARE _data jsonb; _op char(1); '
+    'BEGIN PERFORM pg_advisory_xact_lock(7453081); '
+    "IF TG_OP = 'DELETE' THEN _data := to_jsonb(OLD); _op := 'd'; "
+    "ELSIF TG_OP = 'INSERT' THEN _data := to_jsonb(NEW); _op := 'c'; "
+    "ELSE _data := to_jsonb(NEW); _op := CASE WHEN _data ->> 'deleted_at' IS NULL THEN 'u' ELSE 'd' END; "
+    'END IF; '
+    'INSERT INTO "watermelon_app_changejournal" ("table", "record_id", "op", "device_id") '
+    'VALUES (TG_TABLE_NAME, _data ->> TG_ARGV[0], _op, (SELECT "device_id" FROM "watermelon_app_journaldevice" LIMIT 1)); '
+    'RETURN NULL; END $$'
+)
+
+
+def trigger_sql(table, vendor):
+    if vendor == 'postgresql':
+        return [
+            f'DROP TRIGGER IF EXISTS "{table}_journal" ON "{table}"',
+            f'CREATE TRIGGER "{table}_journal" AFTER INSERT OR UPDATE OR DELETE ON "{table}" '
+            f'FOR EACH ROW EXECUTE FUNCTION "watermelon_journal"(\'id\')',
+        ]
+    return [
+        f'CREATE TRIGGER IF NOT EXISTS "{table}_journal_insert" AFTER INSERT ON "{table}" BEGIN '
+        f"{JOURNAL_INSERT} ('{table}', NEW.\"id\", 'c', {DEVICE}); END",
+        f'CREATE TRIGGER IF NOT EXISTS "{table}_journal_update" AFTER UPDATE ON "{table}" BEGIN '
+        f"{JOURNAL_INSERT} ('{table}', NEW.\"id\", "
+        f"CASE WHEN NEW.\"deleted_at\" IS NOT NULL THEN 'd' ELSE 'u' END, {DEVICE}); END",
+        f'CREATE TRIGGER IF NOT EXISTS "{table}_journal_delete" AFTER DELETE ON "{table}" BEGIN '
+        f"{JOURNAL_INSERT} ('{table}', OLD.\"id\", 'd', {DEVICE}); END",
+    ]
+
+
+def create_triggers(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor not in ('sqlite', 'postgresql'):
+        return
+    if vendor == 'postgresql':
+        schema_editor.execute(FUNCTION_SQL)
+    for table in TABLES:
+        for sql in trigger_sql(table, vendor):
+            schema_editor.execute(sql)
+
+
+def remove_triggers(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    for table in TABLES:
+        if vendor == 'postgresql':
+            schema_editor.execute(f'DROP TRIGGER IF EXISTS "{table}_journal" ON "{table}"')
+        elif vendor == 'sqlite':
+            for op in ('insert', 'update', 'delete'):
+                schema_editor.execute(f'DROP TRIGGER IF EXISTS "{table}_journal_{op}"')
+    if vendor == 'postgresql':
+        schema_editor.execute('DROP FUNCTION IF EXISTS "watermelon_journal"()')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('watermelon_app', '0004_server_seq'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeJournal',
+            fields=[
+                ('seq', models.BigAutoField(primary_key=True, serialize=False)),
+                ('table', models.CharField(max_length=100)),
+                ('record_id', models.CharField(max_length=64)),
+                ('op', models.CharField(choices=[('c', 'created'), ('u', 'updated'), ('d', 'deleted')], max_length=1)),
+                ('device_id', models.CharField(blank=True, max_length=100, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='JournalDevice',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('device_id', models.CharField(max_length=100)),
+            ],
+        ),
+        migrations.RunPython(create_triggers, remove_triggers),
+    ]
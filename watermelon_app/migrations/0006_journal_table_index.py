@@ -0,0 +1,17 @@
+# Generated by Django 5.1.6 on 2026-10-16 10:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('watermelon_app', '0005_change_journal'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='changejournal',
+            index=models.Index(fields=['table', 'seq'], name='journal_table_seq_idx'),
+        ),
+    ]
@@ -0,0 +1,134 @@
+# Generated by Django 5.1.6 on 2026-10-16 11:30
+
+import django.db.models.deletion
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import migrations, models
+
+
+def assign_owners(apps, schema_editor):
+    """
+    Give the projects and tasks created before pulls were scoped to their user an
+    owner, without which no user could pull or push them. Their owner is not
+    recorded anywhere, so it is the user named by ``SYNC_LEGACY_OWNER``.
+    """
+    Project = apps.get_model('watermelon_app', 'Project')
+    Task = apps.get_model('watermelon_app', 'Task')
+    unowned = [model.objects.filter(owner__isnull=True) for model in (Project, Task)]
+    if not any(queryset.exists() for queryset in unowned):
+        return
+    owner = getattr(settings, 'SYNC_LEGACY_OWNER', None)
+    if owner is None:
+        raise ImproperlyConfigured(
+            'Projects and tasks exist that belong to no user. Set SYNC_LEGACY_OWNER to the primary '
+            'key of the user they should belong to and run migrate again.'
+        )
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    if not User.objects.filter(pk=owner).exists():
+        raise ImproperlyConfigured(f'SYNC_LEGACY_OWNER names no user: {owner!r}.')
+    for queryset in unowned:
+        queryset.update(owner_id=owner)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('watermelon_app', '0006_journal_table_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='project',
+            name='project_sync_cursor_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='project',
+            name='project_live_created_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='project',
+            name='project_live_updated_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='project',
+            name='project_tombstone_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='task',
+            name='task_sync_cursor_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='task',
+            name='task_live_created_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='task',
+            name='task_live_updated_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='task',
+            name='task_tombstone_idx',
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='owner',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='projects', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='owner',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='tasks', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='project',
+            name='server_seq',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='task',
+            name='server_seq',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='project',
+            index=models.Index(fields=['owner', 'updated_at', 'id'], name='project_owner_cursor_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='project',
+            index=models.Index(condition=models.Q(('deleted_at__isnull', True)), fields=['owner', 'created_at'], name='project_owner_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='project',
+            index=models.Index(condition=models.Q(('deleted_at__isnull', True)), fields=['owner', 'updated_at', 'created_at'], name='project_owner_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='project',
+            index=models.Index(condition=models.Q(('deleted_at__isnull', False)), fields=['owner', 'deleted_at', 'id'], name='project_owner_tombstone_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='project',
+            index=models.Index(fields=['owner', 'server_seq'], name='project_owner_seq_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['owner', 'updated_at', 'id'], name='task_owner_cursor_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(condition=models.Q(('deleted_at__isnull', True)), fields=['owner', 'created_at'], name='task_owner_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(condition=models.Q(('deleted_at__isnull', True)), fields=['owner', 'updated_at', 'created_at'], name='task_owner_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(condition=models.Q(('deleted_at__isnull', False)), fields=['owner', 'deleted_at', 'id'], name='task_owner_tombstone_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['owner', 'server_seq'], name='task_owner_seq_idx'),
+        ),
+        migrations.RunPython(assign_owners, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,159 @@
+# Generated by Django 5.1.6 on 2026-10-16 13:10
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F, Max
+from django.utils import timezone
+
+# Sync rules of the models as this migration introduces them
+VISIBLE_TO = {
+    'Project': ('owner', 'members'),
+    'Task': ('owner', 'project__owner', 'project__members'),
+}
+
+
+def next_seq(apps):
+    ServerSequence = apps.get_model('watermelon_app', 'ServerSequence')
+    if not ServerSequence.objects.filter(pk=1).update(value=F('value') + 1):
+        ServerSequence.objects.create(pk=1, value=1)
+    return ServerSequence.objects.values_list('value', flat=True).get(pk=1)
+
+
+def backfill_subscriptions(apps, schema_editor):
+    """
+    Subscribe the users the rules reach to the existing records. A record was in
+    its owner's scope all along, so that subscription carries the record's own
+    stamps and is not pulled again; any other user enters the scope now.
+    """
+    Subscription = apps.get_model('watermelon_app', 'Subscription')
+    SubscriptionState = apps.get_model('watermelon_app', 'SubscriptionState')
+    ChangeJournal = apps.get_model('watermelon_app', 'ChangeJournal')
+    connection = schema_editor.connection
+    now, seq = timezone.now(), None
+    for name, paths in VISIBLE_TO.items():
+        model = apps.get_model('watermelon_app', name)
+        table, pk_field = model._meta.db_table, model._meta.pk
+        records = {
+            pk: stamps for pk, *stamps in model.objects.values_list(
+                'pk', 'owner', 'created_at', 'created_seq', 'updated_at', 'server_seq'
+            ).iterator()
+        }
+        reached = {(user_id, pk) for path in paths for user_id, pk in model.objects.values_list(path, 'pk')}
+        subscriptions = []
+        for user_id, pk in reached:
+            if user_id is None:
+                continue
+            owner, created_at, created_seq, updated_at, server_seq = records[pk]
+            if user_id == owner:
+                stamps = {
+                    'entered_at': created_at, 'entered_seq': created_seq,
+                    'changed_at': updated_at, 'changed_seq': server_seq,
+                }
+            else:
+                seq = seq or next_seq(apps)
+                stamps = {'entered_at': now, 'entered_seq': seq, 'changed_at': now, 'changed_seq': seq}
+            record_id = str(pk_field.get_db_prep_value(pk, connection))
+            subscriptions.append(Subscription(user_id=user_id, table=table, record_id=record_id, **stamps))
+        Subscription.objects.bulk_create(subscriptions, batch_size=500)
+    # The journal written so far is reflected in the subscriptions
+    high = ChangeJournal.objects.aggregate(high=Max('seq'))['high'] or 0
+    SubscriptionState.objects.update_or_create(pk=1, defaults={'journal_seq': high})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('watermelon_app', '0007_owner_scoping'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Subscription',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('table', models.CharField(max_length=100)),
+                ('record_id', models.CharField(max_length=64)),
+                ('entered_at', models.DateTimeField()),
+                ('entered_seq', models.BigIntegerField()),
+                ('changed_at', models.DateTimeField()),
+                ('changed_seq', models.BigIntegerField()),
+                ('left', models.BooleanField(default=False)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SubscriptionState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('journal_seq', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RemoveIndex(
+            model_name='project',
+            name='project_owner_cursor_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='project',
+            name='project_owner_created_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='project',
+            name='project_owner_updated_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='project',
+            name='project_owner_tombstone_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='project',
+            name='project_owner_seq_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='task',
+            name='task_owner_cursor_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='task',
+            name='task_owner_created_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='task',
+            name='task_owner_updated_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='task',
+            name='task_owner_tombstone_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='task',
+            name='task_owner_seq_idx',
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='members',
+            field=models.ManyToManyField(blank=True, related_name='member_projects', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='subscription',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='subscriptions', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='subscription',
+            index=models.Index(fields=['user', 'table', 'changed_at'], name='subscription_changed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='subscription',
+            index=models.Index(fields=['user', 'table', 'changed_seq'], name='subscription_seq_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='subscription',
+            index=models.Index(fields=['table', 'record_id'], name='subscription_record_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='subscription',
+            constraint=models.UniqueConstraint(fields=('user', 'table', 'record_id'), name='subscription_unique'),
+        ),
+        migrations.RunPython(backfill_subscriptions, migrations.RunPython.noop),
+    ]
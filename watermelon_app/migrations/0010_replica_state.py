@@ -0,0 +1,20 @@
+# Generated by Django 5.1.6 on 2026-10-16 14:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('watermelon_app', '0009_tombstone_compaction'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReplicaState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('copied_at', models.DateTimeField()),
+            ],
+        ),
+    ]
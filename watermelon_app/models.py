@@ -1,22 +1,188 @@
 # myapp/models.py
 import uuid
+from django.conf import settings
 from django.db import models
+from django.db.models import Exists, OuterRef, Q
+from django.db.models.functions import Cast
+
+class OwnedQuerySet(models.QuerySet):
+    """
+    QuerySet of a synced model whose ``owner_field`` names the user each row belongs to.
+    Models declaring sync rules in ``visible_to`` are scoped by their subscriptions instead,
+    and read whole through ``subscriptions.subscribed_rows()``.
+    """
+
+    def owned_by(self, user):
+        # A primary key works for both foreign key and ``pk`` owner fields
+        owner = user.pk if isinstance(user, models.Model) else user
+        if getattr(self.model, 'visible_to', ()):
+            # One probe of the unique subscription index per row, so that looking up a
+            # batch of keys costs the batch, not the size of the user's scope
+            subscribed = Subscription.objects.live(owner, self.model).filter(
+                record_id=Cast(OuterRef('pk'), models.CharField())
+            )
+            return self.filter(Exists(subscribed))
+        return self.filter(**{self.model.owner_field: owner})
+
+
+def owned_rows(model, owner=None):
+    """Rows of a synced ``model``: all of them, or only those visible to ``owner`` when given."""
+    queryset = model._default_manager.all()
+    return queryset if owner is None else queryset.owned_by(owner)
+
+class ServerSequence(models.Model):
+    """
+    Single-row counter handing out the server_seq value of every write to a synced model.
+    Writers hold its row lock until they commit, so sequence values become visible in order.
+    """
+    value = models.BigIntegerField(default=0)
+
+class ChangeJournal(models.Model):
+    """
+    Append-only log of every write to a synced table, filled by database triggers
+    (see ``journal.py``) so that bulk updates, the admin and raw SQL are captured too.
+    Entries with a ``user`` record a record entering (``c``) or leaving (``d``) that
+    user's scope under the sync rules, written by ``subscriptions.refresh()``.
+    """
+    OPS = [('c', 'created'), ('u', 'updated'), ('d', 'deleted')]
+
+    seq = models.BigAutoField(primary_key=True)
+    table = models.CharField(max_length=100)  # db_table of the written model
+    record_id = models.CharField(max_length=64)
+    op = models.CharField(max_length=1, choices=OPS)
+    device_id = models.CharField(max_length=100, null=True, blank=True)
+    # Entries outlive the users whose scope they record
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True,
+        related_name='+',
+    )
+
+    class Meta:
+        indexes = [
+            # Latest change of each table, the high-water mark behind pull ETags
+            models.Index(fields=['table', 'seq'], name='journal_table_seq_idx'),
+        ]
+
+class JournalDevice(models.Model):
+    """
+    Device of the push being applied, read by the journal triggers. It holds at
+    most one row, written and removed inside the push transaction.
+    """
+    device_id = models.CharField(max_length=100)
+
+class SubscriptionQuerySet(models.QuerySet):
+
+    def of(self, user, model):
+        """Subscriptions of ``user`` to the records of ``model``, current or past."""
+        return self.filter(user=user, table=model._meta.db_table)
+
+    def live(self, user, model):
+        """Records of ``model`` currently visible to ``user``."""
+        return self.of(user, model).filter(left=False)
+
+class Subscription(models.Model):
+    """
+    One record of a synced table visible to one user under the sync rules of its
+    model (see ``subscriptions.py``). The row is kept when the record leaves the
+    user's scope, with ``left`` set, so pulls can report it as deleted. ``changed_at``
+    and ``changed_seq`` move whenever the record is written, enters or leaves.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='subscriptions')
+    table = models.CharField(max_length=100)  # db_table of the record's model
+    record_id = models.CharField(max_length=64)  # Primary key as stored in the record's table
+    entered_at = models.DateTimeField()
+    entered_seq = models.BigIntegerField()
+    changed_at = models.DateTimeField()
+    changed_seq = models.BigIntegerField()
+    left = models.BooleanField(default=False)
+
+    objects = SubscriptionQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            # Also answers whether a user sees a record
+            models.UniqueConstraint(fields=['user', 'table', 'record_id'], name='subscription_unique'),
+        ]
+        indexes = [
+            # Subscription changes of timestamp pulls, in the keyset order of paginated ones
+            models.Index(fields=['user', 'table', 'changed_at', 'record_id'], name='subscription_cursor_idx'),
+            # Subscription changes of sequence pulls
+            models.Index(fields=['user', 'table', 'changed_seq'], name='subscription_seq_idx'),
+            # Subscribers of a written record
+            models.Index(fields=['table', 'record_id'], name='subscription_record_idx'),
+            # Left subscriptions by age, purged by tombstone compaction
+            models.Index(fields=['changed_at'], name='subscription_left_idx', condition=Q(left=True)),
+        ]
+
+class SubscriptionState(models.Model):
+    """Single-row position of the change journal up to which subscriptions are current."""
+    journal_seq = models.BigIntegerField(default=0)
+
+class CompactionState(models.Model):
+    """
+    Single-row record of the oldest pull cursors still answered completely once
+    tombstones have been compacted (see ``compaction.py``). Clients behind them
+    may have missed a deletion and are told to resync.
+    """
+    oldest_pulled_at = models.DateTimeField(null=True)  # Latest deleted_at compacted
+    oldest_seq = models.BigIntegerField(default=0)  # Latest server_seq compacted
+
+class ReplicaState(models.Model):
+    """
+    Single-row time of the copy a read replica holds, written into the replica by
+    ``manage.py sync_sqlite_replica`` (see ``replica.py``); empty on the primary.
+    """
+    copied_at = models.DateTimeField()
+
+class ReplicaPin(models.Model):
+    """
+    Time until which the pulls of a user's device stay on the primary after it
+    pushed (see ``replica.py``). Kept in the primary database, which every worker shares.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    device_id = models.CharField(max_length=100, blank=True)
+    until = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'device_id'], name='replica_pin_unique'),
+        ]
 
 class Project(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4)  # Client can provide IDs
+    owner = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True, related_name='projects'
+    )
     name = models.CharField(max_length=100)
     lead_task = models.ForeignKey(
         'Task', on_delete=models.SET_NULL, null=True, blank=True, related_name='leading_projects'
     )
+    # Users the project is shared with, besides its owner
+    members = models.ManyToManyField(settings.AUTH_USER_MODEL, blank=True, related_name='member_projects')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     deleted_at = models.DateTimeField(null=True, blank=True)  # Soft deletes
+    server_seq = models.BigIntegerField(default=0)  # Sequence of the last write
+    created_seq = models.BigIntegerField(default=0)  # Sequence of the insert
+
+    objects = OwnedQuerySet.as_manager()
+    # Pushes stamp the requesting user as owner of the records they create
+    owner_field = 'owner'
+    # Sync rules: lookups from a record to the users who see it. Pulls are read
+    # through the subscriptions these maintain, by primary key.
+    visible_to = ('owner', 'members')
 
     class Meta:
-        ordering = ['created_at']
+        indexes = [
+            # Tombstones by age, read by compaction
+            models.Index(fields=['deleted_at'], name='project_tombstone_age_idx', condition=Q(deleted_at__isnull=False)),
+        ]
 
 class Task(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4)
+    owner = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True, related_name='tasks'
+    )
     title = models.CharField(max_length=200)
     project = models.ForeignKey(
         Project, on_delete=models.CASCADE, null=True, blank=True, related_name='tasks'
@@ -24,6 +190,16 @@ class Task(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     deleted_at = models.DateTimeField(null=True, blank=True)
+    server_seq = models.BigIntegerField(default=0)
+    created_seq = models.BigIntegerField(default=0)
+
+    objects = OwnedQuerySet.as_manager()
+    owner_field = 'owner'
+    # Tasks are shared along with their project
+    visible_to = ('owner', 'project__owner', 'project__members')
 
     class Meta:
-        ordering = ['created_at']
\ No newline at end of file
+        indexes = [
+            # Tombstones by age, read by compaction
+            models.Index(fields=['deleted_at'], name='task_tombstone_age_idx', condition=Q(deleted_at__isnull=False)),
+        ]
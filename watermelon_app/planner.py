@@ -0,0 +1,173 @@
+# myapp/planner.py
+"""
+Write plan of the records created by a push.
+
+The foreign keys between the tables of a push form a dependency graph: a table
+whose records point at another table's records is inserted after it, with the
+keys in place. Where the references form a cycle, e.g. ``Project.lead_task``
+and ``Task.project``, or a table referencing itself, the cycle is broken by
+deferring one of its edges: the referencing records are inserted without that
+key and one batched fixup sets it once every record exists. Only edges that
+close a cycle are deferred, nullable ones first, so an acyclic push is written
+in a single insert per table.
+
+The graph is built from the tables that have created records in the push only;
+references to rows created by earlier pushes need no ordering.
+"""
+import functools
+from collections import namedtuple
+
+from rest_framework.relations import PrimaryKeyRelatedField
+
+# ``table`` references ``target`` through its foreign key ``field``
+Edge = namedtuple('Edge', ['table', 'field', 'target', 'nullable'])
+
+# ``inserts``: ``(table, deferred_fields, referenced)`` in insert order, where
+# ``referenced`` tells whether a later insert points at the table's new records.
+# ``fixups``: ``(table, field)`` for each deferred edge, in insert order.
+PushPlan = namedtuple('PushPlan', ['inserts', 'fixups'])
+
+
+def references(table):
+    """
+    Foreign keys written through the serializer of ``table``.
+
+    Returns:
+        list: ``(field, related_model, nullable)`` for each writable foreign key.
+    """
+    model = table.model
+    found = []
+    for field in table.serializer_class().fields.values():
+        if field.read_only or not isinstance(field, PrimaryKeyRelatedField):
+            continue
+        model_field = model._meta.get_field(field.source)
+        if model_field.many_to_one:
+            found.append((model_field.name, model_field.related_model, model_field.null))
+    return found
+
+
+def dependency_edges(tables):
+    """Edges of the dependency graph between ``tables``, the ``SyncTable`` of a push."""
+    by_model = {table.model: table.name for table in tables}
+    return [
+        Edge(table.name, field, by_model[related_model], nullable)
+        for table in tables
+        for field, related_model, nullable in references(table)
+        if related_model in by_model
+    ]
+
+
+def _find_cycle(names, edges):
+    """Edges of one cycle of the graph, or ``None`` when it is acyclic."""
+    outgoing = {name: [] for name in names}
+    for edge in edges:
+        outgoing[edge.table].append(edge)
+    state, path = {}, []
+
+    def visit(name):
+        state[name] = 'active'
+        for edge in outgoing[name]:
+            if edge.target == name:
+                return [edge]
+            if state.get(edge.target) == 'active':
+                # The cycle runs along the path from the target back to it
+                start = next(i for i, step in enumerate(path) if step.table == edge.target)
+                return path[start:] + [edge]
+            if edge.target not in state:
+                path.append(edge)
+                cycle = visit(edge.target)
+                if cycle is not None:
+                    return cycle
+                path.pop()
+        state[name] = 'done'
+        return None
+
+    for name in names:
+        if name not in state:
+            cycle = visit(name)
+            if cycle is not None:
+                return cycle
+    return None
+
+
+def break_cycles(names, edges):
+    """
+    Split ``edges`` into the ones kept and the ones deferred so the kept graph is acyclic.
+
+    Each cycle found defers one of its edges: a nullable one if it has any, and
+    preferably one pointing at a table listed later in ``names``, which keeps the
+    insert order closest to the order the tables are listed in.
+
+    Returns:
+        tuple: Lists of the kept and the deferred edges.
+    """
+    position = {name: index for index, name in enumerate(names)}
+    kept, deferred = list(edges), []
+    while True:
+        cycle = _find_cycle(names, kept)
+        if cycle is None:
+            return kept, deferred
+        edge = min(cycle, key=lambda e: (
+            not e.nullable, position[e.target] < position[e.table], position[e.table], e.field,
+        ))
+        kept.remove(edge)
+        deferred.append(edge)
+
+
+def insert_order(names, edges):
+    """Topological order of ``names`` under the acyclic ``edges``, ties in listed order."""
+    pending = {name: {edge.target for edge in edges if edge.table == name and edge.target != name} for name in names}
+    order = []
+    while pending:
+        name = next(name for name in names if name in pending and not pending[name])
+        order.append(name)
+        del pending[name]
+        for targets in pending.values():
+            targets.discard(name)
+    return order
+
+
+def build_plan(names, edges):
+    """
+    Plan the inserts of the tables ``names`` linked by ``edges``.
+
+    Returns:
+        PushPlan: Inserts in dependency order, then one fixup per deferred edge.
+    """
+    kept, deferred = break_cycles(names, edges)
+    order = insert_order(names, kept)
+    inserts = []
+    for index, name in enumerate(order):
+        later = order[index + 1:]
+        inserts.append((
+            name,
+            tuple(edge.field for edge in deferred if edge.table == name),
+            any(edge.target == name and edge.table in later for edge in kept),
+        ))
+    fixups = [(edge.table, edge.field) for name in order for edge in deferred if edge.table == name]
+    return PushPlan(tuple(inserts), tuple(fixups))
+
+
+@functools.lru_cache(maxsize=None)
+def _cached_plan(tables):
+    return build_plan([table.name for table in tables], dependency_edges(tables))
+
+
+def plan_push(tables, changes):
+    """
+    Plan the inserts of the records created by a push.
+
+    Args:
+        tables (tuple): ``SyncTable`` of each table of the endpoint, in registration order.
+        changes (dict): The pushed changes by table name.
+
+    Returns:
+        PushPlan: The plan, with tables named by their ``SyncTable``.
+    """
+    created = tuple(table for table in tables if changes.get(table.name, {}).get('created'))
+    plan = _cached_plan(created)
+    by_name = {table.name: table for table in created}
+    return PushPlan(
+        tuple((by_name[name], deferred, referenced) for name, deferred, referenced in plan.inserts),
+        tuple((by_name[name], field) for name, field in plan.fixups),
+    )
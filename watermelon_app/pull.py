@@ -0,0 +1,457 @@
+# myapp/pull.py
+"""
+Helpers shared by the sync views to read changes since a client's last pull.
+
+Paginated pulls walk each table in ``(updated_at, id)`` order, or the owner's
+subscriptions in ``(changed_at, record_id)`` order for models with sync rules.
+The position reached is handed back to the client as an opaque cursor, so every
+page is an index range scan that starts where the previous one stopped.
+
+Sequence pulls take the ``server_seq`` reached by the previous pull instead of
+a timestamp and read one index range per table, so no write committed between
+two pulls can be missed or sent twice.
+
+Every helper takes the ``owner`` whose rows are pulled and reads through the
+owner-leading indexes of the synced models, or through the owner's subscriptions
+for models with sync rules; without one, every row is pulled.
+
+Streamed pulls write the usual response envelope piece by piece while reading
+each queryset in chunks, so server memory does not grow with the delta size.
+
+The ``a``-prefixed helpers build unpaginated and streamed pulls through the async
+ORM for the async views, the buffered one reading every queryset concurrently.
+"""
+import asyncio
+import base64
+import datetime
+import itertools
+import json
+
+from django.db.models import Q
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from . import replica, subscriptions
+from .models import owned_rows
+from .records import aiterate, encoder_for
+from .renderers import dumps
+from .schema import add_migration_changes
+from .sequence import current_seq
+
+# Upper bound on the number of records returned by one page of a paginated pull
+MAX_PAGE_SIZE = 10000
+
+# Rows fetched from the database, and encoded, per step of a streamed pull
+STREAM_CHUNK_SIZE = 2000
+
+
+def parse_last_pulled_at(value):
+    """
+    Convert a ``last_pulled_at`` value (milliseconds since the Unix epoch) to a UTC datetime.
+    Missing values map to the earliest possible time, so that everything is pulled.
+
+    Raises:
+        ValidationError: If ``value`` is not a timestamp in milliseconds.
+    """
+    if not value:
+        return datetime.datetime.min.replace(tzinfo=datetime.timezone.utc)
+    try:
+        return datetime.datetime.fromtimestamp(int(value) / 1000, tz=datetime.timezone.utc)
+    except (OSError, OverflowError, TypeError, ValueError):
+        raise ValidationError('last_pulled_at must be a timestamp in milliseconds.')
+
+
+def current_timestamp():
+    """
+    Current server timestamp in milliseconds, or the time of the replica copy
+    when the pull reads from a replica.
+    """
+    return int((replica.copied_at() or timezone.now()).timestamp() * 1000)
+
+
+def changed_querysets(model, since, owner=None):
+    """
+    Querysets of the records of ``owner`` created, updated and deleted after
+    ``since``, as returned by an unpaginated pull.
+
+    Each one is answered by its own partial index on the model. The updated query
+    spells ``created_at <= since`` as a negation so that SQLite, which has no range
+    statistics, cannot pick the created-rows index for it.
+    """
+    if owner is not None and subscriptions.has_rules(model):
+        return subscriptions.changed_querysets(model, since, owner)
+    rows = owned_rows(model, owner)
+    return (
+        rows.filter(created_at__gt=since, deleted_at__isnull=True),
+        rows.filter(~Q(created_at__gt=since), updated_at__gt=since, deleted_at__isnull=True),
+        rows.filter(deleted_at__gt=since).values_list('id', flat=True),
+    )
+
+
+def pull_changes(tables, query_params, owner=None, migration=None):
+    """
+    Build an unpaginated pull of the rows of ``owner`` changed after ``last_pulled_at``.
+
+    Args:
+        tables (tuple): ``(name, model, serializer_class)`` for each synced table, in pull order.
+        query_params (QueryDict): Request parameters holding ``last_pulled_at``.
+        owner (User, optional): User whose rows are pulled.
+        migration (tuple, optional): Schema migration of the client, from ``parse_migration``;
+            the tables and columns it introduced are added to the changes.
+
+    Returns:
+        dict: The usual ``changes``/``timestamp`` payload.
+    """
+    since = parse_last_pulled_at(query_params.get('last_pulled_at'))
+    # Taken before any table is read, so a write committed meanwhile is pulled again next time
+    timestamp = current_timestamp()
+    changes = {}
+    for name, model, serializer_class in tables:
+        # Each query is a range scan on its own index; only the serializer's columns are read
+        created, updated, deleted = changed_querysets(model, since, owner)
+        encoder = encoder_for(serializer_class)
+        changes[name] = {
+            'created': encoder.records(created),
+            'updated': encoder.records(updated),
+            'deleted': list(deleted),
+        }
+    add_migration_changes(tables, changes, migration, owner)
+    return {'changes': changes, 'timestamp': timestamp}
+
+
+def encode_cursor(state):
+    return base64.urlsafe_b64encode(json.dumps(state).encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        state = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(state, dict):
+            raise ValueError
+        return state
+    except ValueError:
+        raise ValidationError('Invalid cursor.')
+
+
+def parse_limit(value):
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        raise ValidationError('limit must be an integer.')
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise ValidationError(f'limit must be between 1 and {MAX_PAGE_SIZE}.')
+    return limit
+
+
+def classify(rows, since):
+    """
+    Split rows changed after ``since`` into the created, updated and deleted lists
+    of the WatermelonDB protocol. Rows soft-deleted at or before ``since`` were
+    already reported as deleted and are skipped.
+    """
+    created, updated, deleted = [], [], []
+    for row in rows:
+        if row.deleted_at is not None:
+            if row.deleted_at > since:
+                deleted.append(row.pk)
+        elif row.created_at > since:
+            created.append(row)
+        else:
+            updated.append(row)
+    return created, updated, deleted
+
+
+def page_queryset(model, since, after=None, owner=None):
+    """
+    Rows of ``model`` owned by ``owner`` and changed after ``since``, in keyset
+    order, starting past the ``(updated_at, pk)`` position ``after`` when given.
+    """
+    queryset = owned_rows(model, owner).filter(updated_at__gt=since)
+    if after is not None:
+        # The redundant lower bound gives the planner a plain range start on the index
+        queryset = queryset.filter(
+            Q(updated_at__gt=after[0]) | Q(updated_at=after[0], pk__gt=after[1]), updated_at__gte=after[0]
+        )
+    return queryset.order_by('updated_at', 'pk')
+
+
+def _paged_by_subscriptions(model, owner):
+    return owner is not None and subscriptions.has_rules(model)
+
+
+def table_page(model, since, after, owner, limit):
+    """
+    Read at most ``limit`` changes of ``model`` past the keyset position ``after``.
+
+    Models with sync rules are paged through the owner's subscriptions, so records
+    entering or leaving the owner's scope are pulled as created or deleted.
+
+    Returns:
+        tuple: The created and updated rows, the deleted primary keys, the number
+        of changes read, and ``None`` when the table is exhausted, else the position
+        of the last change read (``()`` when nothing could be read).
+    """
+    # Fetch one change past the page to know whether this table has more
+    if _paged_by_subscriptions(model, owner):
+        page = list(subscriptions.page_queryset(model, since, owner, after).values_list(
+            'changed_at', 'record_id', 'left', 'entered_at'
+        )[:limit + 1])
+        more, page = len(page) > limit, page[:limit]
+        created, updated, deleted = subscriptions.page_changes(model, [change[1:] for change in page], since)
+        last = page[-1][:2] if page else ()
+    else:
+        rows = list(page_queryset(model, since, after, owner)[:limit + 1])
+        more, page = len(rows) > limit, rows[:limit]
+        created, updated, deleted = classify(page, since)
+        last = (page[-1].updated_at, page[-1].pk) if page else ()
+    return created, updated, deleted, len(page), last if more else None
+
+
+def paginated_changes(tables, query_params, owner=None):
+    """
+    Build one page of changes for ``tables``.
+
+    Args:
+        tables (tuple): ``(name, model, serializer_class)`` for each synced table, in pull order.
+        query_params (QueryDict): Request parameters holding ``limit`` and either
+            ``last_pulled_at`` for the first page or ``cursor`` for the following ones.
+        owner (User, optional): User whose rows are pulled.
+
+    Returns:
+        dict: The usual ``changes``/``timestamp`` payload plus ``has_more`` and the
+        ``cursor`` to send back for the next page (``None`` on the last page).
+        ``timestamp`` is the time of the first page, for every page.
+
+    Raises:
+        ValidationError: If ``limit`` or ``cursor`` is invalid.
+    """
+    limit = parse_limit(query_params.get('limit'))
+    if query_params.get('cursor'):
+        state = decode_cursor(query_params['cursor'])
+    else:
+        state = {'since': query_params.get('last_pulled_at'), 'timestamp': current_timestamp(), 'table': 0}
+
+    try:
+        since = parse_last_pulled_at(state['since'])
+        table_index = int(state['table'])
+        if not 0 <= table_index < len(tables):
+            raise IndexError(table_index)
+        after = None
+        if state.get('updated_at'):
+            model = tables[table_index][1]
+            # Subscription pages are keyed by the record_id column itself
+            key = state['id'] if _paged_by_subscriptions(model, owner) else model._meta.pk.to_python(state['id'])
+            after = (datetime.datetime.fromisoformat(state['updated_at']), key)
+    except (KeyError, IndexError, TypeError, ValueError, OverflowError):
+        raise ValidationError('Invalid cursor or last_pulled_at.')
+
+    changes = {name: {'created': [], 'updated': [], 'deleted': []} for name, _, _ in tables}
+    remaining = limit
+    next_position = None
+    for index in range(table_index, len(tables)):
+        name, model, serializer_class = tables[index]
+        created, updated, deleted, read, last = table_page(model, since, after, owner, remaining)
+        changes[name] = {
+            'created': serializer_class(created, many=True).data,
+            'updated': serializer_class(updated, many=True).data,
+            'deleted': deleted,
+        }
+        if last is not None:
+            next_position = (index, last or after)
+            break
+        remaining -= read
+        after = None
+
+    page = {'changes': changes, 'timestamp': state['timestamp'], 'has_more': next_position is not None, 'cursor': None}
+    if next_position is not None:
+        index, after = next_position
+        state = {'since': state['since'], 'timestamp': state['timestamp'], 'table': index}
+        if after is not None:
+            state.update(updated_at=after[0].isoformat(), id=str(after[1]))
+        page['cursor'] = encode_cursor(state)
+    return page
+
+
+def parse_last_seq(value):
+    """Convert a ``last_seq`` value to an int, raising ``ValidationError`` when it is not one."""
+    try:
+        last_seq = int(value)
+    except (TypeError, ValueError):
+        raise ValidationError('last_seq must be an integer.')
+    if last_seq < 0:
+        raise ValidationError('last_seq must not be negative.')
+    return last_seq
+
+
+def sequence_changes(tables, query_params, owner=None):
+    """
+    Build the changes written after the sequence value ``last_seq``.
+
+    The upper bound is read before any table, and every table is scanned for
+    ``last_seq < server_seq <= high`` only, so rows written while the pull runs
+    are left for the next one. A row is created when its ``created_seq`` is past
+    ``last_seq`` and deleted when it carries ``deleted_at``.
+
+    Args:
+        tables (tuple): ``(name, model, serializer_class)`` for each synced table, in pull order.
+        query_params (QueryDict): Request parameters holding ``last_seq``.
+        owner (User, optional): User whose rows are pulled.
+
+    Returns:
+        dict: The usual ``changes`` payload, with ``timestamp`` set to the sequence
+        value to send as ``last_seq`` on the next pull.
+
+    Raises:
+        ValidationError: If ``last_seq`` is invalid.
+    """
+    last_seq = parse_last_seq(query_params.get('last_seq'))
+    high = current_seq()
+
+    changes = {}
+    for name, model, serializer_class in tables:
+        entered, deleted = (), []
+        if owner is not None and subscriptions.has_rules(model):
+            # Records entering the owner's scope are created and those leaving it deleted
+            queryset, entered, deleted = subscriptions.sequence_changes(model, last_seq, high, owner)
+        else:
+            queryset = owned_rows(model, owner).filter(server_seq__gt=last_seq, server_seq__lte=high)
+        created, updated = [], []
+        for record, (deleted_at, created_seq, pk) in encoder_for(serializer_class).rows(
+            queryset, extra=('deleted_at', 'created_seq', 'pk')
+        ):
+            if deleted_at is not None:
+                deleted.append(pk)
+            elif created_seq > last_seq or pk in entered:
+                created.append(record)
+            else:
+                updated.append(record)
+        changes[name] = {'created': created, 'updated': updated, 'deleted': deleted}
+    return {'changes': changes, 'timestamp': high}
+
+
+def _stream_array(values, chunk_size):
+    """Yield a JSON array of ``values`` as UTF-8 bytes, encoding ``chunk_size`` items per step."""
+    values = iter(values)
+    yield b'['
+    separator = b''
+    while chunk := list(itertools.islice(values, chunk_size)):
+        yield separator + dumps(chunk)[1:-1]
+        separator = b','
+    yield b']'
+
+
+def stream_changes(tables, since, timestamp, chunk_size=STREAM_CHUNK_SIZE, created_only=False, owner=None):
+    """
+    Yield the body of an unpaginated pull response in UTF-8 chunks.
+
+    Only one chunk of rows is held in memory at a time: querysets are read with
+    ``.iterator()`` and each chunk is encoded as soon as it is built. The output
+    is byte-identical to the rendered ``Response`` of a regular pull.
+
+    With ``created_only``, each table holds its ``created`` list alone, as the
+    turbo first sync of WatermelonDB requires. With ``owner``, only that user's
+    rows are read.
+    """
+    yield b'{"changes":{'
+    for index, (name, model, serializer_class) in enumerate(tables):
+        created, updated, deleted = changed_querysets(model, since, owner)
+        encoder = encoder_for(serializer_class)
+        yield (b',' if index else b'') + dumps(name) + b':{"created":'
+        yield from _stream_array(encoder.rows(created, chunk_size), chunk_size)
+        if not created_only:
+            yield b',"updated":'
+            yield from _stream_array(encoder.rows(updated, chunk_size), chunk_size)
+            yield b',"deleted":'
+            yield from _stream_array(deleted.iterator(chunk_size), chunk_size)
+        yield b'}'
+    yield f'}},"timestamp":{timestamp}}}'.encode()
+
+
+def streaming_response(tables, query_params, owner=None):
+    """
+    Build a ``StreamingHttpResponse`` for an unpaginated pull of the rows of
+    ``owner``. The timestamp is taken before any table is read, so changes
+    committed while streaming are pulled again next time rather than missed.
+    """
+    since = parse_last_pulled_at(query_params.get('last_pulled_at'))
+    return StreamingHttpResponse(
+        stream_changes(tables, since, current_timestamp(), owner=owner), content_type='application/json'
+    )
+
+
+async def _astream_array(values, chunk_size):
+    """``_stream_array()`` for an asynchronous iterable of ``values``."""
+    yield b'['
+    separator, chunk = b'', []
+    async for value in values:
+        chunk.append(value)
+        if len(chunk) == chunk_size:
+            yield separator + dumps(chunk)[1:-1]
+            separator, chunk = b',', []
+    if chunk:
+        yield separator + dumps(chunk)[1:-1]
+    yield b']'
+
+
+async def astream_changes(tables, since, timestamp, chunk_size=STREAM_CHUNK_SIZE, owner=None):
+    """``stream_changes()`` read through the async ORM, yielding the same bytes."""
+    yield b'{"changes":{'
+    for index, (name, model, serializer_class) in enumerate(tables):
+        created, updated, deleted = changed_querysets(model, since, owner)
+        encoder = encoder_for(serializer_class)
+        yield (b',' if index else b'') + dumps(name) + b':{"created":'
+        async for chunk in _astream_array(encoder.arows(created, chunk_size), chunk_size):
+            yield chunk
+        yield b',"updated":'
+        async for chunk in _astream_array(encoder.arows(updated, chunk_size), chunk_size):
+            yield chunk
+        yield b',"deleted":'
+        async for chunk in _astream_array(aiterate(deleted, chunk_size), chunk_size):
+            yield chunk
+        yield b'}'
+    yield f'}},"timestamp":{timestamp}}}'.encode()
+
+
+def astreaming_response(tables, query_params, owner=None):
+    """``streaming_response()`` whose content is produced by ``astream_changes()``."""
+    since = parse_last_pulled_at(query_params.get('last_pulled_at'))
+    return StreamingHttpResponse(
+        astream_changes(tables, since, current_timestamp(), owner=owner), content_type='application/json'
+    )
+
+
+async def _alist(queryset):
+    return [value async for value in queryset]
+
+
+async def _atable_changes(model, serializer_class, since, owner):
+    created, updated, deleted = changed_querysets(model, since, owner)
+    encoder = encoder_for(serializer_class)
+    created, updated, deleted = await asyncio.gather(
+        encoder.arecords(created), encoder.arecords(updated), _alist(deleted)
+    )
+    return {'created': created, 'updated': updated, 'deleted': deleted}
+
+
+async def apull_changes(tables, query_params, owner=None):
+    """
+    Build an unpaginated pull of the rows of ``owner`` changed after ``last_pulled_at``
+    through the async ORM, with the created, updated and deleted queries of every
+    table awaited together.
+
+    Args:
+        tables (tuple): ``(name, model, serializer_class)`` for each synced table, in pull order.
+        query_params (QueryDict): Request parameters holding ``last_pulled_at``.
+        owner (User, optional): User whose rows are pulled.
+
+    Returns:
+        dict: The usual ``changes``/``timestamp`` payload. The timestamp is taken
+        before any table is read.
+    """
+    since = parse_last_pulled_at(query_params.get('last_pulled_at'))
+    timestamp = current_timestamp()
+    changes = await asyncio.gather(
+        *(_atable_changes(model, serializer_class, since, owner) for _, model, serializer_class in tables)
+    )
+    return {'changes': {name: table for (name, _, _), table in zip(tables, changes)}, 'timestamp': timestamp}
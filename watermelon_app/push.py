@@ -0,0 +1,462 @@
+# myapp/push.py
+"""
+Set-based helpers used by the sync views to apply a pushed batch of changes.
+
+Every helper works on a whole table batch at once, so the number of SQL
+statements a push issues does not grow with the number of records in it.
+Failures are returned as ``(item, exception)`` pairs in the order the items
+were pushed, which lets each view keep formatting its own error report.
+
+Given the pushing ``owner``, the helpers stamp it on created records and treat
+the rows of other users, whether written to or referenced, as missing.
+
+``bulk_create_linked`` inserts the created records of several tables in one
+pass, with the foreign keys between them in place, on databases that check
+those keys only at commit.
+"""
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import connection
+from django.db.models import Manager
+from django.utils import timezone
+from rest_framework.exceptions import ErrorDetail, ValidationError
+from rest_framework.relations import PrimaryKeyRelatedField
+from rest_framework.validators import UniqueValidator
+
+from .models import OwnedQuerySet, owned_rows
+from .sequence import next_seq
+from .validation import INVALID, BatchRelatedField, compile_validator
+
+
+class BatchUniqueValidator:
+    """
+    Drop-in replacement for DRF's ``UniqueValidator`` that checks values against
+    a lookup prefetched for the whole batch instead of querying once per record.
+
+    Values claimed by earlier records of the same batch count as taken, which
+    mirrors the per-record save order of the serializer path.
+    """
+    requires_context = True
+
+    def __init__(self, message, taken):
+        self.message = message
+        self.taken = taken
+
+    def __call__(self, value, serializer_field):
+        instance = getattr(serializer_field.parent, 'instance', None)
+        owner = self.taken.get(value)
+        if owner is not None and (instance is None or owner != instance.pk):
+            raise ValidationError(self.message, code='unique')
+
+    def claim(self, value, owner):
+        self.taken[value] = owner
+
+
+def parse_ids(model, raw_ids):
+    """
+    Convert client-supplied IDs to primary key values of ``model``.
+
+    Returns:
+        tuple: ``(pks, failures)`` where ``pks`` maps each position in ``raw_ids``
+        to its parsed primary key and ``failures`` maps positions to the error raised.
+    """
+    pks, failures = {}, {}
+    pk_field = model._meta.pk
+    for position, raw_id in enumerate(raw_ids):
+        try:
+            # Same conversion, and same errors, as an ``objects.get(pk=...)`` lookup
+            pks[position] = pk_field.get_prep_value(raw_id)
+        except (DjangoValidationError, TypeError, ValueError) as e:
+            failures[position] = e
+    return pks, failures
+
+
+def does_not_exist(model):
+    """Build the same exception ``model.objects.get()`` raises for a missing row."""
+    return model.DoesNotExist(f'{model._meta.object_name} matching query does not exist.')
+
+
+def write_stamps(model):
+    """
+    Values every write stamps on a row that ``update()`` does not set on its own:
+    the ``auto_now`` fields and the next server sequence value.
+    """
+    now = timezone.now()
+    stamps = {f.name: now for f in model._meta.concrete_fields if getattr(f, 'auto_now', False)}
+    stamps['server_seq'] = next_seq()
+    return stamps
+
+
+def bulk_write(model, records, fields):
+    """
+    Write ``fields`` of ``records`` with one ``bulk_update`` and apply ``write_stamps``
+    with one plain ``UPDATE``. Keeping the shared stamps out of the ``CASE WHEN``
+    expression halves the work Django does to build the statement.
+    """
+    if fields:
+        model._default_manager.bulk_update(records, fields)
+    model._default_manager.filter(pk__in=[r.pk for r in records]).update(**write_stamps(model))
+
+
+def prepare_serializer(serializer_class, items, partial=False, owner=None, pending=None):
+    """
+    Build one serializer instance to validate every record in ``items``.
+
+    Each ``UniqueValidator`` is swapped for a ``BatchUniqueValidator`` fed by a
+    single ``IN`` query over the values present in the batch. On partial updates
+    the primary key field is not checked, as it is what the instance was looked
+    up by.
+
+    Each ``PrimaryKeyRelatedField`` is swapped for a ``BatchRelatedField``, which
+    resolves the keys referenced by the batch with one ``IN`` query. With
+    ``owner``, related fields only accept rows of that user. With ``pending``, a
+    ``{model: primary keys}`` mapping of the records created by the same push,
+    they also accept those records.
+    """
+    serializer = serializer_class(partial=partial)
+    model = serializer.Meta.model
+    for name, field in list(serializer.fields.items()):
+        if isinstance(field, PrimaryKeyRelatedField) and isinstance(field.queryset, Manager):
+            # Fields generated by ModelSerializer hold the related model's manager
+            field.queryset = field.queryset.all()
+        owned_relation = isinstance(field, PrimaryKeyRelatedField) and isinstance(field.queryset, OwnedQuerySet)
+        if owner is not None and owned_relation:
+            field.queryset = field.queryset.owned_by(owner)
+        if isinstance(field, PrimaryKeyRelatedField) and not field.read_only:
+            serializer.fields[name] = field = _batch_related_field(field, items, (pending or {}).get(field.queryset.model))
+        if field.read_only or not any(isinstance(v, UniqueValidator) for v in field.validators):
+            continue
+        validators = []
+        for validator in field.validators:
+            if not isinstance(validator, UniqueValidator):
+                validators.append(validator)
+            elif not (partial and field.source == model._meta.pk.name):
+                taken = _prefetch_taken(model, field, items)
+                validators.append(BatchUniqueValidator(validator.message, taken))
+        field.validators = validators
+    return serializer
+
+
+def _batch_related_field(field, items, pending=None):
+    pending = pending or frozenset()
+    replacement = BatchRelatedField({}, pending, *field._args, **{**field._kwargs, 'queryset': field.queryset})
+    values = set()
+    for item in items:
+        if isinstance(item, dict) and item.get(field.field_name) is not None:
+            pk = replacement.parse_pk(item[field.field_name])
+            if pk is not None and pk not in pending:
+                values.add(pk)
+    if values:
+        replacement.resolved = field.queryset.in_bulk(values)
+    return replacement
+
+
+def _prefetch_taken(model, field, items):
+    values = set()
+    for item in items:
+        if not isinstance(item, dict) or field.field_name not in item:
+            continue
+        try:
+            values.add(field.to_internal_value(item[field.field_name]))
+        except Exception:
+            # Invalid values are reported by the field itself during validation
+            continue
+    if not values:
+        return {}
+    return dict(
+        model._default_manager.filter(**{f'{field.source}__in': values}).values_list(field.source, 'pk')
+    )
+
+
+def validate_batch(serializer, items, instances=None):
+    """
+    Validate ``items`` with a serializer built by ``prepare_serializer``, through
+    its compiled column checks where possible (see ``validation.py``).
+
+    Args:
+        serializer: Serializer instance shared by the whole batch.
+        items (list): Raw records to validate.
+        instances (list, optional): Model instance for each item on partial updates.
+
+    Returns:
+        list: ``(position, validated_data, exception)`` triples in item order; exactly
+        one of ``validated_data`` and ``exception`` is set.
+    """
+    pk_name = serializer.Meta.model._meta.pk.name
+    batch_validators = [
+        (field.source, validator)
+        for field in serializer.fields.values()
+        for validator in field.validators
+        if isinstance(validator, BatchUniqueValidator)
+    ]
+    compiled = compile_validator(serializer)
+    results = []
+    for position, item in enumerate(items):
+        serializer.instance = instances[position] if instances else None
+        # Well-formed records are checked column by column; the others, and every
+        # record of a serializer that cannot be compiled, by the serializer itself
+        data = compiled(item) if compiled is not None else INVALID
+        if data is INVALID:
+            try:
+                data = serializer.run_validation(item)
+            except ValidationError as e:
+                results.append((position, None, e))
+                continue
+        owner = serializer.instance.pk if serializer.instance else data.get(pk_name) or object()
+        for source, validator in batch_validators:
+            if source in data:
+                validator.claim(data[source], owner)
+        results.append((position, data, None))
+    serializer.instance = None
+    return results
+
+
+def _validate_created(serializer_class, items, deferred_fields=(), owner=None, pending=None):
+    """
+    Validate created records into unsaved model instances.
+
+    Returns:
+        tuple: ``(position, instance)`` pairs of the valid records and
+        ``(item, exception)`` pairs of the others.
+    """
+    stripped = [{k: v for k, v in item.items() if k not in deferred_fields} for item in items]
+    serializer = prepare_serializer(serializer_class, stripped, owner=owner, pending=pending)
+    model = serializer.Meta.model
+    failures, objs = [], []
+    for position, data, error in validate_batch(serializer, stripped):
+        if error is not None:
+            failures.append((items[position], error))
+        else:
+            objs.append((position, model(**data)))
+    return objs, failures
+
+
+def _insert_created(model, objs, owner=None):
+    """Insert validated records with one ``bulk_create``, stamped with their sequence and owner."""
+    if not objs:
+        return
+    # A user's own row is its owner; there is nothing to stamp
+    stamp_owner = owner is not None and model.owner_field != 'pk'
+    # bulk_create skips pre_save signals, so the batch is sequenced here
+    seq = next_seq()
+    for obj in objs:
+        obj.server_seq = obj.created_seq = seq
+        if stamp_owner:
+            setattr(obj, model.owner_field, owner)
+    model._default_manager.bulk_create(objs)
+
+
+def bulk_create_records(serializer_class, items, deferred_fields=(), owner=None):
+    """
+    Validate and insert created records with a single ``bulk_create``.
+
+    Args:
+        serializer_class (class): Serializer used to validate each record.
+        items (list): Created records as pushed by the client.
+        deferred_fields (tuple): Fields stripped before validation, to be set later
+            by ``bulk_assign_fk`` once every record in the push exists.
+        owner (User, optional): User pushing the records, stamped as their owner.
+
+    Returns:
+        list: ``(item, exception)`` pairs for records that failed validation.
+    """
+    objs, failures = _validate_created(serializer_class, items, deferred_fields, owner)
+    _insert_created(serializer_class.Meta.model, [obj for _, obj in objs], owner)
+    return failures
+
+
+def can_defer_constraint_checks():
+    """Whether the database can check foreign keys at commit, as ``bulk_create_linked`` needs."""
+    return connection.vendor in ('sqlite', 'postgresql')
+
+
+def defer_constraint_checks():
+    """
+    Check foreign keys only when the current transaction commits. SQLite resets
+    the pragma at the end of the transaction; PostgreSQL defers the constraints
+    declared deferrable, as Django declares foreign keys.
+    """
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute('PRAGMA defer_foreign_keys = ON')
+        elif connection.vendor == 'postgresql':
+            cursor.execute('SET CONSTRAINTS ALL DEFERRED')
+
+
+def _missing_link(field, value):
+    message = PrimaryKeyRelatedField.default_error_messages['does_not_exist'].format(pk_value=value)
+    return ValidationError({field: [ErrorDetail(message, code='does_not_exist')]})
+
+
+def bulk_create_linked(batches, owner=None):
+    """
+    Validate and insert the created records of several tables in one pass, with
+    the foreign keys between them in place: a record may point at any record
+    created by the same push, whatever the order of the inserts. Must run inside
+    a transaction after ``defer_constraint_checks()``.
+
+    Records pointing at a record of the push that failed are not inserted either,
+    so every key holds at commit.
+
+    Args:
+        batches (list): ``(serializer_class, items)`` for each table with created records.
+        owner (User, optional): User pushing the records, stamped as their owner.
+
+    Returns:
+        list: The ``(item, exception)`` failures of each batch, in batch order.
+    """
+    pending = {}
+    for serializer_class, items in batches:
+        model = serializer_class.Meta.model
+        pks, _ = parse_ids(model, [item.get('id') for item in items])
+        pending.setdefault(model, set()).update(pk for pk in pks.values() if pk is not None)
+
+    validated, failures = [], []
+    for serializer_class, items in batches:
+        objs, batch_failures = _validate_created(serializer_class, items, owner=owner, pending=pending)
+        validated.append(dict(objs))
+        failures.append(batch_failures)
+
+    def inserted():
+        found = {model: set() for model in pending}
+        for (serializer_class, _), objs in zip(batches, validated):
+            found[serializer_class.Meta.model].update(obj.pk for obj in objs.values())
+        return found
+
+    # Records of the push that failed but were already created by an earlier one can be linked to
+    existing = {}
+    for model, pks in inserted().items():
+        missing = pending[model] - pks
+        found = owned_rows(model, owner).filter(pk__in=missing).values_list('pk', flat=True) if missing else ()
+        existing[model] = set(found)
+
+    # Drop the records linked to records of the push that are not inserted, until none is left
+    links = [
+        [field for field in serializer_class.Meta.model._meta.concrete_fields if field.related_model in pending]
+        for serializer_class, _ in batches
+    ]
+    while True:
+        available = {model: pks | existing[model] for model, pks in inserted().items()}
+        dropped = False
+        for (serializer_class, items), objs, fields, batch_failures in zip(batches, validated, links, failures):
+            for position, obj in list(objs.items()):
+                for field in fields:
+                    value = getattr(obj, field.attname)
+                    if value in pending[field.related_model] and value not in available[field.related_model]:
+                        batch_failures.append((items[position], _missing_link(field.name, value)))
+                        del objs[position]
+                        dropped = True
+                        break
+        if not dropped:
+            break
+
+    for (serializer_class, items), objs, batch_failures in zip(batches, validated, failures):
+        _insert_created(serializer_class.Meta.model, list(objs.values()), owner)
+        # Failures in the order the items were pushed
+        order = {id(item): position for position, item in enumerate(items)}
+        batch_failures.sort(key=lambda failure: order[id(failure[0])])
+    return failures
+
+
+def bulk_assign_fk(model, fk_field, items, owner=None):
+    """
+    Point ``fk_field`` of each created record at the target named in its item.
+
+    Records and targets are each resolved with one query and the assignments are
+    written with one ``bulk_update``. With ``owner``, both must belong to that user.
+
+    Returns:
+        list: ``(item, exception)`` pairs for records that could not be updated.
+    """
+    items = [item for item in items if fk_field in item]
+    target_model = model._meta.get_field(fk_field).related_model
+    pks, pk_failures = parse_ids(model, [item.get('id') for item in items])
+    target_pks, target_failures = parse_ids(target_model, [item[fk_field] for item in items])
+    records = owned_rows(model, owner).in_bulk(set(pks.values()) - {None})
+    targets = set(
+        owned_rows(target_model, owner).filter(pk__in=set(target_pks.values()) - {None})
+        .values_list('pk', flat=True)
+    )
+
+    failures, changed = [], {}
+    attname = model._meta.get_field(fk_field).attname
+    for position, item in enumerate(items):
+        if position in pk_failures:
+            failures.append((item, pk_failures[position]))
+        elif pks[position] not in records:
+            failures.append((item, does_not_exist(model)))
+        elif position in target_failures:
+            failures.append((item, target_failures[position]))
+        elif target_pks[position] not in targets:
+            failures.append((item, does_not_exist(target_model)))
+        else:
+            record = records[pks[position]]
+            setattr(record, attname, target_pks[position])
+            changed[record.pk] = record
+    if changed:
+        bulk_write(model, list(changed.values()), [fk_field])
+    return failures
+
+
+def bulk_apply_updated(serializer_class, items, owner=None):
+    """
+    Validate partial updates and write them with a single ``bulk_update``.
+    With ``owner``, records of other users are reported as missing.
+
+    Returns:
+        list: ``(item, exception)`` pairs where the exception is the model's
+        ``DoesNotExist`` for unknown IDs, a DRF ``ValidationError`` for invalid
+        data, or whatever parsing the ID raised.
+    """
+    model = serializer_class.Meta.model
+    pks, pk_failures = parse_ids(model, [item.get('id') for item in items])
+    records = owned_rows(model, owner).in_bulk(set(pks.values()) - {None})
+
+    failures, found = {}, []
+    for position, item in enumerate(items):
+        if position in pk_failures:
+            failures[position] = pk_failures[position]
+        elif pks[position] not in records:
+            failures[position] = does_not_exist(model)
+        else:
+            found.append(position)
+
+    serializer = prepare_serializer(serializer_class, [items[p] for p in found], partial=True, owner=owner)
+    instances = [records[pks[p]] for p in found]
+    changed, fields = {}, set()
+    for index, data, error in validate_batch(serializer, [items[p] for p in found], instances):
+        if error is not None:
+            failures[found[index]] = error
+            continue
+        record = instances[index]
+        for attr, value in data.items():
+            setattr(record, attr, value)
+        changed[record.pk] = record
+        fields.update(data)
+    if changed:
+        fields.discard(model._meta.pk.name)
+        bulk_write(model, list(changed.values()), sorted(fields))
+    return [(items[position], failures[position]) for position in sorted(failures)]
+
+
+def bulk_soft_delete(model, ids, owner=None):
+    """
+    Soft delete records by stamping ``deleted_at`` with one ``UPDATE ... WHERE id IN``.
+    With ``owner``, records of other users are reported as missing.
+
+    Returns:
+        list: ``(id, exception)`` pairs for IDs that could not be deleted.
+    """
+    pks, pk_failures = parse_ids(model, ids)
+    existing = set(
+        owned_rows(model, owner).filter(pk__in=set(pks.values()) - {None}).values_list('pk', flat=True)
+    )
+    if existing:
+        model._default_manager.filter(pk__in=existing).update(deleted_at=timezone.now(), **write_stamps(model))
+
+    failures = []
+    for position, record_id in enumerate(ids):
+        if position in pk_failures:
+            failures.append((record_id, pk_failures[position]))
+        elif pks[position] not in existing:
+            failures.append((record_id, does_not_exist(model)))
+    return failures
@@ -0,0 +1,152 @@
+# myapp/records.py
+"""
+Serializer-free encoding of pulled records.
+
+A ``RecordEncoder`` reads the columns behind a serializer's ``Meta.fields`` with
+``values_list`` and builds the WatermelonDB record for each row directly, without
+creating model instances or running DRF fields per row. The records it produces
+render to exactly the same JSON as ``serializer_class(queryset, many=True).data``.
+"""
+import functools
+import itertools
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
+
+
+def _iso_datetime(tz):
+    """Build a converter matching ``serializers.DateTimeField`` in its default ISO 8601 format."""
+    def convert(value):
+        value = value.astimezone(tz).isoformat()
+        if value.endswith('+00:00'):
+            value = value[:-6] + 'Z'
+        return value
+    return convert
+
+
+async def aiterate(queryset, chunk_size):
+    """
+    Read ``queryset.iterator(chunk_size)`` from async code, one chunk per hop to
+    the sync thread. Unlike ``aiterator()``, which runs the query of a
+    ``values_list`` queryset in the calling thread, every query runs in the sync thread.
+    """
+    iterator = None
+
+    def next_chunk():
+        nonlocal iterator
+        if iterator is None:
+            iterator = queryset.iterator(chunk_size)
+        return list(itertools.islice(iterator, chunk_size))
+
+    while chunk := await sync_to_async(next_chunk)():
+        for row in chunk:
+            yield row
+
+
+class RecordEncoder:
+    """
+    Column spec for one serializer: the model column read for each output field and
+    how its value is represented. Build instances with ``encoder_for()``, which
+    caches one per serializer class and field subset.
+    """
+
+    def __init__(self, serializer_class, fields=None):
+        self.serializer_class = serializer_class
+        model = serializer_class.Meta.model
+        self.names, self.columns, self.converters = [], [], []
+        self.datetime_positions = []
+        for name, field in serializer_class().fields.items():
+            if fields is not None and name not in fields:
+                continue
+            model_field = model._meta.get_field(field.source)
+            self.names.append(name)
+            self.columns.append(model_field.attname)
+            self.converters.append(self._converter(field, model_field))
+            if self.converters[-1] is _iso_datetime:
+                self.datetime_positions.append(len(self.names) - 1)
+
+    @staticmethod
+    def _converter(field, model_field):
+        """
+        Return ``None`` when the stored value is already its own representation,
+        ``_iso_datetime`` for timestamps (bound to the current timezone per read)
+        and the DRF field's ``to_representation`` for anything without a fast path.
+        """
+        if isinstance(field, serializers.PrimaryKeyRelatedField) and field.pk_field is None:
+            target = model_field.target_field
+            return str if target.get_internal_type() == 'UUIDField' else None
+        if isinstance(field, serializers.DateTimeField):
+            output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+            if settings.USE_TZ and output_format and output_format.lower() == ISO_8601 and not hasattr(field, 'timezone'):
+                return _iso_datetime
+        elif isinstance(field, serializers.UUIDField):
+            if field.uuid_format == 'hex_verbose':
+                return str
+        elif isinstance(field, (serializers.CharField, serializers.IntegerField)):
+            return None
+        return field.to_representation
+
+    def _encoder(self, extra):
+        """Build the function turning one ``values_list`` row into its record, or ``(record, extra_values)``."""
+        converters = list(self.converters)
+        if self.datetime_positions:
+            convert_datetime = _iso_datetime(timezone.get_current_timezone())
+            for position in self.datetime_positions:
+                converters[position] = convert_datetime
+        converted = [(position, convert) for position, convert in enumerate(converters) if convert is not None]
+        names = self.names
+        width = len(self.columns)
+
+        def encode(row):
+            row = list(row)
+            for position, convert in converted:
+                value = row[position]
+                if value is not None:
+                    row[position] = convert(value)
+            if extra:
+                return dict(zip(names, row)), row[width:]
+            return dict(zip(names, row))
+        return encode
+
+    def rows(self, queryset, chunk_size=None, extra=()):
+        """
+        Yield one record dict per row of ``queryset``.
+
+        Args:
+            queryset (QuerySet): Rows to encode; its model must match the serializer's.
+            chunk_size (int, optional): Read the rows with ``.iterator(chunk_size)``
+                instead of loading them all at once.
+            extra (tuple, optional): Additional columns read along with the record.
+                When given, ``(record, extra_values)`` pairs are yielded instead.
+        """
+        encode = self._encoder(extra)
+        values = queryset.values_list(*self.columns, *extra)
+        for row in values.iterator(chunk_size) if chunk_size else values:
+            yield encode(row)
+
+    async def arows(self, queryset, chunk_size=None, extra=()):
+        """Asynchronous ``rows()``, reading ``queryset`` through the async ORM."""
+        encode = self._encoder(extra)
+        values = queryset.values_list(*self.columns, *extra)
+        async for row in aiterate(values, chunk_size) if chunk_size else values:
+            yield encode(row)
+
+    def records(self, queryset):
+        """Return the list of records for ``queryset``, like ``serializer.data`` with ``many=True``."""
+        return list(self.rows(queryset))
+
+    async def arecords(self, queryset):
+        """Asynchronous ``records()``."""
+        return [record async for record in self.arows(queryset)]
+
+
+@functools.cache
+def encoder_for(serializer_class, fields=None):
+    """
+    Return the cached encoder of ``serializer_class``, limited to the ``fields``
+    tuple of output names when given.
+    """
+    return RecordEncoder(serializer_class, fields)
@@ -0,0 +1,58 @@
+# myapp/registry.py
+"""
+Declarative registry of the synced tables.
+
+Each synced model is registered once, from the ``ready()`` of its app, with its
+WatermelonDB table name and the serializer listing its synced fields, whose
+foreign keys to other synced tables are the dependencies the push planner in
+``planner.py`` orders inserts by. Scoping is declared on the model itself, by
+``owner_field`` and the sync rules in ``visible_to``.
+
+Registering a model also hooks it into server sequencing, the change journal,
+the ETag watermarks, subscriptions and, unless ``compacted`` is false,
+tombstone compaction. The engine in ``engine.py`` then drives pulls and pushes
+of every table of an endpoint from ``tables_of()``.
+"""
+from collections import namedtuple
+
+from . import compaction, journal, sequence, subscriptions, watermarks
+
+# Unpacks like the ``(name, model, serializer_class)`` triples the pull helpers take
+SyncTable = namedtuple('SyncTable', ['name', 'model', 'serializer_class'])
+
+_tables = {}
+
+
+def register(name, model, serializer_class, compacted=True):
+    """
+    Sync ``model`` as the WatermelonDB table ``name``.
+
+    Args:
+        name (str): Table name on the client.
+        model (class): Synced model, scoped by its ``owner_field`` or ``visible_to``.
+        serializer_class (class): Serializer whose fields are the synced columns.
+        compacted (bool): Whether compaction may hard-delete old tombstones of the model.
+
+    Raises:
+        ValueError: If another model is already registered as ``name``.
+    """
+    registered = _tables.get(name)
+    if registered is not None and registered.model is not model:
+        raise ValueError(f'Sync table {name!r} is already registered for {registered.model._meta.label}.')
+    _tables[name] = SyncTable(name, model, serializer_class)
+    sequence.register(model)
+    journal.register(model)
+    watermarks.register(model)
+    subscriptions.register(model)
+    if compacted:
+        compaction.register(model)
+
+
+def tables_of(app_label):
+    """
+    Returns:
+        tuple: The ``SyncTable`` of every model of ``app_label``, in registration
+        order, which is the order they are pulled and pushed in.
+    """
+    return tuple(table for table in _tables.values() if table.model._meta.app_label == app_label)
+
@@ -0,0 +1,54 @@
+# myapp/renderers.py
+"""
+JSON rendering for the sync endpoints.
+
+Pull responses are large and made only of plain JSON types, UUIDs and datetimes,
+so they are rendered with orjson when it is installed. Without it, a reusable
+stdlib encoder is used that skips the per-call setup and circular reference
+checks of ``json.dumps``.
+"""
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils import encoders
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_drf_default = encoders.JSONEncoder().default
+
+# Compact and non-ASCII preserving, like DRF's JSONRenderer with default settings
+_stdlib_encoder = encoders.JSONEncoder(
+    ensure_ascii=False, allow_nan=False, check_circular=False, separators=(',', ':')
+)
+
+
+def dumps(data):
+    """
+    Encode ``data`` to UTF-8 JSON bytes with the fastest available backend.
+
+    UUIDs and datetimes are handled natively by orjson, with UTC written as ``Z``
+    like DRF does. Anything else neither backend knows about goes through DRF's
+    encoder.
+    """
+    if orjson is not None:
+        ret = orjson.dumps(data, default=_drf_default, option=orjson.OPT_UTC_Z)
+        # Keep the output valid JavaScript, as DRF does; the bytes only occur inside strings
+        return ret.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
+    ret = _stdlib_encoder.encode(data)
+    # Keep the output valid JavaScript, as DRF does
+    return ret.replace('\u2028', '\\u2028').replace('\u2029', '\\u2029').encode()
+
+
+class SyncJSONRenderer(JSONRenderer):
+    """
+    Renderer used by the sync views. Falls back to DRF's own rendering when the
+    client asks for indented output.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if self.get_indent(accepted_media_type or '', renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        return dumps(data)
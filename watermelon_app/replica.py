@@ -0,0 +1,213 @@
+# myapp/replica.py
+"""
+Read-replica routing for pulls.
+
+With ``SYNC_READ_FROM_REPLICA`` set, the queries of a pull are sent to the
+``SYNC_REPLICA_DATABASE`` alias while pushes and everything else stay on the
+primary. ``ReplicaRouter`` routes reads by a context variable that
+``read_replica`` sets around the ``get`` of a sync view, and around the streamed
+body of its response, so it holds in threads and in async views alike.
+
+A pull stays on the primary when the replica cannot answer it consistently:
+when the replica is unreadable or its copy is older than ``SYNC_REPLICA_MAX_LAG``
+seconds, when the client's cursor is already past the copy, and for
+``SYNC_REPLICA_STICKY_SECONDS`` after the same user and device (``X-Device-Id``)
+pushed, so a device reads its own writes. Pins are ``ReplicaPin`` rows of the
+primary database, so they hold across workers.
+
+Pulls served by the replica are stamped with the time of its copy rather than
+the current time, so the next pull asks again for everything written since.
+
+``refresh()``, run by ``manage.py sync_sqlite_replica``, keeps a local SQLite
+replica fresh with SQLite's online backup API, standing in for a database server
+replica.
+"""
+import contextlib
+import contextvars
+import datetime
+import functools
+import os
+import sqlite3
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import ChangeJournal, ReplicaPin, ReplicaState, ServerSequence
+
+# (alias, copied_at) of the replica the current pull reads from, or None for the primary
+_reading = contextvars.ContextVar('sync_replica_reading', default=None)
+
+
+class ReplicaRouter:
+    """Database router sending the reads of replica pulls to the replica; the replica is never migrated."""
+
+    def db_for_read(self, model, **hints):
+        reading = _reading.get()
+        return reading[0] if reading is not None else None
+
+    def db_for_write(self, model, **hints):
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == settings.SYNC_REPLICA_DATABASE:
+            return False
+        return None
+
+
+def copied_at():
+    """Time of the replica copy the current pull reads from, or ``None`` on the primary."""
+    reading = _reading.get()
+    return reading[1] if reading is not None else None
+
+
+def _device_id(request):
+    return request.headers.get('X-Device-Id', '')[:ReplicaPin._meta.get_field('device_id').max_length]
+
+
+def pin(request):
+    """Keep the pulls of the user and device behind ``request`` on the primary for a while."""
+    if settings.SYNC_READ_FROM_REPLICA:
+        until = timezone.now() + datetime.timedelta(seconds=settings.SYNC_REPLICA_STICKY_SECONDS)
+        ReplicaPin.objects.update_or_create(user=request.user, device_id=_device_id(request), defaults={'until': until})
+
+
+def pinned(request):
+    """Whether the pulls of the user and device behind ``request`` are kept on the primary."""
+    return ReplicaPin.objects.using('default').filter(
+        user=request.user, device_id=_device_id(request), until__gt=timezone.now()
+    ).exists()
+
+
+def _ahead_of(query_params, alias, copied):
+    """Whether the cursor in ``query_params`` is past what the replica copy holds."""
+    try:
+        if query_params.get('last_seq'):
+            replica_seq = ServerSequence.objects.using(alias).filter(pk=1).values_list('value', flat=True).first()
+            return int(query_params['last_seq']) > (replica_seq or 0)
+        if query_params.get('journal_seq'):
+            high = ChangeJournal.objects.using(alias).aggregate(high=Max('seq'))['high']
+            return int(query_params['journal_seq']) > (high or 0)
+        if query_params.get('last_pulled_at'):
+            return int(query_params['last_pulled_at']) > copied.timestamp() * 1000
+    except (TypeError, ValueError):
+        # Malformed cursors are rejected by the pull, wherever it runs
+        pass
+    return False
+
+
+def choose(request):
+    """
+    Pick the database a pull reads from.
+
+    Returns:
+        tuple: ``(alias, copied_at)`` of the replica, or ``None`` for the primary.
+    """
+    if not settings.SYNC_READ_FROM_REPLICA or pinned(request):
+        return None
+    alias = settings.SYNC_REPLICA_DATABASE
+    try:
+        copied = ReplicaState.objects.using(alias).values_list('copied_at', flat=True).first()
+        if copied is None or timezone.now() - copied > datetime.timedelta(seconds=settings.SYNC_REPLICA_MAX_LAG):
+            return None
+        if _ahead_of(request.query_params, alias, copied):
+            return None
+    except DatabaseError:
+        return None
+    return alias, copied
+
+
+@contextlib.contextmanager
+def reading(target):
+    """Route the reads made inside the block to ``target`` from ``choose()``."""
+    token = _reading.set(target)
+    try:
+        yield
+    finally:
+        _reading.reset(token)
+
+
+def _stream(chunks, target):
+    chunks = iter(chunks)
+    while True:
+        with reading(target):
+            chunk = next(chunks, None)
+        if chunk is None:
+            return
+        yield chunk
+
+
+async def _astream(chunks, target):
+    chunks = aiter(chunks)
+    while True:
+        with reading(target):
+            chunk = await anext(chunks, None)
+        if chunk is None:
+            return
+        yield chunk
+
+
+def bind(response, target):
+    """Route the reads made while the streamed body of ``response`` is produced to ``target``."""
+    if target is not None and response.streaming:
+        stream = _astream if response.is_async else _stream
+        response.streaming_content = stream(response.streaming_content, target)
+    return response
+
+
+def read_replica(get):
+    """Decorate the ``get`` of a sync view to read the pull from the replica when it can."""
+    @functools.wraps(get)
+    def wrapper(self, request, *args, **kwargs):
+        target = choose(request)
+        with reading(target):
+            response = get(self, request, *args, **kwargs)
+        return bind(response, target)
+    return wrapper
+
+
+def refresh(alias=None, pages=-1):
+    """
+    Copy the primary SQLite database to the replica ``alias`` with the online
+    backup API.
+
+    The copy is made into a temporary file next to the replica, stamped with the
+    time the backup started and moved over the replica in one rename, so readers
+    never see a partial copy.
+
+    Args:
+        alias (str, optional): Replica alias, ``SYNC_REPLICA_DATABASE`` by default.
+        pages (int, optional): Pages copied per backup step; ``-1`` copies the
+            whole database at once.
+
+    Returns:
+        datetime: The time of the copy.
+    """
+    alias = alias or settings.SYNC_REPLICA_DATABASE
+    primary, replica = connections['default'], connections[alias]
+    if primary.vendor != 'sqlite' or replica.vendor != 'sqlite':
+        raise DatabaseError('Only SQLite databases can be copied to a replica file.')
+    target = os.fspath(replica.settings_dict['NAME'])
+    temp_path = f'{target}.tmp'
+
+    copied = timezone.now()
+    source = sqlite3.connect(os.fspath(primary.settings_dict['NAME']))
+    destination = sqlite3.connect(temp_path)
+    try:
+        source.backup(destination, pages=pages)
+        # A replica in WAL mode would leave a -wal file behind that does not match the next copy
+        destination.execute('PRAGMA journal_mode=DELETE')
+        destination.execute(f'DELETE FROM {ReplicaState._meta.db_table}')
+        destination.execute(
+            f'INSERT INTO {ReplicaState._meta.db_table} (id, copied_at) VALUES (1, ?)',
+            [primary.ops.adapt_datetimefield_value(copied)],
+        )
+        destination.commit()
+    finally:
+        destination.close()
+        source.close()
+    os.replace(temp_path, target)
+    # Connections of this process still reading the replaced file reopen the new one
+    replica.close()
+    return copied
@@ -0,0 +1,118 @@
+# myapp/schema.py
+"""
+Client schema versions and the migration-aware part of a pull.
+
+After a schema upgrade WatermelonDB pulls with ``schemaVersion`` and a
+``migration`` object whose ``from`` is the version it upgraded from. The tables
+and columns each version added are listed in ``SCHEMA_MIGRATIONS``. An upgraded
+client then gets, next to its usual delta, every row of the tables it just
+created and the new columns of every row of the tables it altered, so a release
+costs resync traffic in proportion to the schema change rather than a full pull.
+"""
+import json
+
+from rest_framework.exceptions import ValidationError
+
+from . import subscriptions
+from .models import owned_rows
+from .records import encoder_for
+
+# Schema version of the current WatermelonDB app schema
+SCHEMA_VERSION = 1
+
+# Tables and columns added by each schema version, in WatermelonDB names, e.g.
+#   2: {'tables': ['student_profiles'], 'columns': {'projects': ['lead_task']}}
+# Columns are serializer field names; 'id' is always sent along with them.
+SCHEMA_MIGRATIONS = {}
+
+# Pull parameters selecting a mode that cannot carry a migration
+MIGRATION_EXCLUDED_PARAMS = ('stream', 'limit', 'last_seq', 'journal_seq', 'turbo')
+
+
+def pending_migration(query_params):
+    """
+    The raw ``migration`` parameter of a pull, or ``None`` when no migration is
+    pending. WatermelonDB then sends ``null``; an empty value means the same.
+    """
+    raw = query_params.get('migration')
+    if raw is None or raw.strip() in ('', 'null'):
+        return None
+    return raw
+
+
+def parse_migration(query_params):
+    """
+    Read the ``schemaVersion`` and ``migration`` parameters of a pull.
+
+    Returns:
+        tuple: ``(from_version, to_version)`` of the client's migration, or ``None``
+        when the pull carries no migration.
+
+    Raises:
+        ValidationError: If either parameter is malformed, the versions are out of range
+            or the pull is made in a mode that cannot carry the migration.
+    """
+    raw = pending_migration(query_params)
+    if raw is None:
+        return None
+    excluded = [param for param in MIGRATION_EXCLUDED_PARAMS if query_params.get(param)]
+    if excluded:
+        raise ValidationError(f'migration cannot be combined with {", ".join(excluded)}.')
+    try:
+        migration = json.loads(raw)
+        from_version = int(migration['from'])
+        to_version = int(query_params.get('schemaVersion', SCHEMA_VERSION))
+    except (TypeError, ValueError, KeyError):
+        raise ValidationError('migration must be a JSON object with a "from" schema version.')
+    if not 1 <= from_version <= to_version <= SCHEMA_VERSION:
+        raise ValidationError(f'Schema versions must satisfy 1 <= from <= schemaVersion <= {SCHEMA_VERSION}.')
+    return from_version, to_version
+
+
+def migration_plan(from_version, to_version):
+    """
+    Union of the changes of every version after ``from_version`` up to ``to_version``.
+
+    Returns:
+        tuple: The set of added tables and ``{table: set of added columns}`` for the
+        other tables.
+    """
+    tables, columns = set(), {}
+    for version in range(from_version + 1, to_version + 1):
+        step = SCHEMA_MIGRATIONS.get(version, {})
+        tables.update(step.get('tables', ()))
+        for table, added in step.get('columns', {}).items():
+            columns.setdefault(table, set()).update(added)
+    return tables, {table: added for table, added in columns.items() if table not in tables}
+
+
+def add_migration_changes(tables, changes, migration, owner=None):
+    """
+    Extend the ``changes`` of a pull with what the client's schema migration needs.
+
+    Tables added by the migration are sent whole as ``created``, replacing their
+    delta. For tables that gained columns, every live row missing from the delta
+    is appended to ``updated`` with ``id`` and the new columns only, which
+    WatermelonDB merges into the records it already has.
+
+    Args:
+        tables (tuple): ``(name, model, serializer_class)`` for each synced table, in pull order.
+        changes (dict): The pull's ``changes``, modified in place.
+        migration (tuple): ``(from_version, to_version)`` from ``parse_migration()``, or ``None``.
+        owner (User, optional): User whose rows are pulled.
+    """
+    if migration is None:
+        return
+    added_tables, added_columns = migration_plan(*migration)
+    for name, model, serializer_class in tables:
+        if owner is not None and subscriptions.has_rules(model):
+            rows = subscriptions.subscribed_rows(model, owner)
+        else:
+            rows = owned_rows(model, owner)
+        live = rows.filter(deleted_at__isnull=True)
+        if name in added_tables:
+            changes[name] = {'created': encoder_for(serializer_class).records(live), 'updated': [], 'deleted': []}
+        elif name in added_columns:
+            sent = {record['id'] for record in changes[name]['created'] + changes[name]['updated']}
+            encoder = encoder_for(serializer_class, tuple(sorted({'id', *added_columns[name]})))
+            changes[name]['updated'].extend(record for record in encoder.rows(live) if record['id'] not in sent)
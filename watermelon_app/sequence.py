@@ -0,0 +1,49 @@
+# myapp/sequence.py
+"""
+Server sequence numbers for synced models.
+
+Every write to a synced model stamps the row's ``server_seq`` with a value taken
+from the ``ServerSequence`` counter, and inserts also record it as ``created_seq``.
+Pulls then read one ``server_seq`` range per table instead of comparing wall-clock
+timestamps. Saves are stamped through a ``pre_save`` receiver; bulk writes, which
+do not send signals, take a value with ``next_seq()`` themselves.
+"""
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import pre_save
+
+from .models import ServerSequence
+
+
+def next_seq():
+    """
+    Reserve and return the next sequence value.
+
+    The counter row stays locked until the surrounding transaction commits, so
+    concurrent writers commit in sequence order and a reader never sees a value
+    before every smaller one is visible.
+    """
+    with transaction.atomic():
+        if not ServerSequence.objects.filter(pk=1).update(value=F('value') + 1):
+            ServerSequence.objects.create(pk=1, value=1)
+        return ServerSequence.objects.values_list('value', flat=True).get(pk=1)
+
+
+def current_seq():
+    """Return the highest sequence value handed out and committed so far."""
+    return ServerSequence.objects.filter(pk=1).values_list('value', flat=True).first() or 0
+
+
+def stamp_server_seq(sender, instance, raw=False, **kwargs):
+    if raw:
+        # Fixtures keep the sequence they were dumped with
+        return
+    instance.server_seq = next_seq()
+    if instance._state.adding:
+        instance.created_seq = instance.server_seq
+
+
+def register(*models):
+    """Stamp ``server_seq`` on every ``save()`` of ``models``."""
+    for model in models:
+        pre_save.connect(stamp_server_seq, sender=model, dispatch_uid=f'server_seq.{model._meta.label}')
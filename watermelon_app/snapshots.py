@@ -0,0 +1,188 @@
+# myapp/snapshots.py
+"""
+Pre-rendered first-sync snapshots.
+
+A first sync (no ``last_pulled_at``) returns every live row of its user, the same
+payload for every device of that user. A snapshot is that payload rendered once
+and written gzip-compressed under ``SYNC_SNAPSHOT_DIR``, so first syncs are
+answered from a file with no ORM work and no serialization. The file's
+modification time is set to the server timestamp inside the payload, so clients
+resuming from it pull everything written since.
+
+Each table set has a regular snapshot and a turbo one, holding only the
+``created`` lists as WatermelonDB's turbo first sync expects. Snapshots are
+built by ``manage.py build_sync_snapshots``, e.g. for the users expected to sync
+right after a release. A first sync is answered from its user's snapshot while
+that is younger than ``SYNC_SNAPSHOT_MAX_AGE`` seconds and streamed from the
+database otherwise, so no request waits on a snapshot being written. Stale
+snapshots are removed by ``prune_snapshots``, which the ``build_sync_snapshots``
+and ``compact_tombstones`` commands run.
+"""
+import datetime
+import gzip
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.http import FileResponse, StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+
+from .compression import accepts
+from .pull import current_timestamp, stream_changes
+
+# Default age in seconds past which a snapshot is rebuilt on the next first sync
+DEFAULT_MAX_AGE = 300
+
+# Bytes read per step when a snapshot is decompressed for a client without gzip support
+READ_CHUNK_SIZE = 64 * 1024
+
+
+def snapshot_dir():
+    return Path(getattr(settings, 'SYNC_SNAPSHOT_DIR', Path(settings.BASE_DIR) / 'sync_snapshots'))
+
+
+def snapshot_key(tables):
+    """Name of the snapshot of ``tables``, made of their WatermelonDB table names."""
+    return '-'.join(name for name, _, _ in tables)
+
+
+def snapshot_path(tables, turbo=False, owner=None):
+    directory = snapshot_dir() if owner is None else snapshot_dir() / 'owners' / str(getattr(owner, 'pk', owner))
+    return directory / f'{snapshot_key(tables)}{"-turbo" if turbo else ""}.json.gz'
+
+
+def build_snapshot(tables, turbo=False, owner=None):
+    """
+    Render the first-sync payload of ``tables`` to its snapshot file.
+
+    The payload is streamed into a temporary file that then replaces the snapshot,
+    so readers always see a complete file.
+
+    Args:
+        tables (tuple): ``(name, model, serializer_class)`` for each synced table, in pull order.
+        turbo (bool, optional): Build the turbo snapshot, with ``created`` lists only.
+        owner (User, optional): User whose rows the snapshot holds.
+
+    Returns:
+        int: The server timestamp of the snapshot, in milliseconds.
+    """
+    path = snapshot_path(tables, turbo, owner)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    since = datetime.datetime.min.replace(tzinfo=datetime.timezone.utc)
+    timestamp = current_timestamp()
+
+    fd, temp_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb', mtime=0) as compressed:
+            for chunk in stream_changes(tables, since, timestamp, created_only=turbo, owner=owner):
+                compressed.write(chunk)
+        os.utime(temp_path, ns=(timestamp * 10 ** 6, timestamp * 10 ** 6))
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    return timestamp
+
+
+def prune_snapshots(max_age=None):
+    """
+    Remove the per-user snapshots, and the temporary files next to them, older
+    than ``max_age`` seconds, then the user directories left empty.
+
+    Args:
+        max_age (int, optional): Age in seconds; ``SYNC_SNAPSHOT_MAX_AGE`` by default.
+
+    Returns:
+        int: The number of files removed.
+    """
+    if max_age is None:
+        max_age = getattr(settings, 'SYNC_SNAPSHOT_MAX_AGE', DEFAULT_MAX_AGE)
+    cutoff = time.time() - max_age
+    removed = 0
+    owners = snapshot_dir() / 'owners'
+    if not owners.is_dir():
+        return removed
+    for directory in owners.iterdir():
+        if not directory.is_dir():
+            continue
+        for path in directory.iterdir():
+            try:
+                if path.suffix in ('.gz', '.tmp') and path.stat().st_mtime < cutoff:
+                    path.unlink()
+                    removed += 1
+            except FileNotFoundError:
+                pass
+        try:
+            # Fails when a file is left or a build started meanwhile
+            directory.rmdir()
+        except OSError:
+            pass
+    return removed
+
+
+def fresh_snapshot(path):
+    """Whether the snapshot at ``path`` exists and is younger than ``SYNC_SNAPSHOT_MAX_AGE``."""
+    max_age = getattr(settings, 'SYNC_SNAPSHOT_MAX_AGE', DEFAULT_MAX_AGE)
+    try:
+        return time.time() - path.stat().st_mtime < max_age
+    except FileNotFoundError:
+        return False
+
+
+def _decompressed(file):
+    with file, gzip.GzipFile(fileobj=file, mode='rb') as snapshot:
+        while chunk := snapshot.read(READ_CHUNK_SIZE):
+            yield chunk
+
+
+def snapshot_response(tables, request, turbo=False, owner=None):
+    """
+    Answer a first sync of ``tables`` from its snapshot.
+
+    Clients accepting gzip get the file as is through ``FileResponse``, which the
+    WSGI server can send with ``sendfile``. Others get it decompressed as a stream.
+
+    Args:
+        tables (tuple): ``(name, model, serializer_class)`` for each synced table, in pull order.
+        request (Request): The first-sync request.
+        turbo (bool, optional): Answer from the turbo snapshot.
+        owner (User, optional): User whose rows are pulled.
+
+    Returns:
+        HttpResponseBase: The response, or ``None`` when there is no fresh snapshot,
+        in which case the live path should answer.
+    """
+    path = snapshot_path(tables, turbo, owner)
+    if not fresh_snapshot(path):
+        return None
+    try:
+        # A rebuild replacing the file later does not affect the one opened here
+        file = open(path, 'rb')
+    except FileNotFoundError:
+        return None
+    if accepts(request.headers.get('Accept-Encoding', ''), 'gzip'):
+        response = FileResponse(file, content_type='application/json')
+        del response['Content-Disposition']
+        response['Content-Encoding'] = 'gzip'
+    else:
+        response = StreamingHttpResponse(_decompressed(file), content_type='application/json')
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
+
+
+def turbo_response(tables, request, owner=None):
+    """
+    Answer a turbo first sync of the rows ``owner`` has in ``tables``: the raw UTF-8 JSON body holding only
+    the ``created`` lists, from the turbo snapshot or, when there is no fresh one,
+    streamed straight from the database.
+    """
+    response = snapshot_response(tables, request, turbo=True, owner=owner)
+    if response is None:
+        since = datetime.datetime.min.replace(tzinfo=datetime.timezone.utc)
+        response = StreamingHttpResponse(
+            stream_changes(tables, since, current_timestamp(), created_only=True, owner=owner),
+            content_type='application/json',
+        )
+    return response
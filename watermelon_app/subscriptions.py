@@ -0,0 +1,329 @@
+# myapp/subscriptions.py
+"""
+Subscription sets precomputed from declarative sync rules.
+
+A synced model lists in ``visible_to`` the lookups leading from one of its rows
+to the users who see it, e.g. ``('owner', 'project__members')`` for tasks shared
+through their project. Instead of evaluating those joins on every pull, each
+user's visible records are kept as ``Subscription`` rows and pulls read the
+records changed in a user's scope straight from them, by primary key.
+
+Subscriptions follow the change journal: ``process()`` reads the journal entries
+written since its last run, recomputes the rules for the records they touch and
+for the records whose rules go through them (the tasks of a changed project),
+and moves ``changed_at``/``changed_seq`` of every subscription that entered,
+left or whose record was written. Pushes and membership changes run it before
+they commit; other saves schedule it for their commit. Membership changes made
+through a many-to-many field of a rule stamp the records owning it, which
+journals them like any write.
+
+Records entering a user's scope are pulled as created and records leaving it as
+deleted, in every pull mode: timestamp and sequence pulls read the subscriptions
+changed past their cursor, paginated pulls walk them in ``(changed_at,
+record_id)`` keyset order and journal pulls read the scope changes ``refresh()``
+journals for each user. Subscriptions that exist before the rules do, e.g. for rows older than
+the journal, are built with ``manage.py refresh_subscriptions --rebuild``.
+"""
+from django.db import connection, transaction
+from django.db.models import F, Max, Q
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.utils import timezone
+
+from . import watermarks
+from .journal import lock_journal
+from .models import ChangeJournal, Subscription, SubscriptionState
+from .push import write_stamps
+from .sequence import next_seq
+
+_rule_models = []
+# Many-to-many fields of the rules, by their through model
+_member_fields = {}
+
+
+def has_rules(model):
+    return bool(getattr(model, 'visible_to', ()))
+
+
+def dependencies(model):
+    """
+    Models other than ``model`` the sync rules of ``model`` go through, each with
+    the lookup leading to it, e.g. ``[(Project, 'project')]`` for tasks.
+    """
+    found = []
+    for path in model.visible_to:
+        names = path.split('__')
+        current = model
+        for depth, name in enumerate(names[:-1], start=1):
+            current = current._meta.get_field(name).related_model
+            found.append((current, '__'.join(names[:depth])))
+    return list(dict.fromkeys(found))
+
+
+def member_fields(model):
+    """Many-to-many fields crossed by the sync rules of ``model``."""
+    fields = []
+    for path in model.visible_to:
+        current = model
+        for name in path.split('__'):
+            field = current._meta.get_field(name)
+            if field.many_to_many and not field.auto_created:
+                fields.append(field)
+            current = field.related_model
+    return fields
+
+
+def db_id(model, pk):
+    """``pk`` as stored in the primary key column of ``model``, the form subscriptions keep."""
+    return str(model._meta.pk.get_db_prep_value(pk, connection))
+
+
+def _batches(values, size):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def refresh(model, pks, written=False):
+    """
+    Recompute the subscriptions to the records ``pks`` of ``model``.
+
+    Users newly reached by a rule are subscribed, users no longer reached are
+    marked as left, and with ``written`` the other subscribers are told the
+    record changed. Soft-deleted records stay subscribed, so their deletion is
+    pulled like any other write; records deleted outright are left by everyone.
+    """
+    table = model._meta.db_table
+    # Each batch reads the records, then their subscriptions, by primary key
+    for batch in _batches(set(pks), connection.features.max_query_params):
+        desired = set()
+        records = model._default_manager.filter(pk__in=batch)
+        for path in model.visible_to:
+            for user_id, pk in records.values_list(path, 'pk'):
+                if user_id is not None:
+                    desired.add((user_id, db_id(model, pk)))
+        existing = {
+            (user_id, record_id): (subscription_id, left)
+            for subscription_id, user_id, record_id, left in Subscription.objects.filter(
+                table=table, record_id__in=[db_id(model, pk) for pk in batch]
+            ).values_list('pk', 'user_id', 'record_id', 'left')
+        }
+        new = desired - existing.keys()
+        entering = {key: pk for key, (pk, left) in existing.items() if left and key in desired}
+        leaving = {key: pk for key, (pk, left) in existing.items() if not left and key not in desired}
+        staying = [pk for key, (pk, left) in existing.items() if written and not left and key in desired]
+        if not (new or entering or leaving or staying):
+            continue
+
+        now, seq = timezone.now(), next_seq()
+        changed = {'changed_at': now, 'changed_seq': seq}
+        entered = {'entered_at': now, 'entered_seq': seq, **changed}
+        Subscription.objects.bulk_create(
+            Subscription(user_id=user_id, table=table, record_id=record_id, **entered) for user_id, record_id in new
+        )
+        if entering:
+            Subscription.objects.filter(pk__in=entering.values()).update(left=False, **entered)
+        if leaving:
+            Subscription.objects.filter(pk__in=leaving.values()).update(left=True, **changed)
+        if staying:
+            Subscription.objects.filter(pk__in=staying).update(**changed)
+        # Journal the scope changes for the journal pulls of the users concerned
+        lock_journal()
+        ChangeJournal.objects.bulk_create([
+            *(ChangeJournal(table=table, record_id=record_id, op='c', user_id=user_id)
+              for user_id, record_id in [*new, *entering]),
+            *(ChangeJournal(table=table, record_id=record_id, op='d', user_id=user_id)
+              for user_id, record_id in leaving),
+        ])
+
+
+def process():
+    """
+    Bring every subscription up to date with the change journal. Runs in its own
+    transaction, or in the caller's; concurrent runs queue on the state row.
+    """
+    if not _rule_models:
+        return
+    with transaction.atomic():
+        # Writing the state row first keeps another run out until this one commits
+        if not SubscriptionState.objects.filter(pk=1).update(journal_seq=F('journal_seq')):
+            SubscriptionState.objects.create(pk=1)
+        start = SubscriptionState.objects.values_list('journal_seq', flat=True).get(pk=1)
+        high = ChangeJournal.objects.aggregate(high=Max('seq'))['high'] or 0
+        if high <= start:
+            return
+
+        watched = {model._meta.db_table for model in _rule_models}
+        for model in _rule_models:
+            watched.update(dependency._meta.db_table for dependency, _ in dependencies(model))
+        touched = {}
+        # Scope changes are this module's own entries
+        entries = ChangeJournal.objects.filter(seq__gt=start, seq__lte=high, table__in=watched, user__isnull=True)
+        for table, record_id in entries.values_list('table', 'record_id').iterator():
+            touched.setdefault(table, set()).add(record_id)
+
+        for model in _rule_models:
+            pk_field = model._meta.pk
+            own = {pk_field.to_python(record_id) for record_id in touched.get(model._meta.db_table, ())}
+            refresh(model, own, written=True)
+            # Records whose rules go through a written record may have changed hands
+            for dependency, lookup in dependencies(model):
+                ids = list(touched.get(dependency._meta.db_table, ()))
+                for batch in _batches(ids, connection.features.max_query_params):
+                    related = model._default_manager.filter(**{f'{lookup}__in': batch}).values_list('pk', flat=True)
+                    refresh(model, set(related) - own)
+        SubscriptionState.objects.filter(pk=1).update(journal_seq=high)
+
+
+def schedule():
+    """Run ``process()`` once the current transaction commits, or right away outside of one."""
+    if not connection.in_atomic_block:
+        process()
+    elif not any(func is process for _, func, _ in connection.run_on_commit):
+        transaction.on_commit(process)
+
+
+def _schedule_on_write(sender, **kwargs):
+    schedule()
+
+
+def _members_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """Stamp the records whose members changed, journaling the change for ``process()``."""
+    field = _member_fields[sender]
+    if action == 'pre_clear' and reverse:
+        # Which records lose the member is only known before the rows go
+        instance._cleared_member_of = list(
+            sender.objects.filter(**{field.m2m_reverse_field_name(): instance.pk})
+            .values_list(field.m2m_field_name(), flat=True)
+        )
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        pks = [instance.pk]
+    elif action == 'post_clear':
+        pks = instance.__dict__.pop('_cleared_member_of', [])
+    else:
+        pks = list(pk_set or ())
+    if pks:
+        field.model._default_manager.filter(pk__in=pks).update(**write_stamps(field.model))
+        # Right away, so the new scope holds within the transaction that changed it
+        process()
+        watermarks.touch()
+
+
+def register(*models):
+    """
+    Keep the subscriptions of the ``models`` declaring sync rules current after
+    every save, delete and membership change.
+    """
+    for model in models:
+        if not has_rules(model) or model in _rule_models:
+            continue
+        _rule_models.append(model)
+        for watched in [model, *(dependency for dependency, _ in dependencies(model))]:
+            label = watched._meta.label
+            post_save.connect(_schedule_on_write, sender=watched, dispatch_uid=f'subscriptions.save.{label}')
+            post_delete.connect(_schedule_on_write, sender=watched, dispatch_uid=f'subscriptions.delete.{label}')
+        for field in member_fields(model):
+            _member_fields[field.remote_field.through] = field
+            m2m_changed.connect(
+                _members_changed, sender=field.remote_field.through,
+                dispatch_uid=f'subscriptions.members.{field.remote_field.through._meta.label}',
+            )
+
+
+def rebuild():
+    """Recompute the subscriptions to every record of every model with sync rules."""
+    with transaction.atomic():
+        high = ChangeJournal.objects.aggregate(high=Max('seq'))['high'] or 0
+        for model in _rule_models:
+            refresh(model, model._default_manager.values_list('pk', flat=True))
+            # Subscriptions to records that no longer exist
+            stale = Subscription.objects.filter(table=model._meta.db_table, left=False).exclude(
+                record_id__in=model._default_manager.values('pk')
+            )
+            for batch in _batches(stale.values_list('pk', flat=True), connection.features.max_query_params):
+                now = timezone.now()
+                Subscription.objects.filter(pk__in=batch).update(left=True, changed_at=now, changed_seq=next_seq())
+        if not SubscriptionState.objects.filter(pk=1).update(journal_seq=high):
+            SubscriptionState.objects.create(pk=1, journal_seq=high)
+
+
+def subscribed_rows(model, user):
+    """Records of ``model`` currently in the scope of ``user``, read through the user's subscriptions."""
+    return model._default_manager.filter(pk__in=Subscription.objects.live(user, model).values('record_id'))
+
+
+def changed_querysets(model, since, user):
+    """
+    Querysets of the records created, updated and deleted in the scope of ``user``
+    after ``since``, like ``pull.changed_querysets``. Records are found through the
+    user's subscriptions changed after ``since``; those that entered the scope are
+    created and those that left it are deleted, whatever their own timestamps.
+    """
+    changed = Subscription.objects.of(user, model).filter(changed_at__gt=since)
+    live = changed.filter(left=False)
+    entered = live.filter(entered_at__gt=since).values('record_id')
+    rows = model._default_manager.filter(pk__in=live.values('record_id'))
+    left = changed.filter(left=True).values_list('record_id', flat=True)
+    return (
+        rows.filter(Q(created_at__gt=since) | Q(pk__in=entered), deleted_at__isnull=True),
+        rows.filter(~Q(created_at__gt=since), deleted_at__isnull=True).exclude(pk__in=entered),
+        rows.filter(deleted_at__gt=since).values_list('id', flat=True).union(left, all=True),
+    )
+
+
+def sequence_changes(model, last_seq, high, user):
+    """
+    Records in the scope of ``user`` changed within ``(last_seq, high]``.
+
+    Returns:
+        tuple: The queryset of the subscribed records, the set of primary keys that
+        entered the scope in that range and the list of those that left it.
+    """
+    pk_field = model._meta.pk
+    changed = Subscription.objects.of(user, model).filter(changed_seq__gt=last_seq, changed_seq__lte=high)
+    rows = model._default_manager.filter(pk__in=changed.filter(left=False).values('record_id'))
+    entered = changed.filter(left=False, entered_seq__gt=last_seq).values_list('record_id', flat=True)
+    left = changed.filter(left=True).values_list('record_id', flat=True)
+    return rows, {pk_field.to_python(record_id) for record_id in entered}, [pk_field.to_python(r) for r in left]
+
+
+def page_queryset(model, since, user, after=None):
+    """
+    Subscriptions of ``user`` to ``model`` changed after ``since``, in keyset order,
+    starting past the ``(changed_at, record_id)`` position ``after`` when given.
+    """
+    queryset = Subscription.objects.of(user, model).filter(changed_at__gt=since)
+    if after is not None:
+        # The redundant lower bound gives the planner a plain range start on the index
+        queryset = queryset.filter(
+            Q(changed_at__gt=after[0]) | Q(changed_at=after[0], record_id__gt=after[1]), changed_at__gte=after[0]
+        )
+    return queryset.order_by('changed_at', 'record_id')
+
+
+def page_changes(model, page, since):
+    """
+    Split a page of ``(record_id, left, entered_at)`` subscriptions changed after
+    ``since`` into the created, updated and deleted lists of a pull, like
+    ``pull.classify()``. The records are fetched by primary key; those that left
+    the scope or no longer exist are deleted, those that entered it created.
+    """
+    pk_field = model._meta.pk
+    pks = [pk_field.to_python(record_id) for record_id, _, _ in page]
+    rows = model._default_manager.in_bulk([pk for pk, (_, left, _) in zip(pks, page) if not left])
+    created, updated, deleted = [], [], []
+    for pk, (_, left, entered_at) in zip(pks, page):
+        row = rows.get(pk)
+        if left or row is None:
+            deleted.append(pk)
+        elif row.deleted_at is not None:
+            # Rows soft-deleted at or before ``since`` were already reported
+            if row.deleted_at > since:
+                deleted.append(pk)
+        elif row.created_at > since or entered_at > since:
+            created.append(row)
+        else:
+            updated.append(row)
+    return created, updated, deleted
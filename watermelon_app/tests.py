@@ -1,3 +1,914 @@
-from django.test import TestCase
+# myapp/tests.py
+import datetime
+import gzip
+import json
+import tempfile
+import time
+import uuid
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.auth import get_user_model
+from django.http import FileResponse
+from django.utils import timezone
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from .management.commands.check_sync_query_plans import query_plans
+from . import compaction, compression, pull, renderers, replica, schema, subscriptions, watermarks
+from .models import Project, ReplicaPin, ReplicaState, Task
+from .planner import Edge, PushPlan, build_plan, plan_push
+from .push import prepare_serializer, validate_batch
+from .records import encoder_for
+from .serializers import ProjectSerializer, TaskSerializer
+from .snapshots import build_snapshot, snapshot_path
+from .validation import INVALID, compile_validator
+from .views import SyncView
+
+
+class QueryPlanTests(TestCase):
+    """Every pull query, push conflict lookup and ETag lookup runs on an index range."""
+
+    def test_no_full_scan_or_temp_sort(self):
+        since = datetime.datetime.now(datetime.timezone.utc)
+        for label, plan in query_plans(since):
+            with self.subTest(label):
+                self.assertNotRegex(plan, r'\bSCAN\b(?! CONSTANT ROW)')
+                self.assertNotIn('USE TEMP B-TREE', plan)
+
+
+class PushPlanTests(SimpleTestCase):
+    """Insert order and deferred keys of the push planner."""
+
+    def test_acyclic(self):
+        plan = build_plan(['profiles', 'users'], [Edge('profiles', 'user', 'users', False)])
+        self.assertEqual(plan, PushPlan((('users', (), True), ('profiles', (), False)), ()))
+
+    def test_self_reference(self):
+        plan = build_plan(['nodes'], [Edge('nodes', 'parent', 'nodes', True)])
+        self.assertEqual(plan, PushPlan((('nodes', ('parent',), False),), (('nodes', 'parent'),)))
+
+    def test_three_table_cycle(self):
+        edges = [Edge('a', 'b', 'b', True), Edge('b', 'c', 'c', True), Edge('c', 'a', 'a', True)]
+        plan = build_plan(['a', 'b', 'c'], edges)
+        self.assertEqual(plan, PushPlan((('a', ('b',), True), ('c', (), True), ('b', (), False)), (('a', 'b'),)))
+
+    def test_three_table_cycle_with_self_reference(self):
+        edges = [
+            Edge('a', 'b', 'b', True), Edge('b', 'c', 'c', True), Edge('c', 'a', 'a', True),
+            Edge('b', 'parent', 'b', True), Edge('d', 'a', 'a', False),
+        ]
+        plan = build_plan(['a', 'b', 'c', 'd'], edges)
+        self.assertEqual(plan.inserts, (('a', ('b',), True), ('c', (), True), ('b', ('parent',), False), ('d', (), False)))
+        self.assertEqual(plan.fixups, (('a', 'b'), ('b', 'parent')))
+
+    def test_non_nullable_edge_is_kept(self):
+        edges = [Edge('projects', 'lead_task', 'tasks', False), Edge('tasks', 'project', 'projects', True)]
+        plan = build_plan(['projects', 'tasks'], edges)
+        self.assertEqual(plan.fixups, (('tasks', 'project'),))
+
+    def test_project_task_cycle(self):
+        changes = {'projects': {'created': [{}]}, 'tasks': {'created': [{}]}}
+        plan = plan_push(SyncView.sync_tables, changes)
+        self.assertEqual([(table.name, deferred) for table, deferred, _ in plan.inserts], [
+            ('projects', ('lead_task',)), ('tasks', ()),
+        ])
+        self.assertEqual([(table.name, field) for table, field in plan.fixups], [('projects', 'lead_task')])
+
+    def test_only_created_tables_are_planned(self):
+        plan = plan_push(SyncView.sync_tables, {'tasks': {'created': [{}]}, 'projects': {'updated': [{}]}})
+        self.assertEqual([(table.name, deferred) for table, deferred, _ in plan.inserts], [('tasks', ())])
+        self.assertEqual(plan.fixups, ())
+
+
+class PushQueryCountTests(TestCase):
+    """The statements a push runs depend on its plan, not on how many records it creates."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(get_user_model().objects.create(username='planner'))
+
+    def push(self, changes):
+        response = self.client.post('/sync/', {'changes': changes}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+
+    def push_cycle(self, size, queries):
+        projects = [str(uuid.uuid4()) for _ in range(size)]
+        tasks = [str(uuid.uuid4()) for _ in range(size)]
+        with self.assertNumQueries(queries):
+            self.push({
+                'projects': {'created': [
+                    {'id': project, 'name': 'P', 'lead_task': task} for project, task in zip(projects, tasks)
+                ]},
+                'tasks': {'created': [
+                    {'id': task, 'title': 'T', 'project': project} for project, task in zip(projects, tasks)
+                ]},
+            })
+        for project, task in zip(projects, tasks):
+            self.assertEqual(str(Project.objects.get(pk=project).lead_task_id), task)
+            self.assertEqual(str(Task.objects.get(pk=task).project_id), project)
+        return projects[0]
+
+    def push_tasks(self, size, project, queries):
+        tasks = [str(uuid.uuid4()) for _ in range(size)]
+        with self.assertNumQueries(queries):
+            self.push({'tasks': {'created': [{'id': task, 'title': 'T', 'project': project} for task in tasks]}})
+        self.assertEqual(Task.objects.filter(pk__in=tasks, project_id=project).count(), size)
+
+    def assert_counts(self, cycle, tasks_only):
+        for size in (1, 20):
+            with self.subTest(size=size):
+                project = self.push_cycle(size, cycle)
+                self.push_tasks(size, project, tasks_only)
+
+    @override_settings(SYNC_SINGLE_PASS_PUSH=True)
+    def test_single_pass(self):
+        self.assert_counts(cycle=49, tasks_only=34)
+
+    @override_settings(SYNC_SINGLE_PASS_PUSH=False)
+    def test_fixup_pass(self):
+        self.assert_counts(cycle=77, tasks_only=33)
+
+
+@override_settings(SYNC_WATERMARK_PATH=None)
+class IsolationTests(TestCase):
+    """A user never pulls, updates or deletes the rows of another user, whatever the pull mode."""
+
+    PULL_MODES = {
+        'timestamp': {'last_pulled_at': 1},
+        'stream': {'last_pulled_at': 1, 'stream': 1},
+        'limit': {'limit': 10},
+        'last_seq': {'last_seq': 0},
+        'journal_seq': {'journal_seq': 0},
+        'snapshot': {},
+        'turbo': {'turbo': 1},
+    }
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        snapshots = override_settings(SYNC_SNAPSHOT_DIR=directory.name)
+        snapshots.enable()
+        self.addCleanup(snapshots.disable)
+
+        users = get_user_model().objects
+        alice, bob = users.create(username='alice'), users.create(username='bob')
+        self.alice, self.bob = self.client_for(alice), self.client_for(bob)
+        self.project, self.task = str(uuid.uuid4()), str(uuid.uuid4())
+        response = self.alice.post('/sync/', {'changes': {
+            'projects': {'created': [{'id': self.project, 'name': 'A', 'lead_task': self.task}]},
+            'tasks': {'created': [{'id': self.task, 'title': 'T', 'project': self.project}]},
+        }}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        for user in (alice, bob):
+            for turbo in (False, True):
+                build_snapshot(SyncView.sync_tables, turbo, user)
+
+    def client_for(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def pull(self, client, params):
+        response = client.get('/sync/', params)
+        self.assertEqual(response.status_code, 200)
+        if response.streaming:
+            return json.loads(b''.join(response.streaming_content))
+        return response.json()
+
+    def test_pull(self):
+        for mode, params in self.PULL_MODES.items():
+            with self.subTest(mode):
+                own = self.pull(self.alice, params)['changes']
+                self.assertEqual([record['id'] for record in own['projects']['created']], [self.project])
+                self.assertEqual([record['id'] for record in own['tasks']['created']], [self.task])
+                other = json.dumps(self.pull(self.bob, params))
+                self.assertNotIn(self.project, other)
+                self.assertNotIn(self.task, other)
+
+    def test_push(self):
+        response = self.bob.post('/sync/', {'changes': {
+            'projects': {'updated': [{'id': self.project, 'name': 'B'}]},
+            'tasks': {'deleted': [self.task]},
+        }}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Project.objects.get(pk=self.project).name, 'A')
+        self.assertIsNone(Task.objects.get(pk=self.task).deleted_at)
+
+    def test_push_into_other_project(self):
+        task = str(uuid.uuid4())
+        response = self.bob.post('/sync/', {'changes': {
+            'tasks': {'created': [{'id': task, 'title': 'B', 'project': self.project}]},
+        }}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Task.objects.filter(pk=task).exists())
+
+
+@override_settings(SYNC_WATERMARK_PATH=None)
+class ScopeChangeTests(TestCase):
+    """Records entering or leaving a user's scope reach them in paginated and journal pulls."""
+
+    def setUp(self):
+        users = get_user_model().objects
+        owner, self.member = users.create(username='owner'), users.create(username='member')
+        self.client = APIClient()
+        self.client.force_authenticate(self.member)
+        self.project = Project.objects.create(owner=owner, name='P')
+        self.task = Task.objects.create(owner=owner, project=self.project, title='T')
+
+    def pull(self, params):
+        response = self.client.get('/sync/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def walk(self, last_pulled_at):
+        """Pull every page after ``last_pulled_at``, as ``{table: {kind: ids}}``."""
+        found = {}
+        body = self.pull({'last_pulled_at': last_pulled_at, 'limit': 1})
+        while True:
+            for table, changes in body['changes'].items():
+                for kind, records in changes.items():
+                    ids = found.setdefault(table, {}).setdefault(kind, [])
+                    ids += [record['id'] if isinstance(record, dict) else record for record in records]
+            if not body['has_more']:
+                return found
+            body = self.pull({'limit': 1, 'cursor': body['cursor']})
+
+    def ids(self, changes, kind):
+        return {table: [
+            record['id'] if isinstance(record, dict) else record for record in table_changes[kind]
+        ] for table, table_changes in changes.items()}
+
+    def test_paginated(self):
+        last_pulled_at = self.pull({'last_pulled_at': 1})['timestamp']
+        self.project.members.add(self.member)
+        changes = self.walk(last_pulled_at)
+        self.assertEqual(self.ids(changes, 'created'), {'projects': [str(self.project.pk)], 'tasks': [str(self.task.pk)]})
+
+        last_pulled_at = self.pull({'last_pulled_at': last_pulled_at})['timestamp']
+        self.project.members.remove(self.member)
+        changes = self.walk(last_pulled_at)
+        self.assertEqual(self.ids(changes, 'deleted'), {'projects': [str(self.project.pk)], 'tasks': [str(self.task.pk)]})
+
+    def test_journal(self):
+        journal_seq = self.pull({'journal_seq': 0})['timestamp']
+        self.project.members.add(self.member)
+        body = self.pull({'journal_seq': journal_seq})
+        self.assertEqual(self.ids(body['changes'], 'created'), {'projects': [str(self.project.pk)], 'tasks': [str(self.task.pk)]})
+
+        self.project.members.remove(self.member)
+        body = self.pull({'journal_seq': body['timestamp']})
+        self.assertEqual(self.ids(body['changes'], 'deleted'), {'projects': [str(self.project.pk)], 'tasks': [str(self.task.pk)]})
+
+
+@override_settings(SYNC_WATERMARK_PATH=None)
+class SnapshotTests(TestCase):
+    """First syncs are answered from a fresh per-user snapshot, and streamed without one."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        snapshots = override_settings(SYNC_SNAPSHOT_DIR=directory.name)
+        snapshots.enable()
+        self.addCleanup(snapshots.disable)
+        self.user = get_user_model().objects.create(username='first')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.project = Project.objects.create(owner=self.user, name='P')
+
+    def first_sync(self):
+        response = self.client.get('/sync/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response.status_code, 200)
+        self.addCleanup(response.close)
+        return response
+
+    def test_streamed_without_snapshot(self):
+        response = self.first_sync()
+        self.assertNotIsInstance(response, FileResponse)
+        body = json.loads(gzip.decompress(b''.join(response.streaming_content)))
+        self.assertEqual([record['id'] for record in body['changes']['projects']['created']], [str(self.project.pk)])
+        self.assertFalse(snapshot_path(SyncView.sync_tables, owner=self.user).exists())
+
+    def test_served_from_fresh_snapshot(self):
+        build_snapshot(SyncView.sync_tables, owner=self.user)
+        self.assertIsInstance(self.first_sync(), FileResponse)
+
+    @override_settings(SYNC_SNAPSHOT_MAX_AGE=0)
+    def test_stale_snapshot_is_not_served(self):
+        build_snapshot(SyncView.sync_tables, owner=self.user)
+        self.assertNotIsInstance(self.first_sync(), FileResponse)
+
+
+@override_settings(SYNC_WATERMARK_PATH=None)
+class PullTimestampTests(TestCase):
+    """The timestamp of a pull is taken before its tables are read."""
+
+    def test_write_during_pull_is_pulled_next(self):
+        user = get_user_model().objects.create(username='racer')
+        client = APIClient()
+        client.force_authenticate(user)
+        with self.captureOnCommitCallbacks(execute=True):
+            project = Project.objects.create(owner=user, name='P')
+            task = Task.objects.create(owner=user, project=project, title='T')
+        changed_querysets = pull.changed_querysets
+
+        def write_first(model, *args, **kwargs):
+            # Another device writes while the first table is being read
+            if model is Project:
+                time.sleep(0.002)
+                Task.objects.filter(pk=task.pk).update(title='Changed', updated_at=timezone.now())
+                subscriptions.process()
+            return changed_querysets(model, *args, **kwargs)
+
+        with mock.patch.object(pull, 'changed_querysets', write_first):
+            last_pulled_at = client.get('/sync/', {'last_pulled_at': 1}).json()['timestamp']
+        body = client.get('/sync/', {'last_pulled_at': last_pulled_at}).json()
+        self.assertEqual([record['title'] for record in body['changes']['tasks']['updated']], ['Changed'])
+
+
+@override_settings(SYNC_WATERMARK_PATH=None)
+class MalformedPullTests(TestCase):
+    """A malformed pull parameter is answered with 400, whatever the pull mode."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(get_user_model().objects.create(username='malformed'))
+
+    def test_last_pulled_at(self):
+        for url, params in [
+            ('/sync/', {}), ('/sync/', {'stream': 1}), ('/sync/async/', {}), ('/sync/async/', {'stream': 1}),
+        ]:
+            for value in ('abc', '1e400', str(10 ** 30)):
+                with self.subTest(url=url, params=params, value=value):
+                    response = self.client.get(url, {**params, 'last_pulled_at': value})
+                    self.assertEqual(response.status_code, 400)
+                    self.assertIn('errors', response.json())
+
+
+@override_settings(SYNC_WATERMARK_PATH=None)
+@mock.patch.object(schema, 'SCHEMA_VERSION', 3)
+@mock.patch.object(schema, 'SCHEMA_MIGRATIONS', {
+    2: {'columns': {'projects': ['name']}},
+    3: {'tables': ['tasks'], 'columns': {'projects': ['lead_task'], 'tasks': ['title']}},
+})
+class SchemaMigrationTests(TestCase):
+    """An upgraded client pulls the tables and columns its schema migration added."""
+
+    def setUp(self):
+        user = get_user_model().objects.create(username='upgraded')
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.old = Project.objects.create(owner=user, name='Old')
+            self.changed = Project.objects.create(owner=user, name='Changed')
+            self.task = Task.objects.create(owner=user, project=self.old, title='T')
+            Task.objects.create(owner=user, project=self.old, title='Gone', deleted_at=timezone.now())
+        time.sleep(0.002)
+        self.last_pulled_at = int(time.time() * 1000)
+        time.sleep(0.002)
+        self.changed.name = 'Renamed'
+        self.changed.save()
+        subscriptions.process()
+
+    def test_plan(self):
+        self.assertEqual(schema.migration_plan(1, 3), ({'tasks'}, {'projects': {'name', 'lead_task'}}))
+        self.assertEqual(schema.migration_plan(2, 3), ({'tasks'}, {'projects': {'lead_task'}}))
+        self.assertEqual(schema.migration_plan(1, 2), (set(), {'projects': {'name'}}))
+
+    def test_pull(self):
+        response = self.client.get('/sync/', {
+            'last_pulled_at': self.last_pulled_at, 'schemaVersion': 3, 'migration': json.dumps({'from': 1}),
+        })
+        self.assertEqual(response.status_code, 200, response.content)
+        changes = response.json()['changes']
+        self.assertEqual([record['id'] for record in changes['tasks']['created']], [str(self.task.pk)])
+        self.assertEqual(changes['tasks']['updated'], [])
+        updated = {record['id']: record for record in changes['projects']['updated']}
+        self.assertEqual(updated[str(self.changed.pk)]['name'], 'Renamed')
+        self.assertIn('updated_at', updated[str(self.changed.pk)])
+        self.assertEqual(updated[str(self.old.pk)], {'id': str(self.old.pk), 'name': 'Old', 'lead_task': None})
+        self.assertEqual(len(updated), 2)
+
+    def test_other_modes_rejected(self):
+        migration = json.dumps({'from': 1})
+        for url in ('/sync/', '/sync/async/'):
+            for params in ({'stream': 1}, {'limit': 10}, {'last_seq': 0}, {'journal_seq': 0}):
+                with self.subTest(url=url, params=params):
+                    response = self.client.get(url, {
+                        'last_pulled_at': self.last_pulled_at, 'schemaVersion': 3, 'migration': migration, **params,
+                    })
+                    self.assertEqual(response.status_code, 400)
+
+
+@override_settings(SYNC_WATERMARK_PATH=None, SYNC_READ_FROM_REPLICA=True)
+class ReplicaTests(TransactionTestCase):
+    """
+    Pulls read from a fresh replica, except for a device that just pushed. The test
+    replica mirrors the test database through its own connection, so rows are committed.
+    """
+
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(get_user_model().objects.create(username='replicated'))
+        self.copied = timezone.now() - datetime.timedelta(seconds=5)
+        ReplicaState.objects.create(copied_at=self.copied)
+        self.copied_ms = int(self.copied.timestamp() * 1000)
+
+    def pulled_at(self, device='', **params):
+        response = self.client.get('/sync/', {'last_pulled_at': 1, **params}, HTTP_X_DEVICE_ID=device)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()['timestamp']
+
+    def test_router(self):
+        router = replica.ReplicaRouter()
+        self.assertIsNone(router.db_for_read(Project))
+        with replica.reading(('replica', self.copied)):
+            self.assertEqual(Project.objects.all().db, 'replica')
+            self.assertIsNone(router.db_for_write(Project))
+            self.assertEqual(replica.copied_at(), self.copied)
+        self.assertEqual(Project.objects.all().db, 'default')
+        self.assertFalse(router.allow_migrate('replica', 'watermelon_app'))
+        self.assertIsNone(router.allow_migrate('default', 'watermelon_app'))
+
+    def test_pull_reads_replica(self):
+        self.assertEqual(self.pulled_at(), self.copied_ms)
+        # A cursor past the copy is answered by the primary
+        self.assertGreater(self.pulled_at(last_pulled_at=self.copied_ms + 1000), self.copied_ms)
+
+    @override_settings(SYNC_REPLICA_MAX_LAG=1)
+    def test_lagging_replica(self):
+        self.assertGreater(self.pulled_at(), self.copied_ms)
+
+    def test_pinned_after_push(self):
+        response = self.client.post('/sync/', {'changes': {'projects': {'created': [
+            {'id': str(uuid.uuid4()), 'name': 'P'},
+        ]}}}, format='json', HTTP_X_DEVICE_ID='phone')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertGreater(self.pulled_at('phone'), self.copied_ms)
+        self.assertEqual(self.pulled_at('tablet'), self.copied_ms)
+        ReplicaPin.objects.update(until=timezone.now())
+        self.assertEqual(self.pulled_at('phone'), self.copied_ms)
+
+
+class RendererTests(SimpleTestCase):
+    """Sync responses render byte for byte as DRF's JSONRenderer, with or without orjson."""
+
+    def test_matches_drf(self):
+        data = {
+            'id': uuid.uuid4(),
+            'at': datetime.datetime(2024, 5, 1, 12, 30, 15, 123456, tzinfo=datetime.timezone.utc),
+            'text': 'line\u2028para\u2029 \u00e9 \u2713',
+            'items': [None, True, 1, 1.5, {'nested': 'x'}],
+        }
+        expected = JSONRenderer().render(data)
+        for backend in (renderers.orjson, None):
+            with self.subTest(orjson=backend is not None), mock.patch.object(renderers, 'orjson', backend):
+                self.assertEqual(renderers.dumps(data), expected)
+
+
+@override_settings(SYNC_WATERMARK_PATH=None)
+class ConditionalPullTests(TestCase):
+    """Incremental pulls carry an ETag and answer a matching If-None-Match with 304."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create(username='conditional')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            Project.objects.create(owner=self.user, name='P')
+
+    def pull(self, client=None, etag=None, **params):
+        headers = {'HTTP_IF_NONE_MATCH': etag} if etag else {}
+        return (client or self.client).get('/sync/', {'last_pulled_at': 1, **params}, **headers)
+
+    def test_not_modified_until_written(self):
+        etag = self.pull()['ETag']
+        response = self.pull(etag=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response.content, b'')
+
+        response = self.client.post('/sync/', {'changes': {'projects': {'created': [
+            {'id': str(uuid.uuid4()), 'name': 'Q'},
+        ]}}}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        response = self.pull(etag=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(self.pull(etag=response['ETag']).status_code, 304)
+
+    def test_scoped_to_user_and_mode(self):
+        etag = self.pull()['ETag']
+        other = APIClient()
+        other.force_authenticate(get_user_model().objects.create(username='other'))
+        self.assertEqual(self.pull(client=other, etag=etag).status_code, 200)
+        self.assertEqual(self.client.get('/sync/', {'last_seq': 0}, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_first_sync_untagged(self):
+        response = self.client.get('/sync/')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('ETag'))
+
+
+class WatermarkTests(TestCase):
+    """The registry answers only when it is fresh, consistent and knows every table."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(SYNC_WATERMARK_PATH=f'{directory.name}/marks.bin')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def set_header(self, generation=None, refreshed_at=None):
+        buffer = watermarks._open()[1]
+        magic, current_generation, current_refreshed_at = watermarks.HEADER.unpack_from(buffer)
+        watermarks.HEADER.pack_into(
+            buffer, 0, magic,
+            current_generation if generation is None else generation,
+            current_refreshed_at if refreshed_at is None else refreshed_at,
+        )
+
+    def test_read_write(self):
+        watermarks.write({'projects': 5, 'tasks': 7})
+        self.assertEqual(watermarks.read(['tasks', 'projects']), [7, 5])
+        # Marks only move forward
+        watermarks.write({'projects': 3})
+        self.assertEqual(watermarks.read(['projects']), [5])
+
+    def test_unknown_table(self):
+        watermarks.write({'projects': 5})
+        self.assertIsNone(watermarks.read(['projects', 'tasks']))
+
+    def test_being_written(self):
+        watermarks.write({'projects': 5})
+        self.set_header(generation=3)
+        self.assertIsNone(watermarks.read(['projects']))
+        # The next writer recovers from a writer that died mid-write
+        watermarks.write({'projects': 6})
+        self.assertEqual(watermarks.read(['projects']), [6])
+
+    def test_stale(self):
+        watermarks.write({'projects': 5})
+        self.set_header(refreshed_at=time.time() - watermarks.DEFAULT_MAX_AGE - 1)
+        self.assertIsNone(watermarks.read(['projects']))
+
+    @override_settings(SYNC_WATERMARK_PATH=None)
+    def test_disabled(self):
+        self.assertIsNone(watermarks.read(['projects']))
+
+    def test_pull_falls_back_to_database(self):
+        client = APIClient()
+        client.force_authenticate(get_user_model().objects.create(username='marked'))
+        etag = client.get('/sync/', {'last_pulled_at': 1})['ETag']
+        # A fresh registry answers without a query
+        with self.assertNumQueries(0):
+            self.assertEqual(client.get('/sync/', {'last_pulled_at': 1}, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        for header in ({'generation': 5}, {'refreshed_at': 0.0}):
+            with self.subTest(**header):
+                self.set_header(**header)
+                with mock.patch.object(watermarks, 'load', wraps=watermarks.load) as load:
+                    response = client.get('/sync/', {'last_pulled_at': 1}, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304)
+                load.assert_called_once()
+
+
+@override_settings(SYNC_WATERMARK_PATH=None)
+class CompactionTests(TestCase):
+    """Old tombstones are hard-deleted, and pulls from before them are told to resync."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create(username='compacted')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.old = timezone.now() - datetime.timedelta(hours=2)
+        with self.captureOnCommitCallbacks(execute=True):
+            # Deleted long ago, but a live task would go with it
+            self.kept = Project.objects.create(owner=self.user, name='Kept')
+            self.live_task = Task.objects.create(owner=self.user, project=self.kept, title='Live')
+            # Deleted long ago along with its task
+            self.gone = Project.objects.create(owner=self.user, name='Gone')
+            self.gone_task = Task.objects.create(owner=self.user, project=self.gone, title='Gone')
+            # Deleted recently
+            self.recent = Project.objects.create(owner=self.user, name='Recent')
+        Project.objects.filter(pk__in=[self.kept.pk, self.gone.pk]).update(deleted_at=self.old)
+        Task.objects.filter(pk=self.gone_task.pk).update(deleted_at=self.old)
+        Project.objects.filter(pk=self.recent.pk).update(deleted_at=timezone.now())
+
+    def test_compact(self):
+        with tempfile.TemporaryDirectory() as archive_dir:
+            removed = compaction.compact(horizon=3600, archive_dir=archive_dir)
+            with gzip.open(f'{archive_dir}/{Project._meta.db_table}.jsonl.gz', 'rt') as archive:
+                archived = [json.loads(line)['id'] for line in archive]
+        self.assertEqual(removed[Project._meta.db_table], 1)
+        self.assertEqual(removed[Task._meta.db_table], 1)
+        self.assertEqual(archived, [str(self.gone.pk)])
+        self.assertEqual(
+            set(Project.objects.values_list('pk', flat=True)), {self.kept.pk, self.recent.pk}
+        )
+        self.assertEqual(set(Task.objects.values_list('pk', flat=True)), {self.live_task.pk})
+        oldest_pulled_at, oldest_seq = compaction.oldest_supported()
+        self.assertEqual(oldest_pulled_at, self.old)
+        self.assertGreater(oldest_seq, 0)
+
+    def test_expired_cursor_resets(self):
+        compaction.compact(horizon=3600, archive_dir=None)
+        oldest_pulled_at, oldest_seq = compaction.oldest_supported()
+        oldest_ms = int(oldest_pulled_at.timestamp() * 1000)
+        for url in ('/sync/', '/sync/async/'):
+            for params in ({'last_pulled_at': oldest_ms - 1000}, {'last_seq': oldest_seq - 1}):
+                with self.subTest(url=url, params=params):
+                    response = self.client.get(url, params)
+                    self.assertEqual(response.status_code, 410)
+                    self.assertEqual(response.json()['reset'], True)
+                    self.assertEqual(response.json()['oldest_pulled_at'], oldest_ms)
+            for params in ({'last_pulled_at': oldest_ms + 1000}, {'last_seq': oldest_seq}, {'last_seq': 0}):
+                with self.subTest(url=url, params=params):
+                    self.assertEqual(self.client.get(url, params).status_code, 200)
+
+
+@override_settings(SYNC_WATERMARK_PATH=None)
+class PushConflictTests(TestCase):
+    """A push overwriting records written since the client's last pull is rejected with 409."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create(username='conflicted')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.project = Project.objects.create(owner=self.user, name='P')
+            self.task = Task.objects.create(owner=self.user, project=self.project, title='T')
+
+    def push(self, query, changes):
+        return self.client.post(f'/sync/?{query}', {'changes': changes}, format='json')
+
+    def changes(self):
+        return {
+            'projects': {'created': [{'id': str(uuid.uuid4()), 'name': 'New'}], 'updated': [
+                {'id': str(self.project.pk), 'name': 'Mine'},
+            ]},
+            'tasks': {'deleted': [str(self.task.pk)]},
+        }
+
+    def test_conflict(self):
+        for cursor in ('last_pulled_at', 'last_seq'):
+            with self.subTest(cursor=cursor):
+                mode = {'last_pulled_at': 1} if cursor == 'last_pulled_at' else {'last_seq': 0}
+                pulled = self.client.get('/sync/', mode).json()['timestamp']
+                time.sleep(0.002)
+                response = self.client.post('/sync/', {'changes': {'projects': {'updated': [
+                    {'id': str(self.project.pk), 'name': 'Theirs'},
+                ]}}}, format='json')
+                self.assertEqual(response.status_code, 200, response.content)
+
+                response = self.push(f'{cursor}={pulled}', self.changes())
+                self.assertEqual(response.status_code, 409)
+                self.assertEqual(response.json()['conflicts'], {'projects': [str(self.project.pk)]})
+                self.assertEqual(Project.objects.get(pk=self.project.pk).name, 'Theirs')
+                self.assertFalse(Project.objects.filter(name='New').exists())
+                self.assertTrue(Task.objects.filter(pk=self.task.pk, deleted_at__isnull=True).exists())
+
+    def test_no_conflict(self):
+        pulled = self.client.get('/sync/', {'last_pulled_at': 1}).json()['timestamp']
+        response = self.push(f'last_pulled_at={pulled}', self.changes())
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(Project.objects.get(pk=self.project.pk).name, 'Mine')
+
+    def test_malformed_cursor(self):
+        for query in ('last_pulled_at=abc', 'last_pulled_at=1e400', 'last_seq=abc'):
+            with self.subTest(query=query):
+                response = self.push(query, self.changes())
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('errors', response.json())
+                self.assertEqual(Project.objects.get(pk=self.project.pk).name, 'P')
+
+
+class RecordEncoderTests(TestCase):
+    """Encoded records render to the same JSON as the serializers' data."""
+
+    def test_matches_serializer(self):
+        user = get_user_model().objects.create(username='encoded')
+        project = Project.objects.create(owner=user, name='P é')
+        task = Task.objects.create(owner=user, project=project, title='T')
+        Task.objects.create(owner=user, title='Orphan')
+        project.lead_task = task
+        project.save()
+        Project.objects.create(owner=user, name='No lead')
+        renderer = JSONRenderer()
+        for serializer_class in (ProjectSerializer, TaskSerializer):
+            queryset = serializer_class.Meta.model.objects.order_by('pk')
+            for tz in ('UTC', 'Europe/Paris'):
+                with self.subTest(serializer=serializer_class.__name__, tz=tz), timezone.override(tz):
+                    encoder = encoder_for(serializer_class)
+                    expected = renderer.render(serializer_class(queryset, many=True).data)
+                    self.assertEqual(renderer.render(encoder.records(queryset)), expected)
+                    self.assertEqual(renderer.render(async_to_sync(encoder.arecords)(queryset)), expected)
+
+
+@mock.patch.object(compression, 'COMPRESSORS', dict.fromkeys(('zstd', 'br', 'gzip', 'deflate')))
+class NegotiationTests(SimpleTestCase):
+    """Content coding negotiation from Accept-Encoding quality values."""
+
+    def test_negotiate(self):
+        for header, coding in [
+            ('', None),
+            ('identity', None),
+            ('gzip', 'gzip'),
+            ('GZIP', 'gzip'),
+            ('gzip, deflate, br, zstd', 'zstd'),
+            ('gzip;q=1, br;q=0.5', 'gzip'),
+            ('deflate;q=0.9, gzip;q=0.8', 'deflate'),
+            ('zstd;q=0, *;q=0.5', 'br'),
+            ('*', 'zstd'),
+            ('*;q=0', None),
+            ('gzip;q=0', None),
+            ('gzip;q=abc, deflate', 'deflate'),
+            ('gzip;q=0.5, gzip;level=9', 'gzip'),
+        ]:
+            with self.subTest(header=header):
+                self.assertEqual(compression.negotiate(header), coding)
+
+
+@override_settings(SYNC_WATERMARK_PATH=None)
+class CompressionTests(TestCase):
+    """Buffered and streamed pulls decompress to the body sent without compression."""
+
+    def setUp(self):
+        user = get_user_model().objects.create(username='compressed')
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+        with self.captureOnCommitCallbacks(execute=True):
+            for number in range(20):
+                Project.objects.create(owner=user, name=f'Project {number}')
+
+    def changes(self, body):
+        return json.loads(body)['changes']
+
+    def test_round_trip(self):
+        for params in ({'last_pulled_at': 1}, {'last_pulled_at': 1, 'stream': 1}):
+            with self.subTest(params=params):
+                plain = self.client.get('/sync/', params)
+                self.assertFalse(plain.has_header('Content-Encoding'))
+                response = self.client.get('/sync/', params, HTTP_ACCEPT_ENCODING='gzip')
+                self.assertEqual(response['Content-Encoding'], 'gzip')
+                self.assertIn('Accept-Encoding', response['Vary'])
+                self.assertEqual(response.streaming, 'stream' in params)
+                self.assertEqual(
+                    self.changes(gzip.decompress(response.getvalue())), self.changes(plain.getvalue())
+                )
+
+
+class TurboTests(TestCase):
+    """Turbo first syncs hold only the created lists, live or from the turbo snapshot."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        snapshots = override_settings(SYNC_SNAPSHOT_DIR=directory.name)
+        snapshots.enable()
+        self.addCleanup(snapshots.disable)
+        self.user = get_user_model().objects.create(username='turbo')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.project = Project.objects.create(owner=self.user, name='P')
+            Project.objects.create(owner=self.user, name='Deleted', deleted_at=timezone.now())
+
+    def turbo_body(self):
+        response = self.client.get('/sync/', {'turbo': 1}, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response.status_code, 200)
+        self.addCleanup(response.close)
+        body = b''.join(response.streaming_content)
+        if response.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        return response, json.loads(body)
+
+    def assert_created_only(self, body):
+        self.assertEqual(set(body), {'changes', 'timestamp'})
+        for name, _, _ in SyncView.sync_tables:
+            self.assertEqual(list(body['changes'][name]), ['created'])
+        self.assertEqual([record['id'] for record in body['changes']['projects']['created']], [str(self.project.pk)])
+
+    def test_streamed(self):
+        response, body = self.turbo_body()
+        self.assertNotIsInstance(response, FileResponse)
+        self.assert_created_only(body)
+
+    def test_from_snapshot(self):
+        build_snapshot(SyncView.sync_tables, turbo=True, owner=self.user)
+        response, body = self.turbo_body()
+        self.assertIsInstance(response, FileResponse)
+        self.assert_created_only(body)
+
+    def test_incremental_rejected(self):
+        response = self.client.get('/sync/', {'turbo': 1, 'last_pulled_at': 1})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['errors'], ['turbo is only supported for the first sync.'])
+
+
+@override_settings(SYNC_WATERMARK_PATH=None)
+class AsyncEndpointTests(TestCase):
+    """The async endpoint answers pulls and pushes like the synchronous one."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create(username='async')
+        self.client.force_login(self.user)
+        self.async_client.force_login(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            project = Project.objects.create(owner=self.user, name='P')
+            Task.objects.create(owner=self.user, project=project, title='T')
+
+    def changes(self, body):
+        return json.loads(body)['changes']
+
+    async def test_pull(self):
+        expected = self.changes((await sync_to_async(self.client.get)('/sync/', {'last_pulled_at': 1})).content)
+        response = await self.async_client.get('/sync/async/', {'last_pulled_at': 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.streaming)
+        self.assertEqual(self.changes(response.content), expected)
+        # Incremental pulls are conditional there too
+        response = await self.async_client.get(
+            '/sync/async/', {'last_pulled_at': 1}, headers={'If-None-Match': response['ETag']}
+        )
+        self.assertEqual(response.status_code, 304)
+
+    async def test_stream(self):
+        expected = self.changes((await sync_to_async(self.client.get)('/sync/', {'last_pulled_at': 1})).content)
+        response = await self.async_client.get('/sync/async/', {'last_pulled_at': 1, 'stream': 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_async)
+        body = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(self.changes(body), expected)
+
+    async def test_push(self):
+        project = str(uuid.uuid4())
+        response = await self.async_client.post(
+            '/sync/async/', {'changes': {'projects': {'created': [{'id': project, 'name': 'Q'}]}}},
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertTrue(await Project.objects.filter(pk=project, owner=self.user).aexists())
+
+    async def test_unauthenticated(self):
+        await self.async_client.alogout()
+        response = await self.async_client.get('/sync/async/', {'last_pulled_at': 1})
+        self.assertEqual(response.status_code, 403)
+
+
+class CompiledValidatorTests(TestCase):
+    """Compiled column checks give the serializer's validated data and errors."""
+
+    def test_matches_serializer(self):
+        user = get_user_model().objects.create(username='validated')
+        with self.captureOnCommitCallbacks(execute=True):
+            project = Project.objects.create(owner=user, name='P')
+            task = Task.objects.create(owner=user, project=project, title='T')
+        pending = uuid.uuid4()
+        cases = {
+            TaskSerializer: [
+                {'id': str(uuid.uuid4()), 'title': 'T', 'project': str(project.pk)},
+                {'id': str(uuid.uuid4()), 'title': 'é ✓', 'project': str(pending)},
+                {'id': str(uuid.uuid4()), 'title': 'x' * 201},
+                {'id': str(uuid.uuid4())},
+                {'id': str(uuid.uuid4()), 'title': None},
+                {'id': str(uuid.uuid4()), 'title': ''},
+                {'id': str(uuid.uuid4()), 'title': ' padded '},
+                {'id': str(uuid.uuid4()), 'title': 5},
+                {'id': str(uuid.uuid4()), 'title': 'nul\x00'},
+                {'id': str(uuid.uuid4()), 'title': 'T', 'project': str(uuid.uuid4())},
+                {'id': str(uuid.uuid4()), 'title': 'T', 'project': 'abc'},
+                {'id': str(uuid.uuid4()), 'title': 'T', 'project': None},
+                {'id': 'not-a-uuid', 'title': 'T'},
+                {'id': 7, 'title': 'T'},
+                'not a record',
+            ],
+            ProjectSerializer: [
+                {'id': str(uuid.uuid4()), 'name': 'P', 'lead_task': str(task.pk)},
+                {'id': str(uuid.uuid4()), 'name': 'x' * 101, 'lead_task': 'abc'},
+                {'id': str(uuid.uuid4().hex), 'name': 'Hex id'},
+            ],
+        }
+        for serializer_class, items in cases.items():
+            with self.subTest(serializer=serializer_class.__name__):
+                results = []
+                for compiled in (True, False):
+                    serializer = prepare_serializer(
+                        serializer_class, items, owner=user, pending={Project: {pending}}
+                    )
+                    if compiled:
+                        # Well-formed records do take the compiled path
+                        self.assertIsNot(compile_validator(serializer)(items[0]), INVALID)
+                        results.append(validate_batch(serializer, items))
+                    else:
+                        with mock.patch('watermelon_app.push.compile_validator', return_value=None):
+                            results.append(validate_batch(serializer, items))
+                fast, slow = [
+                    [(position, data, error and error.detail) for position, data, error in result]
+                    for result in results
+                ]
+                self.assertEqual(fast, slow)
@@ -1,7 +1,8 @@
 # myapp/urls.py
 from django.urls import path
-from .views import SyncView
+from .views import AsyncSyncView, SyncView
 
 urlpatterns = [
     path('sync/', SyncView.as_view(), name='sync'),
+    path('sync/async/', AsyncSyncView.as_view(), name='sync-async'),
 ]
\ No newline at end of file
@@ -0,0 +1,244 @@
+# myapp/validation.py
+"""
+Compiled validation of pushed records.
+
+DRF validates a record by walking the serializer's writable fields, running
+the empty-value checks, conversion and validator chain of each one and
+collecting the results in fresh dicts. For the synced serializers most of that
+work proves nothing for a well-formed record. ``compile_validator`` reduces the
+writable fields of a prepared serializer to one check per column: UUID strings
+are parsed, strings checked against their length limits, nulls against
+``allow_null`` and foreign keys looked up among the rows the batch resolved.
+Whether a serializer class can be compiled at all is worked out once per class;
+the column checks themselves are built for each batch, as they use the fields
+``push.prepare_serializer`` set up for it.
+
+A compiled check only accepts values it can prove DRF accepts unchanged. A
+record with any other value, invalid or merely in need of coercion, is left to
+the serializer, so the validated data and the error messages are DRF's own.
+
+Related fields of a push are ``BatchRelatedField`` instances, which resolve the
+keys referenced by the whole batch at once.
+"""
+import functools
+import uuid
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.validators import MaxLengthValidator, MinLengthValidator, ProhibitNullCharactersValidator
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+from rest_framework.fields import ProhibitSurrogateCharactersValidator, empty
+from rest_framework.relations import PrimaryKeyRelatedField
+
+# Returned by a column check for values it cannot accept on its own
+INVALID = object()
+
+# Validators whose checks are inlined by the string column check
+_LENGTH_VALIDATORS = (MaxLengthValidator, MinLengthValidator)
+_CHARACTER_VALIDATORS = (ProhibitNullCharactersValidator, ProhibitSurrogateCharactersValidator)
+
+
+class BatchRelatedField(PrimaryKeyRelatedField):
+    """
+    Drop-in replacement for ``PrimaryKeyRelatedField`` that resolves primary keys
+    against rows prefetched for the whole batch instead of querying once per record.
+
+    Keys in ``pending``, of records created by the same push and not inserted yet,
+    resolve to an unsaved instance carrying only the primary key. Keys missing from
+    ``resolved`` were looked up and do not exist; values that could not be parsed
+    are left to the regular lookup, which reports them.
+    """
+
+    def __init__(self, resolved, pending=frozenset(), **kwargs):
+        self.resolved = resolved
+        self.pending = pending
+        super().__init__(**kwargs)
+        # get_queryset() clones the queryset on every call
+        self.model = self.queryset.model
+        self.to_pk = self.model._meta.pk.to_python
+
+    def parse_pk(self, data):
+        """Primary key value of ``data``, or ``None`` when it cannot be one."""
+        try:
+            return self.to_pk(data)
+        except (DjangoValidationError, AttributeError, TypeError, ValueError):
+            return None
+
+    def to_internal_value(self, data):
+        pk = self.parse_pk(data)
+        if pk is None:
+            return super().to_internal_value(data)
+        if pk in self.pending:
+            return self.model(pk=pk)
+        if pk not in self.resolved:
+            self.fail('does_not_exist', pk_value=data)
+        return self.resolved[pk]
+
+
+@functools.lru_cache(maxsize=None)
+def _compilable(serializer_class):
+    """
+    Whether records of ``serializer_class`` can be checked column by column:
+    the serializer must add no per-field or object-level validation of its own.
+    """
+    serializer = serializer_class()
+    if serializer_class.validate is not serializers.Serializer.validate or serializer.validators:
+        return False
+    for field in serializer.fields.values():
+        if hasattr(serializer, f'validate_{field.field_name}'):
+            return False
+        if field.default is not empty or len(field.source_attrs) != 1:
+            return False
+    return True
+
+
+def _run(validators, value, field):
+    """Run the remaining ``(validator, requires_context)`` pairs of a column on ``value``."""
+    try:
+        for validator, requires_context in validators:
+            if requires_context:
+                validator(value, field)
+            else:
+                validator(value)
+    except (ValidationError, DjangoValidationError):
+        return INVALID
+    return value
+
+
+def _remaining(field):
+    return [(validator, getattr(validator, 'requires_context', False)) for validator in field.validators]
+
+
+def _uuid_check(field):
+    validators = _remaining(field)
+
+    def check(value):
+        if type(value) is not str:
+            return INVALID
+        try:
+            value = uuid.UUID(value)
+        except ValueError:
+            return INVALID
+        return _run(validators, value, field) if validators else value
+    return check
+
+
+def _char_check(field):
+    # Limits given as callables are left to the validators themselves
+    inlined = [
+        validator for validator in field.validators
+        if isinstance(validator, _LENGTH_VALIDATORS) and not callable(validator.limit_value)
+    ]
+    max_length = min((v.limit_value for v in inlined if isinstance(v, MaxLengthValidator)), default=None)
+    # The empty string takes the serializer's blank handling
+    min_length = max([1, *(v.limit_value for v in inlined if isinstance(v, MinLengthValidator))])
+    remaining = [pair for pair in _remaining(field) if not any(pair[0] is v for v in inlined)]
+    # Null and surrogate characters can only occur in non-ASCII strings, or as a NUL
+    characters = [pair for pair in remaining if isinstance(pair[0], _CHARACTER_VALIDATORS)]
+    validators = [pair for pair in remaining if not isinstance(pair[0], _CHARACTER_VALIDATORS)]
+    trim = field.trim_whitespace
+
+    def check(value):
+        # Blank, padded and non-string values take the serializer's conversions
+        if type(value) is not str or len(value) < min_length or (trim and value.strip() is not value):
+            return INVALID
+        if max_length is not None and len(value) > max_length:
+            return INVALID
+        if value.isascii():
+            if '\x00' in value:
+                return INVALID
+        elif _run(characters, value, field) is INVALID:
+            return INVALID
+        return _run(validators, value, field) if validators else value
+    return check
+
+
+def _related_check(field):
+    validators = _remaining(field)
+    model, pending, resolved = field.model, field.pending, field.resolved
+
+    def check(value):
+        pk = field.parse_pk(value)
+        if pk is None:
+            return INVALID
+        if pk in pending:
+            value = model(pk=pk)
+        else:
+            value = resolved.get(pk, INVALID)
+            if value is INVALID:
+                return INVALID
+        return _run(validators, value, field) if validators else value
+    return check
+
+
+def _field_check(field):
+    def check(value):
+        try:
+            return field.run_validation(value)
+        except (ValidationError, DjangoValidationError):
+            return INVALID
+    return check
+
+
+def _column_check(field):
+    if isinstance(field, BatchRelatedField):
+        return _related_check(field)
+    if type(field) is serializers.UUIDField:
+        return _uuid_check(field)
+    # CharField and the subclasses that only add validators, such as EmailField
+    converts_as_char = all(
+        getattr(type(field), method) is getattr(serializers.CharField, method)
+        for method in ('run_validation', 'to_internal_value')
+    )
+    if isinstance(field, serializers.CharField) and converts_as_char:
+        return _char_check(field)
+    return _field_check(field)
+
+
+class CompiledValidator:
+    """
+    Column checks of a prepared serializer, built for the batch it was prepared
+    for. Calling it with a pushed record returns the validated data, or
+    ``INVALID`` when the record must go through the serializer.
+    """
+
+    def __init__(self, serializer):
+        partial = serializer.partial
+        self.columns = [
+            (field.field_name, field.source, field.required and not partial, field.allow_null, _column_check(field))
+            for field in serializer._writable_fields
+        ]
+
+    def __call__(self, item):
+        if type(item) is not dict:
+            return INVALID
+        data = {}
+        for name, source, required, allow_null, check in self.columns:
+            value = item.get(name, empty)
+            if value is empty:
+                if required:
+                    return INVALID
+                continue
+            if value is None:
+                if not allow_null:
+                    return INVALID
+                data[source] = None
+                continue
+            value = check(value)
+            if value is INVALID:
+                return INVALID
+            data[source] = value
+        return data
+
+
+def compile_validator(serializer):
+    """
+    Compile the writable fields of a serializer built by ``push.prepare_serializer``.
+
+    Returns:
+        CompiledValidator: The column checks, or ``None`` when the serializer
+        validates more than its fields and every record must go through it.
+    """
+    if not _compilable(type(serializer)):
+        return None
+    return CompiledValidator(serializer)
@@ -0,0 +1,187 @@
+# myapp/watermarks.py
+"""
+Node-wide registry of the journal high-water marks, shared by all worker processes.
+
+The marks behind pull ETags live in a small memory-mapped file, so a poll whose
+``If-None-Match`` still matches is answered without opening a database cursor.
+Commits of pushes and saves of synced models refresh the file from the journal.
+Writes that bypass both (raw SQL, other hosts) are caught up by readers: a file
+not refreshed for ``SYNC_WATERMARK_MAX_AGE`` seconds, or one that is missing or
+unreadable, is ignored and the marks are read from the database instead.
+
+Layout: a header of magic, generation and refresh time, then ``SLOTS`` slots of
+``(table key, mark)``. Writers take an exclusive ``flock`` and make the
+generation odd while they write; readers retry until they see the same even
+generation before and after reading, like a seqlock. Marks only ever grow, so
+delete the file after restoring the database to an earlier state.
+"""
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models.signals import post_delete, post_save
+
+from .journal import high_water_marks, journaled_tables
+
+# Default seconds after which the registry is no longer trusted without a refresh
+DEFAULT_MAX_AGE = 30
+
+MAGIC = b'SYNCWM01'
+HEADER = struct.Struct('<8sQd')
+SLOT = struct.Struct('<QQ')
+SLOTS = 64
+SIZE = HEADER.size + SLOT.size * SLOTS
+
+# Attempts at a consistent read before falling back to the database
+READ_ATTEMPTS = 3
+
+_mapping = None
+_mapping_lock = threading.Lock()
+
+
+def registry_path():
+    path = getattr(settings, 'SYNC_WATERMARK_PATH', None)
+    return os.fspath(path) if path else None
+
+
+def _table_key(db_table):
+    # Never 0, which marks an empty slot
+    return int.from_bytes(hashlib.blake2b(db_table.encode(), digest_size=8).digest(), 'little') or 1
+
+
+def _open():
+    """Map the registry file, creating it when missing. Returns ``(fd, mmap)`` or ``None``."""
+    global _mapping
+    path = registry_path()
+    if path is None:
+        return None
+    with _mapping_lock:
+        if _mapping is not None and _mapping[0] == path:
+            return _mapping[1:]
+        try:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            if os.fstat(fd).st_size < SIZE:
+                os.ftruncate(fd, SIZE)
+            _mapping = (path, fd, mmap.mmap(fd, SIZE))
+        except OSError:
+            return None
+        return _mapping[1:]
+
+
+def _slot_offsets(key):
+    """Offsets of the slots probed for ``key``, in probe order."""
+    start = key % SLOTS
+    for index in range(SLOTS):
+        yield HEADER.size + SLOT.size * ((start + index) % SLOTS)
+
+
+def read(db_tables):
+    """
+    Return the marks of ``db_tables`` from the registry, or ``None`` when it is
+    disabled, missing, stale, being rewritten or does not know one of the tables.
+    """
+    mapped = _open()
+    if mapped is None:
+        return None
+    buffer = mapped[1]
+    max_age = getattr(settings, 'SYNC_WATERMARK_MAX_AGE', DEFAULT_MAX_AGE)
+    for _ in range(READ_ATTEMPTS):
+        magic, generation, refreshed_at = HEADER.unpack_from(buffer)
+        if magic != MAGIC or time.time() - refreshed_at > max_age:
+            return None
+        if generation % 2:
+            continue
+        marks = []
+        for db_table in db_tables:
+            key = _table_key(db_table)
+            for offset in _slot_offsets(key):
+                slot_key, mark = SLOT.unpack_from(buffer, offset)
+                if slot_key == key:
+                    marks.append(mark)
+                    break
+                if slot_key == 0:
+                    return None
+            else:
+                return None
+        if HEADER.unpack_from(buffer)[1] == generation:
+            return marks
+    return None
+
+
+def write(marks):
+    """
+    Store ``{db_table: mark}`` in the registry and mark it as just refreshed.
+    Marks only move forward, so a writer holding older values cannot undo a newer one.
+    """
+    mapped = _open()
+    if mapped is None:
+        return
+    fd, buffer = mapped
+    fcntl.flock(fd, fcntl.LOCK_EX)
+    try:
+        magic, generation, refreshed_at = HEADER.unpack_from(buffer)
+        if magic != MAGIC:
+            buffer[:] = bytes(SIZE)
+            generation, refreshed_at = 0, 0.0
+        # A writer that died mid-write left the generation odd
+        generation += generation % 2
+        HEADER.pack_into(buffer, 0, MAGIC, generation + 1, refreshed_at)
+        for db_table, mark in marks.items():
+            key = _table_key(db_table)
+            for offset in _slot_offsets(key):
+                slot_key, current = SLOT.unpack_from(buffer, offset)
+                if slot_key in (0, key):
+                    SLOT.pack_into(buffer, offset, key, max(mark, current if slot_key else 0))
+                    break
+        HEADER.pack_into(buffer, 0, MAGIC, generation + 2, time.time())
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+def load(db_tables):
+    """
+    Read the marks of ``db_tables`` from the database, refreshing the registry with
+    those of every journaled table on the way, and return them.
+    """
+    tables = list(dict.fromkeys([*journaled_tables(), *db_tables]))
+    marks = dict(zip(tables, high_water_marks(tables)))
+    if registry_path() is not None:
+        write(marks)
+    return [marks[db_table] for db_table in db_tables]
+
+
+def refresh():
+    """Read the marks of every journaled table from the database and store them."""
+    if registry_path() is not None:
+        load([])
+
+
+def touch():
+    """
+    Refresh the registry once the current transaction commits, or right away
+    outside of one. Several calls in one transaction refresh it only once.
+    """
+    if registry_path() is None:
+        return
+    if not connection.in_atomic_block:
+        refresh()
+    elif not any(func is refresh for _, func, _ in connection.run_on_commit):
+        transaction.on_commit(refresh)
+
+
+def _touch_on_write(sender, **kwargs):
+    touch()
+
+
+def register(*models):
+    """Refresh the registry after every save and delete of ``models``."""
+    for model in models:
+        label = model._meta.label
+        post_save.connect(_touch_on_write, sender=model, dispatch_uid=f'watermarks.save.{label}')
+        post_delete.connect(_touch_on_write, sender=model, dispatch_uid=f'watermarks.delete.{label}')
@@ -84,9 +84,17 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    },
+    # Read replica of 'default' for pulls, kept fresh by manage.py sync_sqlite_replica
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db.replica.sqlite3',
+        'TEST': {'MIRROR': 'default'},
+    },
 }
 
+DATABASE_ROUTERS = ['watermelon_app.replica.ReplicaRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -128,3 +136,64 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Sync snapshots
+# Per-user first-sync payloads pre-rendered by build_sync_snapshots, served for
+# SYNC_SNAPSHOT_MAX_AGE seconds; build_sync_snapshots and compact_tombstones remove older ones
+
+SYNC_SNAPSHOT_DIR = BASE_DIR / 'sync_snapshots'
+
+SYNC_SNAPSHOT_MAX_AGE = 300
+
+
+# Sync watermarks
+# Memory-mapped file shared by the workers of a node, trusted for SYNC_WATERMARK_MAX_AGE
+# seconds after its last refresh. Set SYNC_WATERMARK_PATH to None to always ask the database.
+
+SYNC_WATERMARK_PATH = BASE_DIR / 'sync_watermarks.bin'
+
+SYNC_WATERMARK_MAX_AGE = 30
+
+
+# Tombstone compaction
+# Soft-deleted rows older than SYNC_TOMBSTONE_HORIZON seconds are hard-deleted by
+# manage.py compact_tombstones, SYNC_COMPACTION_BATCH_SIZE per transaction, after being
+# appended to SYNC_TOMBSTONE_ARCHIVE_DIR unless it is None. Pulls from before the
+# compacted tombstones are told to resync.
+
+SYNC_TOMBSTONE_HORIZON = 30 * 24 * 60 * 60
+
+SYNC_COMPACTION_BATCH_SIZE = 500
+
+SYNC_TOMBSTONE_ARCHIVE_DIR = None
+
+
+# Record owners
+# Projects and tasks created before pulls were scoped to their user are given to the user
+# whose primary key is SYNC_LEGACY_OWNER by migration watermelon_app 0007, which refuses
+# to run while such rows exist and it is None.
+
+SYNC_LEGACY_OWNER = None
+
+
+# Read replica
+# Pulls read from the SYNC_REPLICA_DATABASE alias when SYNC_READ_FROM_REPLICA is set,
+# unless its copy is older than SYNC_REPLICA_MAX_LAG seconds. A device that pushed reads
+# from the primary for SYNC_REPLICA_STICKY_SECONDS; the pins are kept in the primary database.
+
+SYNC_REPLICA_DATABASE = 'replica'
+
+SYNC_READ_FROM_REPLICA = False
+
+SYNC_REPLICA_MAX_LAG = 60
+
+SYNC_REPLICA_STICKY_SECONDS = 30
+
+
+# Push inserts
+# With SYNC_SINGLE_PASS_PUSH, the records created by a push are inserted with their foreign
+# keys in place and checked at commit, on databases that can defer the checks (SQLite and
+# PostgreSQL). Otherwise keys closing a reference cycle are set by a second write.
+
+SYNC_SINGLE_PASS_PUSH = True
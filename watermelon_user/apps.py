@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class WatermelonUserConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'watermelon_user'
+
+    def ready(self):
+        from watermelon_app import registry
+        from .serializers import StudentProfileSerializer, UserSerializer
+        # Accounts are never hard-deleted by sync compaction
+        registry.register('users', self.get_model('User'), UserSerializer, compacted=False)
+        registry.register('student_profiles', self.get_model('StudentProfile'), StudentProfileSerializer)
@@ -0,0 +1,30 @@
+# Generated by Django 5.1.6 on 2026-10-16 10:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('watermelon_user', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='studentprofile',
+            options={},
+        ),
+        migrations.AlterModelOptions(
+            name='user',
+            options={},
+        ),
+        migrations.AddIndex(
+            model_name='studentprofile',
+            index=models.Index(fields=['updated_at', 'id'], name='studentprofile_sync_cursor_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['updated_at', 'id'], name='user_sync_cursor_idx'),
+        ),
+    ]
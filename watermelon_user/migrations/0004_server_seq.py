@@ -0,0 +1,41 @@
+# Generated by Django 5.1.6 on 2026-10-16 10:40
+
+from django.db import migrations, models
+
+
+def backfill_server_seq(apps, schema_editor):
+    # Same first value as the watermelon_app tables, which creates the counter
+    for name in ('User', 'StudentProfile'):
+        apps.get_model('watermelon_user', name).objects.update(server_seq=1, created_seq=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('watermelon_app', '0004_server_seq'),
+        ('watermelon_user', '0003_sync_pull_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='studentprofile',
+            name='created_seq',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='studentprofile',
+            name='server_seq',
+            field=models.BigIntegerField(db_index=True, default=0),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='created_seq',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='server_seq',
+            field=models.BigIntegerField(db_index=True, default=0),
+        ),
+        migrations.RunPython(backfill_server_seq, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.1.6 on 2026-10-16 10:43
+
+from django.db import migrations
+
+# Frozen copy of the journal triggers as this migration installs them, independent of
+# later changes to watermelon_app.journal
+JOURNAL_INSERT = 'INSERT INTO "watermelon_app_changejournal" ("table", "record_id", "op", "device_id") VALUES'
+DEVICE = '(SELECT "device_id" FROM "watermelon_app_journaldevice" LIMIT 1)'
+TABLES = ('watermelon_user_user', 'watermelon_user_studentprofile')
+
+
+def trigger_sql(table, vendor):
+    if vendor == 'postgresql':
+        return [
+            f'DROP TRIGGER IF EXISTS "{table}_journal" ON "{table}"',
+            f'CREATE TRIGGER "{table}_journal" AFTER INSERT OR UPDATE OR DELETE ON "{table}" '
+            f'FOR EACH ROW EXECUTE FUNCTION "watermelon_journal"(\'id\')',
+        ]
+    return [
+        f'CREATE TRIGGER IF NOT EXISTS "{table}_journal_insert" AFTER INSERT ON "{table}" BEGIN '
+        f"{JOURNAL_INSERT} ('{table}', NEW.\"id\", 'c', {DEVICE}); END",
+        f'CREATE TRIGGER IF NOT EXISTS "{table}_journal_update" AFTER UPDATE ON "{table}" BEGIN '
+        f"{JOURNAL_INSERT} ('{table}', NEW.\"id\", "
+        f"CASE WHEN NEW.\"deleted_at\" IS NOT NULL THEN 'd' ELSE 'u' END, {DEVICE}); END",
+        f'CREATE TRIGGER IF NOT EXISTS "{table}_journal_delete" AFTER DELETE ON "{table}" BEGIN '
+        f"{JOURNAL_INSERT} ('{table}', OLD.\"id\", 'd', {DEVICE}); END",
+    ]
+
+
+def create_triggers(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor not in ('sqlite', 'postgresql'):
+        return
+    for table in TABLES:
+        for sql in trigger_sql(table, vendor):
+            schema_editor.execute(sql)
+
+
+def remove_triggers(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    for table in TABLES:
+        if vendor == 'postgresql':
+            schema_editor.execute(f'DROP TRIGGER IF EXISTS "{table}_journal" ON "{table}"')
+        elif vendor == 'sqlite':
+            for op in ('insert', 'update', 'delete'):
+                schema_editor.execute(f'DROP TRIGGER IF EXISTS "{table}_journal_{op}"')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('watermelon_app', '0005_change_journal'),
+        ('watermelon_user', '0004_server_seq'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_triggers, remove_triggers),
+    ]
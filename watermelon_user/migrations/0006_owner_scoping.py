@@ -0,0 +1,61 @@
+# Generated by Django 5.1.6 on 2026-10-16 11:30
+
+import watermelon_user.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('watermelon_user', '0005_change_journal_triggers'),
+    ]
+
+    operations = [
+        migrations.AlterModelManagers(
+            name='user',
+            managers=[
+                ('objects', watermelon_user.models.OwnedUserManager()),
+            ],
+        ),
+        migrations.RemoveIndex(
+            model_name='studentprofile',
+            name='studentprofile_sync_cursor_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='studentprofile',
+            name='profile_live_created_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='studentprofile',
+            name='profile_live_updated_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='studentprofile',
+            name='profile_tombstone_idx',
+        ),
+        migrations.AlterField(
+            model_name='studentprofile',
+            name='server_seq',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='studentprofile',
+            index=models.Index(fields=['user', 'updated_at', 'id'], name='profile_owner_cursor_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='studentprofile',
+            index=models.Index(condition=models.Q(('deleted_at__isnull', True)), fields=['user', 'created_at'], name='profile_owner_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='studentprofile',
+            index=models.Index(condition=models.Q(('deleted_at__isnull', True)), fields=['user', 'updated_at', 'created_at'], name='profile_owner_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='studentprofile',
+            index=models.Index(condition=models.Q(('deleted_at__isnull', False)), fields=['user', 'deleted_at', 'id'], name='profile_owner_tombstone_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='studentprofile',
+            index=models.Index(fields=['user', 'server_seq'], name='profile_owner_seq_idx'),
+        ),
+    ]
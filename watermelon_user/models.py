@@ -1,15 +1,35 @@
 from django.db import models
-from django.contrib.auth.models import AbstractUser
+from django.db.models import Q
+from django.contrib.auth.models import AbstractUser, UserManager
 import uuid
+from watermelon_app.models import OwnedQuerySet
+
+class OwnedUserManager(UserManager.from_queryset(OwnedQuerySet)):
+    pass
+
 
 class User(AbstractUser):
     uuid = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     deleted_at = models.DateTimeField(null=True, blank=True)
+    server_seq = models.BigIntegerField(default=0, db_index=True)
+    created_seq = models.BigIntegerField(default=0)
+
+    objects = OwnedUserManager()
+    # A user owns its own row only
+    owner_field = 'pk'
 
     class Meta:
-        ordering = ['created_at']
+        indexes = [
+            # Keyset order of paginated pulls
+            models.Index(fields=['updated_at', 'id'], name='user_sync_cursor_idx'),
+            # Created and updated rows of a pull, among live rows only
+            models.Index(fields=['created_at'], name='user_live_created_idx', condition=Q(deleted_at__isnull=True)),
+            models.Index(fields=['updated_at', 'created_at'], name='user_live_updated_idx', condition=Q(deleted_at__isnull=True)),
+            # Tombstones of a pull, covering the id list it reads
+            models.Index(fields=['deleted_at', 'id'], name='user_tombstone_idx', condition=Q(deleted_at__isnull=False)),
+        ]
         
         
 class StudentProfile(models.Model):
@@ -19,6 +39,24 @@ class StudentProfile(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     deleted_at = models.DateTimeField(null=True, blank=True)
+    server_seq = models.BigIntegerField(default=0)
+    created_seq = models.BigIntegerField(default=0)
+
+    objects = OwnedQuerySet.as_manager()
+    owner_field = 'user'
 
     class Meta:
-        ordering = ['created_at']
\ No newline at end of file
+        # Every pull is scoped to one user, so each index leads with it
+        indexes = [
+            # Keyset order of paginated pulls
+            models.Index(fields=['user', 'updated_at', 'id'], name='profile_owner_cursor_idx'),
+            # Created and updated rows of a pull, among live rows only
+            models.Index(fields=['user', 'created_at'], name='profile_owner_created_idx', condition=Q(deleted_at__isnull=True)),
+            models.Index(fields=['user', 'updated_at', 'created_at'], name='profile_owner_updated_idx', condition=Q(deleted_at__isnull=True)),
+            # Tombstones of a pull, covering the id list it reads
+            models.Index(fields=['user', 'deleted_at', 'id'], name='profile_owner_tombstone_idx', condition=Q(deleted_at__isnull=False)),
+            # Sequence pulls
+            models.Index(fields=['user', 'server_seq'], name='profile_owner_seq_idx'),
+            # Tombstones by age, read by compaction
+            models.Index(fields=['deleted_at'], name='profile_tombstone_age_idx', condition=Q(deleted_at__isnull=False)),
+        ]
@@ -1,3 +1,97 @@
-from django.test import TestCase
+# myapp/tests.py
+import uuid
 
-# Create your tests here.
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from watermelon_app.planner import plan_push
+from watermelon_app.records import encoder_for
+
+from .models import StudentProfile, User
+from .serializers import StudentProfileSerializer, UserSerializer
+from .views import UserProfileSyncView
+
+
+class ProfilePushTests(TestCase):
+    """Pushes of student profiles, which reference their user."""
+
+    def setUp(self):
+        self.user = User.objects.create(username='profiles')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def push_profiles(self, size, queries):
+        profiles = [str(uuid.uuid4()) for _ in range(size)]
+        with self.assertNumQueries(queries):
+            response = self.client.post('/user/sync/', {'changes': {'student_profiles': {'created': [
+                {'id': profile, 'user': self.user.pk, 'bio': 'b'} for profile in profiles
+            ]}}}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(StudentProfile.objects.filter(pk__in=profiles, user=self.user).count(), size)
+
+    def test_plan(self):
+        changes = {'users': {'created': [{}]}, 'student_profiles': {'created': [{}]}}
+        plan = plan_push(UserProfileSyncView.sync_tables, changes)
+        self.assertEqual([(table.name, deferred) for table, deferred, _ in plan.inserts], [
+            ('users', ()), ('student_profiles', ()),
+        ])
+        self.assertEqual(plan.fixups, ())
+
+    def assert_count(self, queries):
+        for size in (1, 20):
+            with self.subTest(size=size):
+                self.push_profiles(size, queries)
+
+    @override_settings(SYNC_SINGLE_PASS_PUSH=True)
+    def test_single_pass_query_count(self):
+        self.assert_count(22)
+
+    @override_settings(SYNC_SINGLE_PASS_PUSH=False)
+    def test_fixup_pass_query_count(self):
+        self.assert_count(21)
+
+
+class UserPushTests(TestCase):
+    """A user syncs their own row only."""
+
+    def setUp(self):
+        self.user = User.objects.create(username='self')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_create_rejected(self):
+        response = self.client.post('/user/sync/', {'changes': {'users': {'created': [
+            {'id': 999, 'username': 'evil'}, {'username': 'evil2'},
+        ]}}}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(response.json()['errors']), 2)
+        self.assertFalse(User.objects.filter(username__startswith='evil').exists())
+
+    def test_create_rejected_alongside_profiles(self):
+        profile = str(uuid.uuid4())
+        response = self.client.post('/user/sync/', {'changes': {
+            'users': {'created': [{'username': 'evil'}]},
+            'student_profiles': {'created': [{'id': profile, 'user': self.user.pk, 'bio': 'b'}]},
+        }}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(User.objects.filter(username='evil').exists())
+        self.assertTrue(StudentProfile.objects.filter(pk=profile, user=self.user).exists())
+
+
+class RecordEncoderTests(TestCase):
+    """Encoded users and profiles render to the same JSON as their serializers' data."""
+
+    def test_matches_serializer(self):
+        user = User.objects.create(username='encoded', email='e@example.com', first_name='É')
+        User.objects.create(username='deleted', deleted_at=timezone.now())
+        StudentProfile.objects.create(user=user, bio='b')
+        renderer = JSONRenderer()
+        for serializer_class in (UserSerializer, StudentProfileSerializer):
+            with self.subTest(serializer=serializer_class.__name__):
+                queryset = serializer_class.Meta.model.objects.order_by('pk')
+                self.assertEqual(
+                    renderer.render(encoder_for(serializer_class).records(queryset)),
+                    renderer.render(serializer_class(queryset, many=True).data),
+                )
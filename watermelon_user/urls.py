@@ -1,6 +1,7 @@
 from django.urls import path
-from .views import UserProfileSyncView
+from .views import AsyncUserProfileSyncView, UserProfileSyncView
 
 urlpatterns = [
     path('sync/', UserProfileSyncView.as_view(), name='sync'),
+    path('sync/async/', AsyncUserProfileSyncView.as_view(), name='sync-async'),
 ]
\ No newline at end of file